@@ -0,0 +1,81 @@
+import asyncio
+import json
+import random
+import re
+import threading
+
+from aiohttp import web
+
+
+class MockLLMServer:
+    """
+    Local OpenAI-compatible chat completions server with configurable latency.
+
+    Answers single-book prompts with a JSON object and "### Book N" batch prompts with a JSON array,
+    and reports usage so the client's token accounting and metrics behave as against the real API.
+    Runs on its own event loop thread; `base_url` is set once `start()` returns.
+    """
+
+    def __init__(self, latency=0.2, jitter=0.05, error_rate=0.0, host="127.0.0.1", port=0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.host = host
+        self.port = port
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.base_url = None
+        self.loop = None
+        self.runner = None
+        self.ready = threading.Event()
+
+    async def chat_completions(self, request):
+        self.requests += 1
+        body = await request.json()
+        prompt = body["messages"][-1]["content"]
+        await asyncio.sleep(max(self.latency + self.random.uniform(-self.jitter, self.jitter), 0))
+        if self.random.random() < self.error_rate:
+            return web.Response(status=429, headers={"Retry-After": "0.1"}, text="rate limited")
+
+        books = re.findall(r"^### Book (\d+)", prompt, re.MULTILINE)
+        answers = [
+            {"title": f"Synthetic Handbook {index}", "authors": ["Jane Benchmark"], "language": "English"}
+            for index in (books or ["0"])
+        ]
+        content = json.dumps(answers if books else answers[0])
+        prompt_tokens = len(prompt) // 4 + 1
+        completion_tokens = len(content) // 4 + 1
+        return web.json_response({
+            "choices": [{"message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        })
+
+    def _serve(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        self.runner = web.AppRunner(app)
+        self.loop.run_until_complete(self.runner.setup())
+        site = web.TCPSite(self.runner, self.host, self.port)
+        self.loop.run_until_complete(site.start())
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{self.host}:{port}/v1"
+        self.ready.set()
+        self.loop.run_forever()
+
+    def start(self):
+        threading.Thread(target=self._serve, name="mock-llm", daemon=True).start()
+        self.ready.wait(10)
+        return self.base_url
+
+    def stop(self):
+        if self.loop is None:
+            return
+        future = asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop)
+        future.result(10)
+        self.loop.call_soon_threadsafe(self.loop.stop)
@@ -0,0 +1,317 @@
+"""
+End-to-end benchmark of the processing pipeline and the upload route against a mock LLM server.
+
+    python -m benchmarks.run --pages 10,100,500,2000 --mixes text,mixed --runs 5 --latency 0.3
+    python -m benchmarks.run --compare benchmarks/results/<old-commit>.json
+
+Synthetic PDFs are generated into a scratch directory, which is also the working directory for the
+run, so the uploaded/processed folders, caches and databases of a real deployment are never touched.
+Results (throughput, p50/p95/p99 latency, peak RSS and mean per-stage time per scenario) are written
+as JSON, by default to benchmarks/results/<commit>.json, so runs on different commits can be compared.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.mock_llm import MockLLMServer
+from benchmarks.synthetic import SyntheticPDF
+
+# Share of body pages drawn as images for each named mix
+MIXES = {"text": 0.0, "mixed": 0.3, "images": 0.9}
+
+
+def percentile(values, fraction):
+    # Nearest-rank percentile; good enough for the handful of runs a scenario has
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = max(int(round(fraction * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def summarize(name, latencies, sizes, pages, wall_seconds, stage_timings, llm_requests, errors):
+    stages = {}
+    for timings in stage_timings:
+        for stage, seconds in timings.items():
+            stages.setdefault(stage, []).append(seconds)
+    return {
+        "name": name,
+        "runs": len(latencies),
+        "errors": errors,
+        "pages": pages,
+        "file_bytes": round(sum(sizes) / len(sizes)) if sizes else 0,
+        "latency_seconds": {
+            "mean": round(sum(latencies) / len(latencies), 4) if latencies else None,
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+        },
+        "throughput": {
+            "files_per_second": round(len(latencies) / wall_seconds, 3) if wall_seconds else None,
+            "pages_per_second": round(len(latencies) * pages / wall_seconds, 1) if wall_seconds else None,
+            "mb_per_second": round(sum(sizes) / (1024 * 1024) / wall_seconds, 2) if wall_seconds else None,
+        },
+        "stage_seconds": {stage: round(sum(values) / len(values), 4) for stage, values in sorted(stages.items())},
+        "llm_requests": llm_requests,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+class BenchmarkRunner:
+    def __init__(self, args, workdir, server):
+        self.args = args
+        self.workdir = workdir
+        self.server = server
+        self.corpus_dir = os.path.join(workdir, "corpus")
+        os.makedirs(self.corpus_dir, exist_ok=True)
+        self.seed = 0
+        self.devnull = open(os.devnull, "w")
+
+    def corpus(self, pages, mix):
+        # A fresh book per run: identical text would be answered from the metadata cache
+        books = []
+        for _ in range(self.args.runs):
+            self.seed += 1
+            path = os.path.join(self.corpus_dir, f"book-{self.seed}-{pages}p-{mix}.pdf")
+            size = SyntheticPDF(
+                pages=pages, image_ratio=MIXES[mix], image_size=self.args.image_size,
+                image_cover=not self.args.text_cover, seed=self.seed,
+            ).write(path)
+            books.append((path, size))
+        return books
+
+    def quiet(self):
+        # The pipeline prints its progress; keep it out of the benchmark output unless asked for
+        if self.args.verbose:
+            return contextlib.nullcontext()
+        return contextlib.redirect_stdout(self.devnull)
+
+    def run_pipeline(self, pages, mix):
+        from pdf_manager.manager import PDFManager
+        from pdf_manager.metrics import collect_timings
+
+        books = self.corpus(pages, mix)
+        latencies, stage_timings, errors = [], [], 0
+        requests_before = self.server.requests
+        started = time.perf_counter()
+        for path, _ in books:
+            with self.quiet(), collect_timings() as timings:
+                run_started = time.perf_counter()
+                try:
+                    PDFManager(path, n_pages=self.args.n_pages).process_pdf()
+                except Exception as e:
+                    errors += 1
+                    print(f"Error processing {path}: {e}", file=sys.stderr)
+                    continue
+                latencies.append(round(time.perf_counter() - run_started, 4))
+            stage_timings.append(dict(timings))
+        wall_seconds = time.perf_counter() - started
+        return summarize(
+            f"pipeline/{pages}p/{mix}", latencies, [size for _, size in books], pages, wall_seconds,
+            stage_timings, self.server.requests - requests_before, errors,
+        )
+
+    def run_api(self, client, pages, mix):
+        books = self.corpus(pages, mix)
+        latencies, stage_timings, errors = [], [], 0
+        requests_before = self.server.requests
+        started = time.perf_counter()
+        for path, _ in books:
+            with self.quiet(), open(path, "rb") as file:
+                run_started = time.perf_counter()
+                response = client.post(
+                    "/pdf/pdf-upload-and-process",
+                    params={"n_pages": self.args.n_pages, "timing": "true"},
+                    files={"file": (os.path.basename(path), file, "application/pdf")},
+                    headers={"api-key": os.environ["GCP_API_KEY"]},
+                )
+                latency = round(time.perf_counter() - run_started, 4)
+            if response.status_code != 200:
+                errors += 1
+                print(f"Error uploading {path}: {response.status_code} {response.text}", file=sys.stderr)
+                continue
+            latencies.append(latency)
+            stage_timings.append(response.json().get("timings") or {})
+        wall_seconds = time.perf_counter() - started
+        return summarize(
+            f"api/{pages}p/{mix}", latencies, [size for _, size in books], pages, wall_seconds,
+            stage_timings, self.server.requests - requests_before, errors,
+        )
+
+    def run(self):
+        from fastapi.testclient import TestClient
+
+        scenarios = []
+        # Smallest books first so the RSS high-water mark of each scenario is attributable to it
+        matrix = [(pages, mix) for pages in sorted(self.args.pages) for mix in self.args.mixes]
+        if "pipeline" in self.args.modes:
+            for pages, mix in matrix:
+                scenarios.append(self.run_pipeline(pages, mix))
+                print(format_scenario(scenarios[-1]))
+        if "api" in self.args.modes:
+            import main
+
+            with TestClient(main.app) as client:
+                for pages, mix in matrix:
+                    scenarios.append(self.run_api(client, pages, mix))
+                    print(format_scenario(scenarios[-1]))
+        return scenarios
+
+
+def format_scenario(scenario):
+    latency = scenario["latency_seconds"]
+    stages = ", ".join(f"{stage}={seconds:.3f}" for stage, seconds in scenario["stage_seconds"].items())
+    return (
+        f"{scenario['name']:<28} p50={latency['p50']}s p95={latency['p95']}s p99={latency['p99']}s "
+        f"{scenario['throughput']['files_per_second']} files/s rss={scenario['peak_rss_mb']}MB "
+        f"llm={scenario['llm_requests']} errors={scenario['errors']}\n    {stages}"
+    )
+
+
+def compare(current, baseline_path, threshold):
+    """
+    Print latency and throughput changes against an earlier result file; return the regressed scenarios.
+    """
+    with open(baseline_path) as file:
+        baseline = {scenario["name"]: scenario for scenario in json.load(file)["scenarios"]}
+    regressions = []
+    print(f"\nCompared with {baseline_path} (regression threshold {threshold:.0%}):")
+    for scenario in current:
+        previous = baseline.get(scenario["name"])
+        if previous is None:
+            continue
+        changes = []
+        for key in ("p50", "p95"):
+            old, new = previous["latency_seconds"][key], scenario["latency_seconds"][key]
+            if old and new is not None:
+                change = (new - old) / old
+                changes.append(f"{key} {change:+.1%}")
+                if change > threshold:
+                    regressions.append(f"{scenario['name']} {key}")
+        old, new = previous["throughput"]["files_per_second"], scenario["throughput"]["files_per_second"]
+        if old and new is not None:
+            change = (new - old) / old
+            changes.append(f"throughput {change:+.1%}")
+            if change < -threshold:
+                regressions.append(f"{scenario['name']} throughput")
+        print(f"  {scenario['name']:<28} " + ", ".join(changes))
+    if regressions:
+        print("Regressions: " + ", ".join(regressions))
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark PDF processing end to end against a mock LLM server.")
+    parser.add_argument("--pages", type=lambda value: [int(item) for item in value.split(",")], default=[10, 100, 500, 2000],
+                        help="Comma-separated page counts (default 10,100,500,2000).")
+    parser.add_argument("--mixes", type=lambda value: value.split(","), default=["text", "mixed"],
+                        help=f"Comma-separated text/image mixes from {', '.join(MIXES)} (default text,mixed).")
+    parser.add_argument("--image-size", type=int, default=256, help="Side of the synthetic images in pixels.")
+    parser.add_argument("--text-cover", action="store_true", help="Give the first page text instead of an image-only cover.")
+    parser.add_argument("--runs", type=int, default=5, help="Books processed per scenario.")
+    parser.add_argument("--n-pages", type=int, default=5, help="n_pages passed to the pipeline.")
+    parser.add_argument("--modes", type=lambda value: value.split(","), default=["pipeline", "api"],
+                        help="Comma-separated modes: pipeline (PDFManager.process_pdf), api (upload route).")
+    parser.add_argument("--latency", type=float, default=0.2, help="Mean mock LLM latency in seconds.")
+    parser.add_argument("--jitter", type=float, default=0.05, help="Uniform jitter around the mock LLM latency.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of mock LLM requests answered with 429.")
+    parser.add_argument("--output", help="Result file (default benchmarks/results/<commit>.json).")
+    parser.add_argument("--compare", help="Earlier result file to compare against; exits non-zero on regressions.")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative change counted as a regression.")
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch directory with the corpus and outputs.")
+    parser.add_argument("--verbose", action="store_true", help="Show the pipeline's own output.")
+    args = parser.parse_args(argv)
+    unknown = [mix for mix in args.mixes if mix not in MIXES]
+    if unknown:
+        parser.error(f"Unknown mixes: {', '.join(unknown)}")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    commit = git_commit()
+    output = os.path.abspath(args.output or os.path.join(REPO_ROOT, "benchmarks", "results", f"{commit or 'local'}.json"))
+    compare_path = os.path.abspath(args.compare) if args.compare else None
+
+    server = MockLLMServer(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate)
+    base_url = server.start()
+    os.environ.setdefault("GCP_API_KEY", "benchmark")
+
+    workdir = tempfile.mkdtemp(prefix="kindlecloud-bench-")
+    previous_dir = os.getcwd()
+    os.chdir(workdir)
+    try:
+        import config
+        from pdf_manager import llm_client
+
+        llm_client.set_llm_client(llm_client.LLMClient(
+            llm_client.OpenAIBackend("benchmark", base_url=base_url, timeout=config.LLM_TIMEOUT_SECONDS),
+            requests_per_minute=config.LLM_REQUESTS_PER_MINUTE,
+            tokens_per_minute=config.LLM_TOKENS_PER_MINUTE,
+            max_in_flight=config.LLM_MAX_IN_FLIGHT,
+            max_retries=config.LLM_MAX_RETRIES,
+        ))
+        started = time.time()
+        scenarios = BenchmarkRunner(args, workdir, server).run()
+        llm_client.close_llm_client()
+    finally:
+        os.chdir(previous_dir)
+        server.stop()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    result = {
+        "commit": commit,
+        "created_at": started,
+        "duration_seconds": round(time.time() - started, 1),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "settings": {
+            "pages": args.pages, "mixes": args.mixes, "image_size": args.image_size, "runs": args.runs,
+            "n_pages": args.n_pages, "modes": args.modes, "latency": args.latency, "jitter": args.jitter,
+            "error_rate": args.error_rate, "text_cover": args.text_cover,
+        },
+        "scenarios": scenarios,
+    }
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(result, file, indent=2)
+    print(f"\nResults written to {output}")
+    if args.keep:
+        print(f"Scratch directory kept at {workdir}")
+
+    if compare_path and compare(scenarios, compare_path, args.threshold):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
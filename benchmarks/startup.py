@@ -0,0 +1,197 @@
+"""
+Cold-start benchmark: import time of the app broken down by module, and time to the first responses.
+
+    python -m benchmarks.startup --runs 5 --modes eager,lazy
+    python -m benchmarks.startup --compare benchmarks/results/startup-<old-commit>.json
+
+Every run starts a fresh interpreter with -X importtime in a scratch working directory, imports main,
+starts the app and times a /health and a /pdf request. Import time is attributed to top-level packages
+by the self time of their modules, so the packages add up to the whole import. Medians over the runs are
+written as JSON, by default to benchmarks/results/startup-<commit>.json, so commits can be compared.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.run import git_commit
+
+# Runs inside the measured interpreter; prints its timings as JSON on the last line of stdout
+PROBE = """
+import json, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+headers = {"api-key": "benchmark"}
+with TestClient(main.app) as client:
+    ready = time.perf_counter()
+    client.get("/health/", headers=headers)
+    health = time.perf_counter()
+    client.get("/pdf/pdf-list", headers=headers)
+    pdf = time.perf_counter()
+print(json.dumps({
+    "import_seconds": imported - started,
+    "startup_seconds": ready - imported,
+    "first_health_seconds": health - ready,
+    "first_pdf_seconds": pdf - health,
+}))
+"""
+
+TIMINGS = ("import_seconds", "startup_seconds", "first_health_seconds", "first_pdf_seconds")
+
+
+def parse_importtime(stderr):
+    """
+    Self and cumulative microseconds per module from -X importtime output.
+    """
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def run_once(mode, workdir, prewarm):
+    env = {
+        **os.environ,
+        "PYTHONPATH": REPO_ROOT,
+        "GCP_API_KEY": "benchmark",
+        "STARTUP_MODE": mode,
+        "STARTUP_PREWARM": "true" if prewarm else "false",
+    }
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE],
+        cwd=workdir, env=env, capture_output=True, text=True, check=True,
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1]), parse_importtime(completed.stderr)
+
+
+def summarize(mode, runs, top):
+    timings = {key: round(statistics.median(run[0][key] for run in runs), 4) for key in TIMINGS}
+    by_module = {}
+    for _, modules in runs:
+        for name, (self_us, _) in modules.items():
+            by_module.setdefault(name, []).append(self_us)
+    module_seconds = {name: statistics.median(values) / 1e6 for name, values in by_module.items()}
+    packages = {}
+    for name, seconds in module_seconds.items():
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0) + seconds
+    return {
+        "name": mode,
+        "runs": len(runs),
+        **timings,
+        "modules_imported": round(statistics.median(len(modules) for _, modules in runs)),
+        "packages": {name: round(seconds, 4) for name, seconds in sorted(packages.items(), key=lambda item: -item[1])[:top]},
+        "slowest_modules": {
+            name: round(seconds, 4) for name, seconds in sorted(module_seconds.items(), key=lambda item: -item[1])[:top]
+        },
+    }
+
+
+def format_scenario(scenario):
+    packages = ", ".join(f"{name}={seconds:.3f}" for name, seconds in list(scenario["packages"].items())[:8])
+    return (
+        f"{scenario['name']:<8} import={scenario['import_seconds']:.3f}s startup={scenario['startup_seconds']:.3f}s "
+        f"first /health={scenario['first_health_seconds']:.3f}s first /pdf={scenario['first_pdf_seconds']:.3f}s "
+        f"modules={scenario['modules_imported']}\n    {packages}"
+    )
+
+
+def compare(current, baseline_path, threshold, min_seconds):
+    """
+    Print timing and per-package import changes against an earlier result file; return the regressions.
+    Changes smaller than min_seconds are ignored as noise.
+    """
+    with open(baseline_path) as file:
+        baseline = {scenario["name"]: scenario for scenario in json.load(file)["scenarios"]}
+    regressions = []
+    print(f"\nCompared with {baseline_path} (regression threshold {threshold:.0%}, at least {min_seconds}s):")
+    for scenario in current:
+        previous = baseline.get(scenario["name"])
+        if previous is None:
+            continue
+        pairs = [(key, previous.get(key), scenario[key]) for key in TIMINGS]
+        pairs += [
+            (f"import {name}", previous["packages"].get(name, 0), seconds) for name, seconds in scenario["packages"].items()
+        ]
+        changes = []
+        for label, old, new in pairs:
+            if old is None:
+                continue
+            if old:
+                changes.append(f"{label} {(new - old) / old:+.1%}")
+            if new - old > min_seconds and (not old or (new - old) / old > threshold):
+                regressions.append(f"{scenario['name']} {label}")
+        print(f"  {scenario['name']:<8} " + ", ".join(changes[:len(TIMINGS)]))
+    if regressions:
+        print("Regressions: " + ", ".join(regressions))
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the server's cold start: import time by module and first responses.")
+    parser.add_argument("--modes", type=lambda value: value.split(","), default=["eager", "lazy"],
+                        help="Comma-separated STARTUP_MODE values (default eager,lazy).")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters started per mode.")
+    parser.add_argument("--prewarm", action="store_true", help="Pre-warm routers in the background in lazy mode.")
+    parser.add_argument("--top", type=int, default=20, help="Packages and modules listed per mode.")
+    parser.add_argument("--output", help="Result file (default benchmarks/results/startup-<commit>.json).")
+    parser.add_argument("--compare", help="Earlier result file to compare against; exits non-zero on regressions.")
+    parser.add_argument("--threshold", type=float, default=0.15, help="Relative change counted as a regression.")
+    parser.add_argument("--min-seconds", type=float, default=0.01, help="Smallest absolute change counted as a regression.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    commit = git_commit()
+    output = os.path.abspath(args.output or os.path.join(REPO_ROOT, "benchmarks", "results", f"startup-{commit or 'local'}.json"))
+
+    started = time.time()
+    scenarios = []
+    for mode in args.modes:
+        runs = []
+        for _ in range(args.runs):
+            # A fresh directory per run so no database or upload folder is left from the previous one
+            workdir = tempfile.mkdtemp(prefix="kindlecloud-startup-")
+            try:
+                runs.append(run_once(mode, workdir, args.prewarm))
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+        scenarios.append(summarize(mode, runs, args.top))
+        print(format_scenario(scenarios[-1]))
+
+    result = {
+        "commit": commit,
+        "created_at": started,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {"modes": args.modes, "runs": args.runs, "prewarm": args.prewarm},
+        "scenarios": scenarios,
+    }
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(result, file, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare and compare(scenarios, os.path.abspath(args.compare), args.threshold, args.min_seconds):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+import os
+import random
+import zlib
+
+PAGE_WIDTH, PAGE_HEIGHT = 612, 792
+
+LOREM = (
+    "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore "
+    "et dolore magna aliqua ut enim ad minim veniam quis nostrud exercitation ullamco laboris nisi ut "
+    "aliquip ex ea commodo consequat duis aute irure dolor in reprehenderit in voluptate velit esse"
+).split()
+
+
+def _escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def _text_stream(lines, size=11, top=740):
+    commands = [f"BT /F1 {size} Tf {size + 3} TL 72 {top} Td"]
+    for line in lines:
+        commands.append(f"({_escape(line)}) '")
+    commands.append("ET")
+    return "\n".join(commands).encode("latin-1")
+
+
+def _image_stream(name):
+    return f"q {PAGE_WIDTH - 144} 0 0 {PAGE_HEIGHT - 144} 72 72 cm /{name} Do Q".encode("latin-1")
+
+
+def _body_lines(rng, count=40, words=12):
+    return [" ".join(rng.choice(LOREM) for _ in range(words)) for _ in range(count)]
+
+
+def _front_matter(book_id):
+    # What a real title and copyright page carries, so page selection and local extraction have work to do
+    return {
+        "title": [f"The Synthetic Handbook {book_id}", "", "by Jane Benchmark and John Baseline"],
+        "copyright": [
+            "Copyright (c) 2021 Jane Benchmark. All rights reserved.",
+            "Published by Example Press, New York.",
+            "Second edition",
+            "ISBN 978-0-306-40615-7",
+            f"Library of Congress Control Number: 2021{book_id:06d}",
+            "Printed in the United States of America",
+        ],
+    }
+
+
+class SyntheticPDF:
+    """
+    Writes an uncompressed-text PDF with a given page count and text/image mix, without any PDF library.
+
+    `image_ratio` is the share of body pages drawn as a single image, `image_size` the side of those images
+    in pixels (random bytes, so they barely compress and drive the file size), and `image_cover` makes the
+    first page image-only, like a scanned cover. No /Info title is written, so the LLM stage is exercised.
+    """
+
+    def __init__(self, pages=100, image_ratio=0.0, image_size=256, image_cover=True, seed=0, book_id=None):
+        self.pages = pages
+        self.image_ratio = image_ratio
+        self.image_size = image_size
+        self.image_cover = image_cover
+        self.seed = seed
+        self.book_id = book_id if book_id is not None else seed
+
+    def _image(self, rng):
+        raw = rng.randbytes(self.image_size * self.image_size * 3)
+        data = zlib.compress(raw, 1)
+        header = (
+            f"<< /Type /XObject /Subtype /Image /Width {self.image_size} /Height {self.image_size} "
+            f"/ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /FlateDecode /Length {len(data)} >>"
+        ).encode("latin-1")
+        return header, data
+
+    def write(self, path):
+        rng = random.Random(self.seed)
+        front = _front_matter(self.book_id)
+        objects = {}
+
+        # 1: catalog, 2: page tree, 3: font; pages and their resources follow
+        objects[3] = b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"
+        next_number = 4
+        page_numbers = []
+        for index in range(self.pages):
+            if index == 0 and self.image_cover:
+                content = None
+            elif index == 1:
+                content = _text_stream(front["title"], size=24, top=600)
+            elif index == 2:
+                content = _text_stream(front["copyright"])
+            elif rng.random() < self.image_ratio:
+                content = None
+            else:
+                content = _text_stream(_body_lines(rng))
+
+            resources = "/Font << /F1 3 0 R >>"
+            if content is None:
+                content = _image_stream("Im0")
+                header, data = self._image(rng)
+                objects[next_number] = (header, data)
+                resources += f" /XObject << /Im0 {next_number} 0 R >>"
+                next_number += 1
+
+            objects[next_number] = (f"<< /Length {len(content)} >>".encode("latin-1"), content)
+            content_number = next_number
+            next_number += 1
+            objects[next_number] = (
+                f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+                f"/Resources << {resources} >> /Contents {content_number} 0 R >>"
+            ).encode("latin-1")
+            page_numbers.append(next_number)
+            next_number += 1
+
+        objects[1] = b"<< /Type /Catalog /Pages 2 0 R >>"
+        kids = " ".join(f"{number} 0 R" for number in page_numbers)
+        objects[2] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_numbers)} >>".encode("latin-1")
+
+        offsets = {}
+        with open(path, "wb") as file:
+            file.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+            for number in range(1, next_number):
+                offsets[number] = file.tell()
+                body = objects[number]
+                file.write(f"{number} 0 obj\n".encode("latin-1"))
+                if isinstance(body, tuple):
+                    header, data = body
+                    file.write(header + b"\nstream\n" + data + b"\nendstream")
+                else:
+                    file.write(body)
+                file.write(b"\nendobj\n")
+            xref_offset = file.tell()
+            file.write(f"xref\n0 {next_number}\n0000000000 65535 f \n".encode("latin-1"))
+            for number in range(1, next_number):
+                file.write(f"{offsets[number]:010d} 00000 n \n".encode("latin-1"))
+            file.write(
+                f"trailer\n<< /Size {next_number} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode("latin-1")
+            )
+        return os.path.getsize(path)
@@ -0,0 +1,142 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Model used for metadata extraction; also part of the metadata cache key
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+
+# OpenAI-compatible endpoint; point OPENAI_BASE_URL at a local stand-in server for tests and benchmarks
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", "500"))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "200000"))
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "8"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "5"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+
+# Metadata cache: in-memory LRU tier in front of an on-disk SQLite tier
+METADATA_CACHE_PATH = os.getenv("METADATA_CACHE_PATH", "./cache/metadata_cache.sqlite3")
+METADATA_CACHE_MEMORY_ITEMS = int(os.getenv("METADATA_CACHE_MEMORY_ITEMS", "256"))
+METADATA_CACHE_MAX_BYTES = int(os.getenv("METADATA_CACHE_MAX_BYTES", str(50 * 1024 * 1024)))
+METADATA_CACHE_TTL_SECONDS = int(os.getenv("METADATA_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+
+# Background processing jobs
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "./data/jobs.sqlite3")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_QUEUE_DEPTH = int(os.getenv("JOB_QUEUE_DEPTH", "100"))
+# Job callbacks go to public http(s) hosts only; JOB_CALLBACK_ALLOWED_HOSTS (comma-separated) restricts them
+# to the listed hosts instead, which may then also be internal ones
+JOB_CALLBACK_ALLOWED_HOSTS = [
+    host.strip() for host in os.getenv("JOB_CALLBACK_ALLOWED_HOSTS", "").split(",") if host.strip()
+]
+
+# Memory-bounded processing: files of LARGE_FILE_BYTES or more, and files whose in-memory processing is
+# estimated above JOB_MEMORY_CEILING, are read through a memory map and written incrementally; running jobs
+# reserve their estimate (LARGE_FILE_JOB_MEMORY for large files) from JOB_MEMORY_BUDGET (0 disables)
+LARGE_FILE_BYTES = int(os.getenv("LARGE_FILE_BYTES", str(100 * 1024 * 1024)))
+LARGE_FILE_JOB_MEMORY = int(os.getenv("LARGE_FILE_JOB_MEMORY", str(128 * 1024 * 1024)))
+JOB_MEMORY_CEILING = int(os.getenv("JOB_MEMORY_CEILING", str(512 * 1024 * 1024)))
+JOB_MEMORY_BUDGET = int(os.getenv("JOB_MEMORY_BUDGET", str(JOB_WORKERS * JOB_MEMORY_CEILING)))
+
+# Local-first metadata: the LLM is only asked for fields whose local confidence is below the threshold,
+# and only when at least one of the required fields is among them
+LOCAL_METADATA_CONFIDENCE = float(os.getenv("LOCAL_METADATA_CONFIDENCE", "0.7"))
+LOCAL_METADATA_REQUIRED_FIELDS = [
+    field.strip() for field in os.getenv("LOCAL_METADATA_REQUIRED_FIELDS", "title,authors").split(",") if field.strip()
+]
+
+# Page text selection for the metadata prompt
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "1500"))
+PAGE_SIGNAL_TARGET = int(os.getenv("PAGE_SIGNAL_TARGET", "10"))
+
+# Batch processing: parsing/writing runs on a process pool, LLM requests group several books
+BATCH_PROCESS_WORKERS = int(os.getenv("BATCH_PROCESS_WORKERS", str(os.cpu_count() or 2)))
+LLM_BATCH_TOKEN_BUDGET = int(os.getenv("LLM_BATCH_TOKEN_BUDGET", "6000"))
+LLM_BATCH_MAX_BOOKS = int(os.getenv("LLM_BATCH_MAX_BOOKS", "8"))
+
+# Page text extraction: pages are extracted in the request's process, and only a book with at least
+# PAGE_TEXT_POOL_MIN_PAGES candidate pages has them extracted on the batch process pool, one wave of
+# PAGE_TEXT_WORKERS pages at a time, since every worker parses the PDF again. Text is cached per file hash and page
+PAGE_TEXT_WORKERS = int(os.getenv("PAGE_TEXT_WORKERS", str(BATCH_PROCESS_WORKERS)))
+PAGE_TEXT_POOL_MIN_PAGES = int(os.getenv("PAGE_TEXT_POOL_MIN_PAGES", "40"))
+PAGE_TEXT_CACHE_PATH = os.getenv("PAGE_TEXT_CACHE_PATH", "./cache/page_text.sqlite3")
+PAGE_TEXT_CACHE_MAX_BYTES = int(os.getenv("PAGE_TEXT_CACHE_MAX_BYTES", str(100 * 1024 * 1024)))
+
+# Near-duplicate detection: MinHash signatures of NEAR_DUPLICATE_SAMPLE_PAGES body pages (past the front matter,
+# which is much the same boilerplate in every book) are indexed with LSH, and a book whose estimated similarity to
+# a processed one reaches NEAR_DUPLICATE_THRESHOLD (0 disables) reuses its metadata; its title and ISBN only
+# when the sampled text is identical. Books are only looked up when local metadata leaves the LLM something to
+# ask, and are signed and indexed on a background thread after processing
+NEAR_DUPLICATE_DB_PATH = os.getenv("NEAR_DUPLICATE_DB_PATH", "./data/near_duplicates.sqlite3")
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.8"))
+NEAR_DUPLICATE_PERMUTATIONS = int(os.getenv("NEAR_DUPLICATE_PERMUTATIONS", "128"))
+NEAR_DUPLICATE_BANDS = int(os.getenv("NEAR_DUPLICATE_BANDS", "16"))
+NEAR_DUPLICATE_SAMPLE_PAGES = int(os.getenv("NEAR_DUPLICATE_SAMPLE_PAGES", "8"))
+
+# Output size budget: processed PDFs larger than OUTPUT_BYTE_BUDGET (0 disables) are optimized towards it,
+# downsampling images to OUTPUT_OPTIMIZE_DPI and then lower, down to OUTPUT_MIN_DPI, if lossless steps aren't enough
+OUTPUT_BYTE_BUDGET = int(os.getenv("OUTPUT_BYTE_BUDGET", "0"))
+OUTPUT_OPTIMIZE_DPI = int(os.getenv("OUTPUT_OPTIMIZE_DPI", "150"))
+OUTPUT_MIN_DPI = int(os.getenv("OUTPUT_MIN_DPI", "72"))
+
+# Cover pages are saved as a one-page PDF with only the resources they use; with COVER_THUMBNAIL_FORMAT
+# ("jpeg" or "png") a cover that is a single full-page image is saved as a thumbnail of at most
+# COVER_THUMBNAIL_SIZE pixels instead
+COVER_THUMBNAIL_FORMAT = os.getenv("COVER_THUMBNAIL_FORMAT", "").lower()
+COVER_THUMBNAIL_SIZE = int(os.getenv("COVER_THUMBNAIL_SIZE", "800"))
+COVER_THUMBNAIL_QUALITY = int(os.getenv("COVER_THUMBNAIL_QUALITY", "80"))
+
+# Library catalog backing the list, search and pdf-check endpoints
+CATALOG_DB_PATH = os.getenv("CATALOG_DB_PATH", "./data/catalog.sqlite3")
+
+# Retention: files in the upload and processed directories are indexed with their size and last access.
+# Every write evicts least recently used files beyond UPLOAD_QUOTA_BYTES / PROCESSED_QUOTA_BYTES (0 disables),
+# files older than RETENTION_MAX_AGE_DAYS are removed daily, and nothing accessed in the last
+# RETENTION_GRACE_SECONDS is evicted
+RETENTION_DB_PATH = os.getenv("RETENTION_DB_PATH", "./data/retention.sqlite3")
+UPLOAD_QUOTA_BYTES = int(os.getenv("UPLOAD_QUOTA_BYTES", "0"))
+PROCESSED_QUOTA_BYTES = int(os.getenv("PROCESSED_QUOTA_BYTES", "0"))
+RETENTION_MAX_AGE_DAYS = int(os.getenv("RETENTION_MAX_AGE_DAYS", "30"))
+RETENTION_GRACE_SECONDS = int(os.getenv("RETENTION_GRACE_SECONDS", "3600"))
+RETENTION_SWEEP_BATCH = int(os.getenv("RETENTION_SWEEP_BATCH", "500"))
+
+# Resumable (tus-style) chunked uploads
+UPLOAD_DB_PATH = os.getenv("UPLOAD_DB_PATH", "./data/uploads.sqlite3")
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+UPLOAD_EXPIRY_SECONDS = int(os.getenv("UPLOAD_EXPIRY_SECONDS", str(24 * 3600)))
+
+# Kindle delivery over SMTP; several books share a message up to the size and attachment limits
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_USERNAME = os.getenv("SMTP_USERNAME", os.getenv("GMAIL_USER", ""))
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD", "")
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "true").lower() == "true"
+SMTP_SSL = os.getenv("SMTP_SSL", "false").lower() == "true"
+SMTP_TIMEOUT_SECONDS = float(os.getenv("SMTP_TIMEOUT_SECONDS", "60"))
+SMTP_IDLE_SECONDS = float(os.getenv("SMTP_IDLE_SECONDS", "60"))
+SMTP_MESSAGES_PER_CONNECTION = int(os.getenv("SMTP_MESSAGES_PER_CONNECTION", "100"))
+DELIVERY_SENDER = os.getenv("DELIVERY_SENDER", SMTP_USERNAME)
+KINDLE_EMAIL = os.getenv("KINDLE_EMAIL", "")
+DELIVERY_DB_PATH = os.getenv("DELIVERY_DB_PATH", "./data/deliveries.sqlite3")
+DELIVERY_WORKERS = int(os.getenv("DELIVERY_WORKERS", "1"))
+DELIVERY_MAX_MESSAGE_BYTES = int(os.getenv("DELIVERY_MAX_MESSAGE_BYTES", str(25 * 1024 * 1024)))
+DELIVERY_MAX_ATTACHMENTS = int(os.getenv("DELIVERY_MAX_ATTACHMENTS", "25"))
+DELIVERY_MAX_RETRIES = int(os.getenv("DELIVERY_MAX_RETRIES", "5"))
+DELIVERY_RETRY_BASE_SECONDS = float(os.getenv("DELIVERY_RETRY_BASE_SECONDS", "30"))
+
+# Startup: in "lazy" mode each router, and the dependencies it imports, is loaded on the first request under
+# its prefix instead of at import time; with STARTUP_PREWARM they are loaded in the background right after
+# startup, along with STARTUP_PREWARM_MODULES
+STARTUP_MODE = os.getenv("STARTUP_MODE", "eager").lower()
+STARTUP_PREWARM = os.getenv("STARTUP_PREWARM", "true").lower() == "true"
+STARTUP_PREWARM_MODULES = [
+    module.strip() for module in os.getenv("STARTUP_PREWARM_MODULES", "aiohttp").split(",") if module.strip()
+]
+
+# Server log: rotates at LOG_MAX_BYTES, or on LOG_ROTATE_WHEN (e.g. "midnight") when that is set
+LOG_FILE = os.getenv("LOG_FILE", "./server.log")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "10"))
+LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN", "")
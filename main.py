@@ -1,19 +1,33 @@
 from fastapi import FastAPI, Depends, HTTPException, Header
-from dotenv import load_dotenv
+import importlib.util
 import os
 import logging
-from routes.health import router as health_router
-from routes.logs import router as log_router
-from routes.process_pdf import router as pdf_router  # Assuming you have a "process_pdf" module
+from routes.lazy import LazyRouters
+from pdf_manager.server_log import configure_logging
+import config  # Loads environment variables from .env
 
-# Load environment variables from .env
-load_dotenv()
+# Routers by module, prefix and tag; imported at startup, or on first use in lazy startup mode
+ROUTERS = [
+    ("routes.health", "/health", "Health"),
+    ("routes.logs", "/logs", "Logs"),
+    ("routes.metrics", "/metrics", "Metrics"),
+    ("routes.process_pdf", "/pdf", "PDF Operations"),
+]
 
 # Retrieve the API key from the .env file
 GCP_API_KEY = os.getenv("GCP_API_KEY")
 if not GCP_API_KEY:
     raise ValueError("GCP_API_KEY must be set.")
 
+# Settings that need Pillow; checked without importing it, so lazy startup stays fast
+PILLOW_INSTALLED = importlib.util.find_spec("PIL") is not None
+if config.OUTPUT_BYTE_BUDGET and not PILLOW_INSTALLED:
+    raise ValueError("OUTPUT_BYTE_BUDGET needs Pillow to downsample images; install it or set OUTPUT_BYTE_BUDGET=0.")
+if config.COVER_THUMBNAIL_FORMAT not in ("", "jpeg", "jpg", "png"):
+    raise ValueError("COVER_THUMBNAIL_FORMAT must be jpeg, png or empty.")
+if config.COVER_THUMBNAIL_FORMAT and not PILLOW_INSTALLED:
+    raise ValueError("COVER_THUMBNAIL_FORMAT needs Pillow to write thumbnails; install it or leave it empty.")
+
 # Initialize the FastAPI app
 app = FastAPI(
     title="PDF Processing API",
@@ -21,11 +35,13 @@ app = FastAPI(
     version="1.0.0"
 )
 
-# Configure logging
-logging.basicConfig(
-    filename="server.log",
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+# Configure logging: rotating file, written from a background thread
+configure_logging(
+    config.LOG_FILE,
+    level=config.LOG_LEVEL,
+    max_bytes=config.LOG_MAX_BYTES,
+    backup_count=config.LOG_BACKUP_COUNT,
+    when=config.LOG_ROTATE_WHEN or None,
 )
 logger = logging.getLogger(__name__)
 
@@ -39,9 +55,13 @@ async def validate_api_key(api_key: str = Header(...)):
         raise HTTPException(status_code=401, detail="Unauthorized: Invalid API Key")
 
 # Include the routers with the API key dependency
-app.include_router(health_router, prefix="/health", tags=["Health"], dependencies=[Depends(validate_api_key)])
-app.include_router(log_router, prefix="/logs", tags=["Logs"], dependencies=[Depends(validate_api_key)])
-app.include_router(pdf_router, prefix="/pdf", tags=["PDF Operations"], dependencies=[Depends(validate_api_key)])
+routers = LazyRouters(app, dependencies=[Depends(validate_api_key)])
+for module_name, prefix, tag in ROUTERS:
+    routers.add(module_name, prefix, tags=[tag])
+if config.STARTUP_MODE == "lazy":
+    routers.install(prewarm=config.STARTUP_PREWARM, prewarm_modules=config.STARTUP_PREWARM_MODULES)
+else:
+    routers.include_all()
 
 # Root endpoint (optional, for basic status checks)
 @app.get("/", tags=["Root"])
@@ -1,2 +1,13 @@
-from pdf_manager.manager import PDFManager
-from pdf_manager.check_metadata import check_pdf_metadata
\ No newline at end of file
+# PDFManager, EPUBManager and check_pdf_metadata are imported on first access, so importing a submodule
+# doesn't pull in the whole pipeline
+def __getattr__(name):
+    if name == "PDFManager":
+        from pdf_manager.manager import PDFManager
+        return PDFManager
+    if name == "EPUBManager":
+        from pdf_manager.epub import EPUBManager
+        return EPUBManager
+    if name == "check_pdf_metadata":
+        from pdf_manager.check_metadata import check_pdf_metadata
+        return check_pdf_metadata
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
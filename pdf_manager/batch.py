@@ -0,0 +1,140 @@
+import config
+from pdf_manager.manager import PDFManager
+from pdf_manager.epub import book_manager
+from pdf_manager.metadata_extractor import PDFMetadataExtractor
+from pdf_manager.metrics import collect_timings, record_metrics, replay_metrics
+from pdf_manager.page_selector import estimate_tokens
+from pdf_manager.process_pool import get_process_pool
+
+
+def prepare_book(file_path, n_pages, sha256=None):
+    # Runs in a worker process: parse, select page text and read local metadata
+    with record_metrics() as metrics, collect_timings() as timings:
+        manager = book_manager(file_path, n_pages=n_pages, sha256=sha256)
+        extracted_text, new_metadata, missing_fields = manager.collect_local_metadata()
+    return (extracted_text, new_metadata, missing_fields, manager.duplicate_of), metrics, timings
+
+
+def finish_book(file_path, n_pages, new_metadata, extracted_text, save_metadata=False, save_cover_page=False, duplicate_of=None):
+    # Runs in a worker process: fill in remaining fields and write the processed PDF
+    with record_metrics() as metrics, collect_timings() as timings:
+        manager = book_manager(file_path, n_pages=n_pages, save_metadata=save_metadata, save_cover_page=save_cover_page)
+        manager.duplicate_of = duplicate_of
+        metadata = manager.complete_metadata(new_metadata, extracted_text)
+        metadata_file, cover_file, renamed_pdf_path = manager.write_outputs(metadata, extracted_text)
+    result = metadata, metadata_file, cover_file, renamed_pdf_path, manager.document_info, manager.page_count
+    return result, metrics, timings
+
+
+def group_for_llm(books, token_budget, max_books):
+    """
+    Split (index, text, fields) tuples into LLM requests: same requested fields, within the token budget.
+    """
+    by_fields = {}
+    for index, text, fields in books:
+        by_fields.setdefault(tuple(fields), []).append((index, text))
+
+    groups = []
+    for fields, members in by_fields.items():
+        current, used = [], 0
+        for index, text in members:
+            tokens = estimate_tokens(text)
+            if current and (used + tokens > token_budget or len(current) >= max_books):
+                groups.append((list(fields), current))
+                current, used = [], 0
+            current.append((index, text))
+            used += tokens
+        if current:
+            groups.append((list(fields), current))
+    return groups
+
+
+class BatchProcessor:
+    """
+    Processes many books with the PDFManager stages spread over a process pool.
+
+    Parsing and local metadata run in parallel, books that still need the LLM are grouped into
+    shared requests, then the write stage runs in parallel again. `on_progress(items)` is called
+    with every item's state whenever one of them changes.
+    """
+
+    def __init__(self, n_pages=5, save_metadata=False, save_cover_page=False, on_progress=None):
+        self.n_pages = n_pages
+        self.save_metadata = save_metadata
+        self.save_cover_page = save_cover_page
+        self.on_progress = on_progress
+
+    @staticmethod
+    def collect(items, index, future):
+        """
+        Result of a worker call. The metrics it recorded are applied here, since the worker's own
+        registry is never scraped, and its stage timings are added to the item's.
+        """
+        result, metrics, timings = future.result()
+        replay_metrics(metrics)
+        item_timings = items[index].setdefault("timings", {})
+        for stage, seconds in timings.items():
+            item_timings[stage] = round(item_timings.get(stage, 0.0) + seconds, 6)
+        return result
+
+    def update(self, items, index, **fields):
+        items[index].update(fields)
+        if self.on_progress:
+            self.on_progress(items)
+
+    def run(self, file_paths, hashes=None):
+        pool = get_process_pool()
+        items = [{"file_path": file_path, "status": "queued"} for file_path in file_paths]
+        hashes = hashes or [None] * len(file_paths)
+
+        # Stage 1: parse and extract text and local metadata
+        prepared = {}
+        futures = {
+            pool.submit(prepare_book, file_path, self.n_pages, hashes[index]): index
+            for index, file_path in enumerate(file_paths)
+        }
+        for future, index in futures.items():
+            try:
+                prepared[index] = self.collect(items, index, future)
+                self.update(items, index, status="extracted", duplicate_of=prepared[index][3])
+            except Exception as e:
+                print(f"Error preparing {file_paths[index]}: {e}")
+                self.update(items, index, status="failed", error=str(e))
+
+        # Stage 2: one LLM request per group of books that still miss required fields
+        needing_llm = [
+            (index, text, missing)
+            for index, (text, _, missing, _) in prepared.items()
+            if PDFManager.needs_llm(missing)
+        ]
+        for fields, members in group_for_llm(needing_llm, config.LLM_BATCH_TOKEN_BUDGET, config.LLM_BATCH_MAX_BOOKS):
+            try:
+                results = PDFMetadataExtractor.query_openai_for_metadata_batch([text for _, text in members], fields)
+            except Exception as e:
+                print(f"Error querying LLM for batch: {e}")
+                results = [{} for _ in members]
+            for (index, _), llm_metadata in zip(members, results):
+                PDFManager.merge_llm_metadata(prepared[index][1], llm_metadata or {}, fields)
+                self.update(items, index, status="metadata_ready")
+
+        # Stage 3: write the processed PDFs
+        futures = {
+            pool.submit(
+                finish_book, file_paths[index], self.n_pages, new_metadata, text,
+                self.save_metadata, self.save_cover_page, duplicate_of,
+            ): index
+            for index, (text, new_metadata, _, duplicate_of) in prepared.items()
+        }
+        for future, index in futures.items():
+            try:
+                result = self.collect(items, index, future)
+                metadata, metadata_file, cover_file, renamed_pdf_path, document_info, page_count = result
+                self.update(
+                    items, index, status="processed", metadata=metadata,
+                    metadata_file=metadata_file, cover_file=cover_file, renamed_pdf=renamed_pdf_path,
+                    document_info=document_info, page_count=page_count,
+                )
+            except Exception as e:
+                print(f"Error writing {file_paths[index]}: {e}")
+                self.update(items, index, status="failed", error=str(e))
+        return items
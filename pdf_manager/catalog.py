@@ -0,0 +1,251 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from PyPDF2 import PdfReader
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class LibraryCatalog:
+    """
+    SQLite index of the uploaded and processed libraries.
+
+    Rows are written when uploads land and when processing finishes, and reconciled against the
+    directories at startup, so listing, search and metadata lookups never scan a directory or parse a PDF.
+    Title, authors, ISBN and file name are indexed with FTS5.
+    """
+
+    COLUMNS = [
+        "library", "file_name", "path", "title", "authors", "isbn", "language", "publisher",
+        "size", "mtime", "page_count", "sha256", "info", "metadata", "updated_at",
+    ]
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS books (
+                library TEXT NOT NULL,
+                file_name TEXT NOT NULL,
+                path TEXT NOT NULL,
+                title TEXT,
+                authors TEXT,
+                isbn TEXT,
+                language TEXT,
+                publisher TEXT,
+                size INTEGER,
+                mtime REAL,
+                page_count INTEGER,
+                sha256 TEXT,
+                info TEXT,
+                metadata TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (library, file_name)
+            );
+            CREATE INDEX IF NOT EXISTS books_sha256 ON books (sha256);
+            CREATE INDEX IF NOT EXISTS books_isbn ON books (isbn);
+            CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(title, authors, isbn, file_name);
+            """
+        )
+        self.connection.commit()
+
+    def upsert(self, library, path, metadata=None, info=None, page_count=None, sha256=None, hash_file=True):
+        """
+        Record a file in the catalog. Fields left as None keep their stored values.
+        Without a known sha256 the file is hashed, unless hash_file is False; its hash is then left empty
+        for whoever needs it first to fill in.
+        """
+        stat = os.stat(path)
+        metadata = metadata or {}
+        row = {
+            "library": library,
+            "file_name": os.path.basename(path),
+            "path": path,
+            "title": metadata.get("title"),
+            "authors": metadata.get("authors"),
+            "isbn": metadata.get("ISBN"),
+            "language": metadata.get("language"),
+            "publisher": metadata.get("publisher"),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "page_count": page_count,
+            "sha256": sha256 or (file_sha256(path) if hash_file else None),
+            "info": json.dumps(info, ensure_ascii=False) if info is not None else None,
+            "metadata": json.dumps(metadata, ensure_ascii=False) if metadata else None,
+            "updated_at": time.time(),
+        }
+        # Keep what we already know about fields the caller didn't supply
+        keep = [name for name in ("title", "authors", "isbn", "language", "publisher", "page_count", "info", "metadata") if row[name] is None]
+        updates = ", ".join(
+            f"{name} = COALESCE(excluded.{name}, books.{name})" if name in keep else f"{name} = excluded.{name}"
+            for name in self.COLUMNS if name not in ("library", "file_name")
+        )
+        with self.lock:
+            self.connection.execute(
+                f"INSERT INTO books ({', '.join(self.COLUMNS)}) VALUES ({', '.join('?' for _ in self.COLUMNS)}) "
+                f"ON CONFLICT (library, file_name) DO UPDATE SET {updates}",
+                [row[name] for name in self.COLUMNS],
+            )
+            self._index(library, row["file_name"])
+            self.connection.commit()
+
+    def _index(self, library, file_name):
+        stored = self.connection.execute(
+            "SELECT rowid, title, authors, isbn, file_name FROM books WHERE library = ? AND file_name = ?",
+            (library, file_name),
+        ).fetchone()
+        self.connection.execute("DELETE FROM books_fts WHERE rowid = ?", (stored["rowid"],))
+        self.connection.execute(
+            "INSERT INTO books_fts (rowid, title, authors, isbn, file_name) VALUES (?, ?, ?, ?, ?)",
+            (stored["rowid"], stored["title"] or "", stored["authors"] or "", stored["isbn"] or "", stored["file_name"]),
+        )
+
+    def remove(self, library, file_name):
+        with self.lock:
+            stored = self.connection.execute(
+                "SELECT rowid FROM books WHERE library = ? AND file_name = ?", (library, file_name)
+            ).fetchone()
+            if stored is None:
+                return False
+            self.connection.execute("DELETE FROM books_fts WHERE rowid = ?", (stored["rowid"],))
+            self.connection.execute("DELETE FROM books WHERE rowid = ?", (stored["rowid"],))
+            self.connection.commit()
+            return True
+
+    def get(self, library, file_name):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT * FROM books WHERE library = ? AND file_name = ?", (library, file_name)
+            ).fetchone()
+        return self._to_dict(row) if row else None
+
+    def list(self, library, offset=0, limit=None):
+        with self.lock:
+            total = self.connection.execute("SELECT COUNT(*) FROM books WHERE library = ?", (library,)).fetchone()[0]
+            rows = self.connection.execute(
+                "SELECT * FROM books WHERE library = ? ORDER BY file_name LIMIT ? OFFSET ?",
+                (library, -1 if limit is None else limit, offset),
+            ).fetchall()
+        return [self._to_dict(row) for row in rows], total
+
+    @staticmethod
+    def _match_expression(query):
+        # Quote every term so user input can't inject FTS syntax; prefix-match the terms
+        terms = re.findall(r"\w[\w\-]*", query, re.UNICODE)
+        return " ".join('"' + term.replace('"', "") + '"*' for term in terms)
+
+    def search(self, query, library=None, offset=0, limit=20):
+        expression = self._match_expression(query)
+        if not expression:
+            return [], 0
+        digits = re.sub(r"[\s\-]", "", query)
+        where = "books_fts MATCH ?"
+        params = [expression]
+        if library:
+            where += " AND books.library = ?"
+            params.append(library)
+        with self.lock:
+            total = self.connection.execute(
+                f"SELECT COUNT(*) FROM books_fts JOIN books ON books.rowid = books_fts.rowid WHERE {where}", params
+            ).fetchone()[0]
+            rows = self.connection.execute(
+                f"SELECT books.* FROM books_fts JOIN books ON books.rowid = books_fts.rowid WHERE {where} "
+                "ORDER BY rank LIMIT ? OFFSET ?",
+                params + [limit, offset],
+            ).fetchall()
+            # Hyphenated and plain ISBNs should find each other
+            if not rows and digits.isdigit() and len(digits) in (10, 13):
+                isbn_params = [digits] + ([library] if library else [])
+                rows = self.connection.execute(
+                    "SELECT * FROM books WHERE REPLACE(REPLACE(isbn, '-', ''), ' ', '') = ?"
+                    + (" AND library = ?" if library else "") + " LIMIT ? OFFSET ?",
+                    isbn_params + [limit, offset],
+                ).fetchall()
+                total = len(rows)
+        return [self._to_dict(row) for row in rows], total
+
+    def find_by_hash(self, sha256):
+        with self.lock:
+            rows = self.connection.execute("SELECT * FROM books WHERE sha256 = ?", (sha256,)).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def reconcile(self, library, directory, read_info=False):
+        """
+        Bring the catalog in line with a directory: add new files, refresh changed ones, drop missing ones.
+        """
+        # Imported here: the EPUB pipeline imports page_text, which imports this module
+        from pdf_manager.epub import EPUBPackage
+
+        with self.lock:
+            known = {
+                row["file_name"]: (row["size"], row["mtime"])
+                for row in self.connection.execute("SELECT file_name, size, mtime FROM books WHERE library = ?", (library,))
+            }
+        seen = set()
+        added = updated = 0
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if not entry.is_file() or not entry.name.endswith((".pdf", ".epub")):
+                    continue
+                seen.add(entry.name)
+                stat = entry.stat()
+                if known.get(entry.name) == (stat.st_size, stat.st_mtime):
+                    continue
+                info = page_count = None
+                metadata = None
+                if read_info and entry.name.endswith(".epub"):
+                    try:
+                        # Only the package document is read; its fields are already ours
+                        info = EPUBPackage(entry.path).info()
+                        metadata = dict(info)
+                    except Exception as e:
+                        logging.error(f"Error reading {entry.path} while reconciling catalog: {e}")
+                elif read_info:
+                    try:
+                        reader = PdfReader(entry.path)
+                        info = {key: str(value) for key, value in (reader.metadata or {}).items()}
+                        page_count = len(reader.pages)
+                    except Exception as e:
+                        logging.error(f"Error reading {entry.path} while reconciling catalog: {e}")
+                if info and metadata is None:
+                    fields = {"title": info.get("/Title"), "authors": info.get("/Author"), "ISBN": info.get("/Keywords")}
+                    metadata = {field: value for field, value in fields.items() if value}
+                try:
+                    self.upsert(library, entry.path, metadata=metadata, info=info, page_count=page_count)
+                except OSError as e:
+                    logging.error(f"Error cataloguing {entry.path}: {e}")
+                    continue
+                if entry.name in known:
+                    updated += 1
+                else:
+                    added += 1
+        removed = 0
+        for file_name in set(known) - seen:
+            removed += self.remove(library, file_name)
+        logging.info(f"Catalog reconciled for {library}: {added} added, {updated} updated, {removed} removed.")
+        return {"added": added, "updated": updated, "removed": removed}
+
+    @staticmethod
+    def _to_dict(row):
+        book = dict(row)
+        book["info"] = json.loads(book["info"]) if book["info"] else None
+        book["metadata"] = json.loads(book["metadata"]) if book["metadata"] else None
+        return book
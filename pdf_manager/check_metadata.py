@@ -9,13 +9,16 @@ def check_pdf_metadata(pdf_path):
             return "No metadata found in the PDF."
 
         print("Loaded Metadata:")
-        response = ""
-        for key, value in metadata.items():
-            response += f"{key}: {value}\n"
-        return response
+        return format_pdf_metadata(metadata)
     except Exception as e:
         return f"Error reading metadata: {e}"
 
+def format_pdf_metadata(metadata):
+    response = ""
+    for key, value in metadata.items():
+        response += f"{key}: {value}\n"
+    return response
+
 
 
 
@@ -0,0 +1,224 @@
+import os
+from io import BytesIO
+
+from PyPDF2 import PdfWriter
+from PyPDF2._page import PageObject
+from PyPDF2.generic import ContentStream, DictionaryObject, EncodedStreamObject, NameObject, StreamObject
+
+from pdf_manager.optimizer import NAME_TOKEN, decode_image, image_mode
+
+# Page keys copied to the cover; annotations, thumbnails and structure would pull in other pages
+COVER_PAGE_KEYS = ("/MediaBox", "/CropBox", "/BleedBox", "/TrimBox", "/ArtBox", "/Rotate", "/UserUnit", "/Contents", "/Group")
+
+# Resource categories whose entries are only kept when the content names them
+NAMED_RESOURCES = ("/XObject", "/Font", "/ExtGState", "/ColorSpace", "/Pattern", "/Shading", "/Properties")
+
+# Fraction of the page an image has to cover to stand in for the whole page
+FULL_PAGE_COVERAGE = 0.9
+
+# Operators that paint text, which a thumbnail of the page image would lose
+TEXT_OPERATORS = {b"Tj", b"TJ", b"'", b'"'}
+
+
+def resolve(value):
+    # The object behind an indirect reference; dictionaries may be stored either way
+    return value.get_object() if value is not None else None
+
+
+def content_data(contents):
+    # Decoded bytes of a page's content stream or array of streams
+    contents = resolve(contents)
+    if isinstance(contents, StreamObject):
+        return contents.get_data()
+    if isinstance(contents, list):
+        return b"\n".join(part.get_object().get_data() for part in contents)
+    return b""
+
+
+def used_names(data):
+    """
+    Resource names the content refers to, or None when it uses #xx escapes that would need decoding.
+    """
+    names = {name.decode("latin-1") for name in NAME_TOKEN.findall(data)}
+    return None if any("#" in name for name in names) else names
+
+
+def prune_resources(resources, data, depth=0):
+    """
+    Copy of a resource dictionary with only the entries `data` refers to. Form XObjects are copied with
+    their own resources pruned the same way, since they often share the book-wide dictionary.
+    """
+    resources = resolve(resources)
+    if not isinstance(resources, DictionaryObject):
+        return resources
+    names = used_names(data)
+    if names is None or depth > 8:
+        return resources
+
+    pruned = DictionaryObject(resources)
+    for category in NAMED_RESOURCES:
+        entries = resolve(resources.get(category))
+        if not isinstance(entries, DictionaryObject):
+            continue
+        kept = DictionaryObject()
+        for name, value in entries.items():
+            if name[1:] not in names:
+                continue
+            if category == "/XObject":
+                value = prune_form(value, resources, data, depth)
+            kept[NameObject(name)] = value
+        pruned[NameObject(category)] = kept
+    return pruned
+
+
+def prune_form(reference, page_resources, page_data, depth):
+    form = reference.get_object()
+    if not isinstance(form, StreamObject) or form.get("/Subtype") != "/Form" or "/Resources" not in form:
+        return reference
+    try:
+        data = form.get_data()
+    except Exception:
+        return reference
+    copy = EncodedStreamObject()
+    for key, value in form.items():
+        if key != "/Length":
+            copy[NameObject(key)] = value
+    copy._data = form._data
+    copy[NameObject("/Resources")] = prune_resources(form.raw_get("/Resources"), data, depth + 1)
+    return copy
+
+
+def lean_page(reader, page):
+    """
+    Copy of `page` with only what is needed to draw it, ready to add to a new PdfWriter.
+    """
+    data = content_data(page.raw_get("/Contents") if "/Contents" in page else None)
+    resources = resolve(page.get("/Resources"))
+    forms = resolve(resources.get("/XObject")) if isinstance(resources, DictionaryObject) else None
+    forms = forms if isinstance(forms, DictionaryObject) else {}
+    # Forms without resources of their own draw with the page's, so their names count as used too
+    for form in forms.values():
+        form = form.get_object()
+        if isinstance(form, StreamObject) and form.get("/Subtype") == "/Form" and "/Resources" not in form:
+            data += b"\n" + form.get_data()
+
+    lean = PageObject(pdf=reader)
+    lean[NameObject("/Type")] = NameObject("/Page")
+    for key in COVER_PAGE_KEYS:
+        if key in page:
+            lean[NameObject(key)] = page.raw_get(key)
+    lean[NameObject("/Resources")] = prune_resources(resources, data)
+    return lean
+
+
+def multiply(first, second):
+    a, b, c, d, e, f = first
+    a2, b2, c2, d2, e2, f2 = second
+    return (
+        a * a2 + b * c2, a * b2 + b * d2,
+        c * a2 + d * c2, c * b2 + d * d2,
+        e * a2 + f * c2 + e2, e * b2 + f * d2 + f2,
+    )
+
+
+def full_page_image(reader, page):
+    """
+    The image XObject that covers the page, when the page is just that image with no text drawn over it.
+    """
+    resources = resolve(page.get("/Resources"))
+    xobjects = resolve(resources.get("/XObject")) if isinstance(resources, DictionaryObject) else None
+    if not isinstance(xobjects, DictionaryObject) or not xobjects or "/Contents" not in page:
+        return None
+    box = [float(value) for value in page.mediabox]
+    page_area = abs(box[2] - box[0]) * abs(box[3] - box[1])
+
+    matrix = (1, 0, 0, 1, 0, 0)
+    stack = []
+    found = None
+    for operands, operator in ContentStream(page["/Contents"], reader).operations:
+        if operator == b"q":
+            stack.append(matrix)
+        elif operator == b"Q" and stack:
+            matrix = stack.pop()
+        elif operator == b"cm":
+            matrix = multiply(tuple(float(value) for value in operands), matrix)
+        elif operator in TEXT_OPERATORS:
+            return None
+        elif operator == b"Do":
+            image = xobjects.get(operands[0])
+            image = image.get_object() if image is not None else None
+            if not isinstance(image, StreamObject) or image.get("/Subtype") != "/Image":
+                continue
+            # Area the unit square lands on, clipped to the page
+            corners = [(x * matrix[0] + y * matrix[2] + matrix[4], x * matrix[1] + y * matrix[3] + matrix[5])
+                       for x, y in ((0, 0), (1, 0), (0, 1), (1, 1))]
+            left = max(min(x for x, _ in corners), min(box[0], box[2]))
+            right = min(max(x for x, _ in corners), max(box[0], box[2]))
+            bottom = max(min(y for _, y in corners), min(box[1], box[3]))
+            top = min(max(y for _, y in corners), max(box[1], box[3]))
+            if right > left and top > bottom and (right - left) * (top - bottom) >= FULL_PAGE_COVERAGE * page_area:
+                found = image
+    return found
+
+
+def save_thumbnail(image, output_file, image_format="jpeg", max_size=800, quality=80):
+    """
+    Write an image XObject as a JPEG or PNG no larger than `max_size` pixels on its longest side.
+    Returns False when the image can't be decoded.
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        print("Pillow is not installed; saving the cover as PDF instead.")
+        return False
+
+    if image.get("/BitsPerComponent") != 8 or image.get("/ImageMask") or "/Decode" in image:
+        return False
+    mode = image_mode(image.get("/ColorSpace"), lambda value: value.get_object() if value is not None else None)
+    if mode is None:
+        return False
+    try:
+        decoded = decode_image(image, mode, (max_size, max_size))
+    except Exception as e:
+        print(f"Error decoding cover image: {e}")
+        return False
+    decoded.thumbnail((max_size, max_size), Image.LANCZOS)
+    if decoded.mode == "CMYK":
+        decoded = decoded.convert("RGB")
+
+    output = BytesIO()
+    if image_format == "png":
+        decoded.save(output, format="PNG", optimize=True)
+    else:
+        decoded.save(output, format="JPEG", quality=quality, optimize=True)
+    with open(output_file, "wb") as file:
+        file.write(output.getvalue())
+    return True
+
+
+def save_cover(reader, output_base, thumbnail_format=None, thumbnail_size=800, thumbnail_quality=80):
+    """
+    Save the first page as a cover and return its path: `output_base` plus .jpg/.png when a thumbnail is
+    requested and the page is a single full-page image, otherwise plus .pdf with only the resources the
+    page uses.
+    """
+    page = reader.pages[0]
+    os.makedirs(os.path.dirname(output_base) or ".", exist_ok=True)
+
+    if thumbnail_format:
+        try:
+            image = full_page_image(reader, page)
+        except Exception as e:
+            print(f"Error inspecting cover page: {e}")
+            image = None
+        extension = "png" if thumbnail_format == "png" else "jpg"
+        output_file = f"{output_base}.{extension}"
+        if image is not None and save_thumbnail(image, output_file, thumbnail_format, thumbnail_size, thumbnail_quality):
+            return output_file
+
+    output_file = f"{output_base}.pdf"
+    writer = PdfWriter()
+    writer.add_page(lean_page(reader, page))
+    with open(output_file, "wb") as cover_pdf:
+        writer.write(cover_pdf)
+    return output_file
@@ -0,0 +1,390 @@
+import logging
+import os
+import random
+import smtplib
+import sqlite3
+import threading
+import time
+import uuid
+from email.message import EmailMessage
+from email.utils import make_msgid
+
+# Headers and MIME boundaries on top of the attachments themselves
+MESSAGE_OVERHEAD = 4 * 1024
+ATTACHMENT_OVERHEAD = 512
+
+
+def encoded_size(size):
+    # Base64 grows attachments by 4/3, plus a CRLF every 76 characters
+    encoded = (size + 2) // 3 * 4
+    return encoded + encoded // 76 * 2 + ATTACHMENT_OVERHEAD
+
+
+def pack_batches(items, max_bytes, max_attachments):
+    """
+    Pack (item, size) pairs into as few messages as possible (first-fit decreasing on encoded size).
+    Returns (batches, too_large) where too_large holds items that don't fit in a message on their own.
+    """
+    batches = []
+    too_large = []
+    for item, size in sorted(items, key=lambda pair: -pair[1]):
+        needed = encoded_size(size)
+        if needed + MESSAGE_OVERHEAD > max_bytes:
+            too_large.append(item)
+            continue
+        for batch in batches:
+            if batch["bytes"] + needed <= max_bytes and len(batch["items"]) < max_attachments:
+                batch["items"].append(item)
+                batch["bytes"] += needed
+                break
+        else:
+            batches.append({"items": [item], "bytes": MESSAGE_OVERHEAD + needed})
+    return [batch["items"] for batch in batches], too_large
+
+
+def is_permanent(error):
+    # 5xx replies, refused recipients and missing files won't succeed on retry; dropped connections and 4xx replies might
+    if isinstance(error, FileNotFoundError):
+        return True
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code >= 500
+    return False
+
+
+class SMTPConnection:
+    """
+    One persistent SMTP session, reused across messages.
+
+    The session is opened on first use, checked with NOOP when it has been idle, reopened after
+    `max_messages` messages or any error, and closed once it has been idle for `idle_timeout` seconds.
+    """
+
+    def __init__(self, host, port, username=None, password=None, starttls=True, use_ssl=False,
+                 timeout=60, idle_timeout=60, max_messages=100):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.use_ssl = use_ssl
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.max_messages = max_messages
+        self.smtp = None
+        self.sent = 0
+        self.last_used = 0.0
+        self.connects = 0
+
+    def _connect(self):
+        if self.use_ssl:
+            smtp = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            if self.starttls:
+                smtp.starttls()
+        if self.username:
+            smtp.login(self.username, self.password or "")
+        self.smtp = smtp
+        self.sent = 0
+        self.connects += 1
+
+    def _alive(self):
+        if self.smtp is None or self.sent >= self.max_messages:
+            return False
+        if time.monotonic() - self.last_used < 5:
+            return True
+        try:
+            return self.smtp.noop()[0] == 250
+        except smtplib.SMTPException:
+            return False
+        except OSError:
+            return False
+
+    def send(self, message, recipients):
+        if not self._alive():
+            self.close()
+            self._connect()
+        try:
+            self.smtp.send_message(message, to_addrs=recipients)
+        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPResponseException):
+            # The server answered, so the session is still usable once reset
+            try:
+                self.smtp.rset()
+            except Exception:
+                self.close()
+            raise
+        except Exception:
+            self.close()
+            raise
+        self.sent += 1
+        self.last_used = time.monotonic()
+
+    def close_if_idle(self):
+        if self.smtp is not None and time.monotonic() - self.last_used > self.idle_timeout:
+            self.close()
+
+    def close(self):
+        if self.smtp is None:
+            return
+        try:
+            self.smtp.quit()
+        except Exception:
+            pass
+        self.smtp = None
+
+
+class DeliveryQueue:
+    """
+    Sends processed books to Kindle addresses, several books per message.
+
+    Deliveries are persisted in SQLite with their per-recipient state. Due deliveries for a recipient are
+    packed into messages up to `max_message_bytes` (encoded) and `max_attachments`, and sent over a
+    persistent SMTP connection per worker, so a shelf costs one handshake rather than one per book.
+    Failed messages are retried with exponential backoff and jitter up to `max_retries` times;
+    permanent SMTP errors fail the deliveries straight away.
+    """
+
+    def __init__(self, db_path, connection_factory, sender, workers=1, max_message_bytes=25 * 1024 * 1024,
+                 max_attachments=25, max_retries=5, base_delay=30.0, max_delay=3600.0, subject="Kindle delivery"):
+        self.db_path = db_path
+        self.connection_factory = connection_factory
+        self.sender = sender
+        self.workers = workers
+        self.max_message_bytes = max_message_bytes
+        self.max_attachments = max_attachments
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.subject = subject
+        self.lock = threading.Lock()
+        self.wake = threading.Condition(self.lock)
+        self.threads = []
+        self.stopping = False
+        self.claimed = set()
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS deliveries (
+                id TEXT PRIMARY KEY,
+                recipient TEXT NOT NULL,
+                file_path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                message_id TEXT,
+                next_attempt_at REAL NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS deliveries_due ON deliveries (status, next_attempt_at);
+            CREATE INDEX IF NOT EXISTS deliveries_recipient ON deliveries (recipient, status);
+            """
+        )
+        self.connection.commit()
+
+    def start(self):
+        with self.lock:
+            if self.threads:
+                return
+            # A message interrupted mid-send goes out again, so it may arrive twice
+            count = self.connection.execute(
+                "UPDATE deliveries SET status = 'queued' WHERE status = 'sending'"
+            ).rowcount
+            self.connection.commit()
+            if count:
+                logging.info(f"Resumed {count} interrupted deliveries.")
+            self.stopping = False
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"delivery-worker-{index}", daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def stop(self, timeout=10):
+        with self.lock:
+            self.stopping = True
+            self.wake.notify_all()
+        for thread in self.threads:
+            thread.join(timeout)
+        self.threads = []
+
+    def enqueue(self, file_paths, recipient):
+        """
+        Queue books for a recipient and return their delivery records.
+        """
+        now = time.time()
+        rows = []
+        for file_path in file_paths:
+            rows.append((uuid.uuid4().hex, recipient, file_path, os.path.getsize(file_path), now, now, now))
+        with self.lock:
+            self.connection.executemany(
+                "INSERT INTO deliveries (id, recipient, file_path, size, status, next_attempt_at, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, 'queued', ?, ?, ?)",
+                rows,
+            )
+            self.connection.commit()
+            self.wake.notify_all()
+        return [self.get(row[0]) for row in rows]
+
+    def get(self, delivery_id):
+        with self.lock:
+            row = self.connection.execute("SELECT * FROM deliveries WHERE id = ?", (delivery_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def list(self, recipient=None, status=None, offset=0, limit=100):
+        conditions, params = [], []
+        if recipient:
+            conditions.append("recipient = ?")
+            params.append(recipient)
+        if status:
+            conditions.append("status = ?")
+            params.append(status)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self.lock:
+            total = self.connection.execute(f"SELECT COUNT(*) FROM deliveries {where}", params).fetchone()[0]
+            rows = self.connection.execute(
+                f"SELECT * FROM deliveries {where} ORDER BY created_at DESC LIMIT ? OFFSET ?", params + [limit, offset]
+            ).fetchall()
+        return [self._to_dict(row) for row in rows], total
+
+    def stats(self):
+        with self.lock:
+            by_status = dict(self.connection.execute("SELECT status, COUNT(*) FROM deliveries GROUP BY status").fetchall())
+            recipients = {}
+            for row in self.connection.execute("SELECT recipient, status, COUNT(*) FROM deliveries GROUP BY recipient, status"):
+                recipients.setdefault(row[0], {})[row[1]] = row[2]
+        return {"workers": self.workers, "deliveries": by_status, "recipients": recipients}
+
+    def _update(self, ids, **fields):
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        self.connection.executemany(
+            f"UPDATE deliveries SET {assignments} WHERE id = ?", [(*fields.values(), delivery_id) for delivery_id in ids]
+        )
+        self.connection.commit()
+
+    def _claim(self):
+        """
+        Take one recipient's due deliveries; returns (recipient, rows) or (None, seconds until the next is due).
+        """
+        now = time.time()
+        row = self.connection.execute(
+            "SELECT recipient FROM deliveries WHERE status = 'queued' AND next_attempt_at <= ? "
+            f"AND recipient NOT IN ({', '.join('?' for _ in self.claimed)}) ORDER BY next_attempt_at LIMIT 1",
+            (now, *self.claimed),
+        ).fetchone()
+        if row is None:
+            upcoming = self.connection.execute(
+                "SELECT MIN(next_attempt_at) FROM deliveries WHERE status = 'queued'"
+            ).fetchone()[0]
+            return None, (max(upcoming - now, 0.1) if upcoming else None)
+        recipient = row[0]
+        rows = self.connection.execute(
+            "SELECT * FROM deliveries WHERE status = 'queued' AND recipient = ? AND next_attempt_at <= ?",
+            (recipient, now),
+        ).fetchall()
+        self._update([item["id"] for item in rows], status="sending")
+        self.claimed.add(recipient)
+        return recipient, rows
+
+    def _work(self):
+        smtp = self.connection_factory()
+        try:
+            while True:
+                with self.lock:
+                    while True:
+                        if self.stopping:
+                            return
+                        recipient, rows = self._claim()
+                        if recipient is not None:
+                            break
+                        smtp.close_if_idle()
+                        # Sleep until the next retry is due or something is queued
+                        self.wake.wait(min(rows, 30) if rows else 30)
+                try:
+                    self._deliver(smtp, recipient, rows)
+                except Exception as e:
+                    self._release(rows, e)
+                finally:
+                    with self.lock:
+                        self.claimed.discard(recipient)
+        finally:
+            smtp.close()
+
+    def _deliver(self, smtp, recipient, rows):
+        items = [(row, row["size"]) for row in rows]
+        batches, too_large = pack_batches(items, self.max_message_bytes, self.max_attachments)
+        if too_large:
+            with self.lock:
+                self._update(
+                    [row["id"] for row in too_large], status="failed",
+                    error=f"File exceeds the {self.max_message_bytes} byte message limit.",
+                )
+        for batch in batches:
+            message_id = make_msgid(domain=self.sender.split("@")[-1] if "@" in self.sender else None)
+            try:
+                message = self._build_message(recipient, batch, message_id)
+                smtp.send(message, [recipient])
+            except Exception as e:
+                self._failed(batch, e)
+                continue
+            logging.info(f"Delivered {len(batch)} books to {recipient} in one message.")
+            with self.lock:
+                self._update([row["id"] for row in batch], status="sent", error=None, message_id=message_id)
+
+    def _release(self, rows, error):
+        # An error outside the per-message handling would otherwise leave the claimed rows 'sending' until a restart
+        ids = [row["id"] for row in rows]
+        with self.lock:
+            sending = {
+                item[0] for item in self.connection.execute(
+                    f"SELECT id FROM deliveries WHERE status = 'sending' AND id IN ({', '.join('?' for _ in ids)})", ids
+                )
+            }
+        if sending:
+            self._failed([row for row in rows if row["id"] in sending], error)
+
+    def _build_message(self, recipient, batch, message_id):
+        message = EmailMessage()
+        message["From"] = self.sender
+        message["To"] = recipient
+        message["Subject"] = self.subject
+        message["Message-ID"] = message_id
+        message.set_content(f"{len(batch)} book(s) attached.")
+        for row in batch:
+            with open(row["file_path"], "rb") as file:
+                message.add_attachment(
+                    file.read(), maintype="application",
+                    subtype="epub+zip" if row["file_path"].lower().endswith(".epub") else "pdf",
+                    filename=os.path.basename(row["file_path"]),
+                )
+        return message
+
+    def _failed(self, batch, error):
+        permanent = is_permanent(error)
+        with self.lock:
+            for row in batch:
+                attempts = row["attempts"] + 1
+                if permanent or attempts >= self.max_retries:
+                    self._update([row["id"]], status="failed", attempts=attempts, error=str(error))
+                    continue
+                # Exponential backoff with full jitter
+                delay = random.uniform(0, min(self.base_delay * 2 ** row["attempts"], self.max_delay))
+                self._update(
+                    [row["id"]], status="queued", attempts=attempts, error=str(error),
+                    next_attempt_at=time.time() + delay,
+                )
+        logging.error(f"Error delivering {len(batch)} books to {batch[0]['recipient']}: {error}")
+
+    @staticmethod
+    def _to_dict(row):
+        delivery = dict(row)
+        delivery["file_name"] = os.path.basename(delivery["file_path"])
+        return delivery
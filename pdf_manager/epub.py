@@ -0,0 +1,403 @@
+import html
+import os
+import posixpath
+import re
+import shutil
+import time
+import zipfile
+from urllib.parse import unquote
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+import config
+from pdf_manager.local_metadata import LocalMetadataExtractor, find_isbn, split_by_confidence
+from pdf_manager.manager import PDFManager
+from pdf_manager.metadata_extractor import PDFMetadataExtractor
+from pdf_manager.metrics import stage_timer, record_error, BYTES_PROCESSED
+from pdf_manager.page_selector import CHARS_PER_TOKEN
+
+# About a printed page of text, so EPUB body samples match the size of PDF ones
+PAGE_CHARS = 3000
+
+EPUB_MEDIA_TYPE = "application/epub+zip"
+CONTAINER_PATH = "META-INF/container.xml"
+CONTAINER_NS = "urn:oasis:names:tc:opendocument:xmlns:container"
+OPF_NS = "http://www.idpf.org/2007/opf"
+DC_NS = "http://purl.org/dc/elements/1.1/"
+
+DATE = re.compile(r"^\d{4}(?:-\d{2}(?:-\d{2})?)?")
+SCRIPT_OR_STYLE = re.compile(r"<(script|style)\b.*?</\1\s*>", re.IGNORECASE | re.DOTALL)
+TAG = re.compile(r"<[^>]+>")
+WHITESPACE = re.compile(r"\s+")
+METADATA_END = re.compile(r"</(?:[\w.-]+:)?metadata\s*>")
+ROLE = re.compile(r"role\s*=\s*[\"']([^\"']*)")
+
+# Our metadata fields and the Dublin Core elements they are written to
+DC_ELEMENTS = {
+    "title": "title",
+    "language": "language",
+    "publisher": "publisher",
+    "publication_date": "date",
+}
+
+
+class EPUBError(Exception):
+    pass
+
+
+def is_epub(file_path):
+    return file_path.lower().endswith(".epub")
+
+
+def book_manager(file_path, n_pages, **options):
+    # The pipeline for a book's format: EPUBs are read from their package document, everything else as PDF
+    manager = EPUBManager if is_epub(file_path) else PDFManager
+    return manager(file_path, n_pages=n_pages, **options)
+
+
+def drop_author(match):
+    # Substitution for creator elements: authors are removed, creators with another role are kept
+    role = ROLE.search(match.group(1) or "")
+    return "" if role is None or role.group(1) == "aut" else match.group(0)
+
+
+class EPUBPackage:
+    """
+    The package document (OPF) of an EPUB, read without extracting the archive.
+
+    The zip's central directory lists the entries; only container.xml and the OPF are decompressed,
+    so reading metadata costs the same for a 200 KB novel and a 200 MB picture book. Spine documents
+    and the cover image are read only when asked for.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        try:
+            with zipfile.ZipFile(file_path) as archive:
+                self.opf_path = self.find_opf(archive)
+                self.opf = archive.read(self.opf_path)
+            self.root = ElementTree.fromstring(self.opf)
+        except (zipfile.BadZipFile, KeyError, ElementTree.ParseError) as e:
+            raise EPUBError(f"Not a readable EPUB: {e}") from e
+        self.metadata_element = self.root.find(f"{{{OPF_NS}}}metadata")
+        if self.metadata_element is None:
+            raise EPUBError("The package document has no metadata.")
+
+    @staticmethod
+    def find_opf(archive):
+        container = ElementTree.fromstring(archive.read(CONTAINER_PATH))
+        rootfile = container.find(f".//{{{CONTAINER_NS}}}rootfile")
+        if rootfile is None or not rootfile.get("full-path"):
+            raise EPUBError("container.xml names no package document.")
+        return rootfile.get("full-path")
+
+    def dc_elements(self, name):
+        return [element for element in self.metadata_element.iter(f"{{{DC_NS}}}{name}") if (element.text or "").strip()]
+
+    def dc_values(self, name):
+        return [element.text.strip() for element in self.dc_elements(name)]
+
+    def authors(self):
+        # EPUB 2 marks roles with opf:role; creators without one are taken as authors
+        return [
+            element.text.strip() for element in self.dc_elements("creator")
+            if element.get(f"{{{OPF_NS}}}role", "aut") == "aut"
+        ]
+
+    def publication_date(self):
+        dates = self.dc_elements("date")
+        # EPUB 2 may list several dates; prefer the one marked as the publication date
+        dates.sort(key=lambda element: element.get(f"{{{OPF_NS}}}event", "publication") != "publication")
+        for element in dates:
+            match = DATE.match(element.text.strip())
+            if match:
+                return match.group(0)
+        return None
+
+    def isbn(self):
+        for value in self.dc_values("identifier"):
+            isbn, _ = find_isbn(re.sub(r"^urn:isbn:", "", value, flags=re.IGNORECASE))
+            if isbn:
+                return isbn
+        return None
+
+    def fields(self):
+        titles = self.dc_values("title")
+        languages = self.dc_values("language")
+        publishers = self.dc_values("publisher")
+        return {
+            "title": titles[0] if titles else None,
+            "authors": self.authors(),
+            "language": languages[0] if languages else None,
+            "publisher": publishers[0] if publishers else None,
+            "publication_date": self.publication_date(),
+            "ISBN": self.isbn(),
+        }
+
+    def info(self):
+        # The fields as stored in the catalog and shown by pdf-check
+        fields = self.fields()
+        fields["authors"] = ", ".join(fields["authors"])
+        return {field: value for field, value in fields.items() if value}
+
+    def resolve(self, href):
+        # Manifest hrefs are URLs relative to the package document
+        return posixpath.normpath(posixpath.join(posixpath.dirname(self.opf_path), unquote(href.split("#")[0])))
+
+    def manifest(self):
+        return {
+            item.get("id"): item for item in self.root.iterfind(f"{{{OPF_NS}}}manifest/{{{OPF_NS}}}item")
+            if item.get("id") and item.get("href")
+        }
+
+    def spine_paths(self):
+        manifest = self.manifest()
+        return [
+            self.resolve(manifest[itemref.get("idref")].get("href"))
+            for itemref in self.root.iterfind(f"{{{OPF_NS}}}spine/{{{OPF_NS}}}itemref")
+            if itemref.get("idref") in manifest
+        ]
+
+    def text(self, n_documents, token_budget):
+        """
+        Plain text of the first and last n_documents spine documents, cut to the token budget.
+        """
+        paths = self.spine_paths()
+        if len(paths) > 2 * n_documents:
+            paths = paths[:n_documents] + paths[-n_documents:]
+        return self.read_text(paths, token_budget * CHARS_PER_TOKEN)
+
+    def body_text(self, n_documents, max_chars):
+        """
+        Plain text of the spine documents past the first and last n_documents, or of all of them in a short book.
+        """
+        paths = self.spine_paths()
+        if len(paths) > 2 * n_documents:
+            paths = paths[n_documents:-n_documents]
+        return self.read_text(paths, max_chars)
+
+    def read_text(self, paths, max_chars):
+        parts, used = [], 0
+        with zipfile.ZipFile(self.file_path) as archive:
+            for path in paths:
+                if used >= max_chars:
+                    break
+                try:
+                    markup = archive.read(path).decode("utf-8", errors="replace")
+                except KeyError:
+                    continue
+                text = WHITESPACE.sub(" ", html.unescape(TAG.sub(" ", SCRIPT_OR_STYLE.sub(" ", markup)))).strip()
+                if text:
+                    parts.append(text[:max_chars - used])
+                    used += len(parts[-1])
+        return "\n".join(parts)
+
+    def cover_image(self):
+        """
+        Archive path and media type of the cover image, from the EPUB 3 cover-image property or the
+        EPUB 2 cover meta. None when the book declares no cover.
+        """
+        manifest = self.manifest()
+        item = next((item for item in manifest.values() if "cover-image" in (item.get("properties") or "").split()), None)
+        if item is None:
+            meta = next((meta for meta in self.metadata_element.iter(f"{{{OPF_NS}}}meta") if meta.get("name") == "cover"), None)
+            item = manifest.get(meta.get("content")) if meta is not None else None
+        if item is None:
+            return None
+        return self.resolve(item.get("href")), item.get("media-type", "")
+
+    def updated_opf(self, metadata):
+        """
+        The package document with metadata written into its Dublin Core elements, or None if nothing changed.
+        Only the elements that change are touched, so the rest of the document is kept byte for byte.
+        """
+        document = self.opf.decode("utf-8")
+        declared = re.search(r'xmlns:([\w.-]+)\s*=\s*["\']' + re.escape(DC_NS) + '["\']', document)
+        prefix = declared.group(1) if declared else "dc"
+        # Elements added to a document that doesn't declare the prefix carry their own declaration
+        declaration = "" if declared else f' xmlns:{prefix}="{DC_NS}"'
+        current = self.fields()
+        additions = []
+
+        def known(value):
+            return value and str(value).strip() not in ("", "Unknown")
+
+        for field, name in DC_ELEMENTS.items():
+            value = metadata.get(field)
+            if not known(value) or value == current[field]:
+                continue
+            pattern = re.compile(rf"<{prefix}:{name}(\s[^>]*)?(?:/>|>.*?</{prefix}:{name}\s*>)", re.DOTALL)
+            replacement = lambda match: f"<{prefix}:{name}{match.group(1) or ''}>{escape(str(value))}</{prefix}:{name}>"
+            document, replaced = pattern.subn(replacement, document, count=1)
+            if not replaced:
+                additions.append(f"<{prefix}:{name}{declaration}>{escape(str(value))}</{prefix}:{name}>")
+
+        authors = metadata.get("authors")
+        if isinstance(authors, list):
+            authors = ", ".join(authors)
+        if known(authors) and authors != ", ".join(current["authors"]):
+            # The creator list is replaced as a whole; contributors with other roles stay
+            creator = re.compile(rf"<{prefix}:creator(\s[^>]*)?(?:/>|>.*?</{prefix}:creator\s*>)\s*", re.DOTALL)
+            document = creator.sub(drop_author, document)
+            additions.extend(
+                f"<{prefix}:creator{declaration}>{escape(author.strip())}</{prefix}:creator>"
+                for author in authors.split(",") if author.strip()
+            )
+
+        isbn = metadata.get("ISBN")
+        if known(isbn) and not current["ISBN"]:
+            additions.append(f"<{prefix}:identifier{declaration}>urn:isbn:{escape(str(isbn))}</{prefix}:identifier>")
+
+        if additions:
+            end = METADATA_END.search(document)
+            if end is None:
+                raise EPUBError("The package document's metadata is not closed.")
+            document = document[:end.start()] + "".join(f"  {element}\n  " for element in additions) + document[end.start():]
+        updated = document.encode("utf-8")
+        return None if updated == self.opf else updated
+
+
+def write_opf(input_epub, output_epub, opf_path, opf):
+    """
+    Copy an EPUB with its package document replaced, without recompressing any other entry.
+
+    The new OPF is appended after the existing entries and the central directory is rewritten to point
+    at it; the old OPF's bytes stay behind unreferenced, as with a PDF incremental update.
+    Returns the size of the written archive.
+    """
+    shutil.copyfile(input_epub, output_epub)
+    with zipfile.ZipFile(output_epub, "a") as archive:
+        old = archive.getinfo(opf_path)
+        # Dropped from the central directory that is written on close
+        archive.filelist.remove(old)
+        del archive.NameToInfo[opf_path]
+        info = zipfile.ZipInfo(opf_path, date_time=time.localtime()[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        info.external_attr = old.external_attr
+        archive.writestr(info, opf)
+    return os.path.getsize(output_epub)
+
+
+class EPUBManager(PDFManager):
+    """
+    The PDFManager pipeline for EPUBs.
+
+    Metadata comes from the package document's Dublin Core elements; the book's text is read, and the
+    LLM asked, only when required fields are still missing. Writing metadata replaces just the OPF entry.
+    """
+
+    def __init__(self, file_path, n_pages: int, save_metadata=False, save_cover_page=False, large_file=None, sha256=None):
+        with stage_timer("epub_parse"):
+            self.package = EPUBPackage(file_path)
+        BYTES_PROCESSED.inc(os.path.getsize(file_path))
+        self.n_pages = n_pages
+        self.metadata_extractor = PDFMetadataExtractor(file_path, n_pages, file_hash=sha256)
+        self.save_metadata = save_metadata
+        self.save_cover_page = save_cover_page
+        self.large_file = False
+        self.metadata = None
+        self.document_info = None
+        self.page_count = None
+        self.optimization = None
+        self.duplicate_of = None
+        self._near_duplicate_text = None
+
+    def collect_local_metadata(self):
+        extractor = LocalMetadataExtractor(None, "")
+        try:
+            with stage_timer("local_metadata"):
+                for field, value in self.package.fields().items():
+                    extractor.offer(field, value, "opf")
+            print(f"OPF metadata: {extractor.fields}")  # Debug: fields and confidences from the package document
+        except Exception as e:
+            print(f"Error reading OPF metadata: {e}")
+        new_metadata, missing_fields = split_by_confidence(extractor.fields, config.LOCAL_METADATA_CONFIDENCE)
+        if not self.needs_llm(missing_fields):
+            return "", new_metadata, missing_fields
+
+        # Only now read the book itself, for the fields the package document left out
+        try:
+            with stage_timer("text_extraction"):
+                extracted_text = self.package.text(self.n_pages, config.PROMPT_TOKEN_BUDGET)
+        except Exception as e:
+            print(f"Error extracting EPUB text: {e}")
+            extracted_text = ""
+        duplicate = self.find_near_duplicate()
+        if duplicate is not None and duplicate["exact"]:
+            return extracted_text, {**duplicate["metadata"], **new_metadata}, []
+        extractor.text = extracted_text
+        extractor.from_text()
+        new_metadata, missing_fields = split_by_confidence(extractor.fields, config.LOCAL_METADATA_CONFIDENCE)
+        if duplicate is not None:
+            new_metadata, missing_fields = self.reuse_near_duplicate(duplicate, new_metadata, missing_fields)
+        return extracted_text, new_metadata, missing_fields
+
+    def body_text(self):
+        return self.package.body_text(self.n_pages, config.NEAR_DUPLICATE_SAMPLE_PAGES * PAGE_CHARS)
+
+    def write_outputs(self, metadata, extracted_text=None):
+        file_path = self.metadata_extractor.file_path
+        processed_dir, metadata_dir = self.output_dirs()
+
+        cover_file = None
+        if self.save_cover_page:
+            with stage_timer("cover_extraction"):
+                cover_file = self.extract_and_save_cover_page(metadata_dir)
+
+        updated_epub_path = os.path.join(processed_dir, f"{os.path.splitext(os.path.basename(file_path))[0]}_with_metadata.epub")
+        with stage_timer("epub_rewrite"):
+            self.document_info = self.attach_metadata_to_epub(file_path, updated_epub_path, metadata, package=self.package)
+        self.metadata = metadata
+
+        with stage_timer("rename_move"):
+            renamed_epub_path = self.rename_pdf_by_title(updated_epub_path, metadata["title"])
+
+        if extracted_text and self.duplicate_of is None:
+            self.register_near_duplicate(renamed_epub_path, metadata)
+
+        metadata_file = self.write_metadata_file(metadata, metadata_dir) if self.save_metadata else None
+        print(f"Metadata attached and saved to: {renamed_epub_path}")
+        return metadata_file, cover_file, renamed_epub_path
+
+    def extract_and_save_cover_page(self, metadata_dir):
+        try:
+            cover = self.package.cover_image()
+            if cover is None:
+                print("The EPUB declares no cover image.")
+                return None
+            path, media_type = cover
+            extension = os.path.splitext(path)[1] or "." + media_type.split("/")[-1]
+            cover_path = os.path.join(
+                metadata_dir, f"{os.path.splitext(os.path.basename(self.metadata_extractor.file_path))[0]}_cover_page{extension}"
+            )
+            with zipfile.ZipFile(self.package.file_path) as archive, archive.open(path) as source, open(cover_path, "wb") as output:
+                shutil.copyfileobj(source, output)
+            print(f"Cover image successfully saved to: {cover_path}")
+            return cover_path
+        except Exception as e:
+            record_error("cover_extraction")
+            print(f"Error extracting cover image: {e}")
+            return None
+
+    @staticmethod
+    def attach_metadata_to_epub(input_epub, output_epub, metadata, package=None):
+        """
+        Write metadata into the EPUB's package document and return the resulting Dublin Core fields.
+        """
+        try:
+            if package is None:
+                package = EPUBPackage(input_epub)
+            opf = package.updated_opf(metadata)
+            if opf is None:
+                shutil.copyfile(input_epub, output_epub)
+                print(f"OPF metadata already up to date, copied: {output_epub}")
+            else:
+                written = write_opf(input_epub, output_epub, package.opf_path, opf)
+                print(f"OPF metadata rewritten ({written} bytes): {output_epub}")
+                package = EPUBPackage(output_epub)
+            return package.info()
+        except Exception as e:
+            record_error("epub_rewrite")
+            print(f"Error attaching metadata to EPUB: {e}")
+            shutil.copyfile(input_epub, output_epub)
+            return None
@@ -0,0 +1,186 @@
+import shutil
+from io import BytesIO
+from PyPDF2 import PdfReader
+from PyPDF2.generic import (
+    ArrayObject,
+    DictionaryObject,
+    IndirectObject,
+    NameObject,
+    NumberObject,
+    create_string_object,
+)
+
+
+def find_startxref(source, file_size):
+    """
+    Return the byte offset recorded after the last 'startxref' keyword.
+    """
+    source.seek(max(file_size - 2048, 0))
+    tail = source.read()
+    pos = tail.rfind(b"startxref")
+    if pos == -1:
+        raise ValueError("startxref not found")
+    return int(tail[pos + len(b"startxref"):].split()[0])
+
+
+def next_object_number(reader):
+    # /Size is optional in xref-stream trailers, so fall back to the highest known object number
+    highest = 0
+    for ids in reader.xref.values():
+        if ids:
+            highest = max(highest, max(ids))
+    if reader.xref_objStm:
+        highest = max(highest, max(reader.xref_objStm))
+    return max(highest + 1, int(reader.trailer.get("/Size", 0)))
+
+
+def serialize(obj):
+    buffer = BytesIO()
+    obj.write_to_stream(buffer, None)
+    return buffer.getvalue()
+
+
+def build_info_dictionary(reader, info):
+    # Start from the existing /Info so untouched keys survive the update
+    merged = DictionaryObject()
+    existing = reader.trailer.get("/Info")
+    if existing is not None:
+        for key, value in existing.get_object().items():
+            merged[NameObject(key)] = value
+    for key, value in info.items():
+        merged[NameObject(key)] = create_string_object(str(value))
+    return merged
+
+
+def build_cover_objects(reader):
+    """
+    A copy of the first page for the front of the book, and the page tree root with it prepended.
+    The copy shares the first page's contents and resources, so nothing large is written.
+    """
+    first_page = reader.pages[0]
+    cover = DictionaryObject()
+    for key, value in first_page.items():
+        # Annotations and structure entries belong to the original page only
+        if key not in ("/Parent", "/Annots", "/StructParents", "/B", "/Tabs"):
+            cover[NameObject(key)] = value
+
+    pages_reference = reader.trailer["/Root"].raw_get("/Pages")
+    pages = DictionaryObject(reader.get_object(pages_reference))
+    cover[NameObject("/Parent")] = pages_reference
+    return cover, pages, pages_reference
+
+
+def xref_subsections(entries):
+    # Group (number, offset, generation) entries into runs of consecutive object numbers
+    runs = []
+    for entry in sorted(entries):
+        if runs and entry[0] == runs[-1][-1][0] + 1:
+            runs[-1].append(entry)
+        else:
+            runs.append([entry])
+    return runs
+
+
+def build_update(source, reader, info, prepend_cover=False):
+    """
+    Build the bytes of an incremental update that replaces the document /Info dictionary and,
+    with `prepend_cover`, adds a copy of the first page in front of the book.
+
+    The update holds the new objects, a new cross-reference section and a trailer whose
+    /Prev points at the original cross-reference section, so the original bytes stay untouched.
+    Only the tail of the source file, the head of its last xref section and the page tree root are read.
+    """
+    if reader.is_encrypted:
+        raise ValueError("Incremental updates of encrypted PDFs are not supported")
+
+    file_size = source.seek(0, 2)
+    prev_xref = find_startxref(source, file_size)
+    source.seek(prev_xref)
+    uses_xref_stream = source.read(4) != b"xref"
+    source.seek(file_size - 1)
+    ends_with_newline = source.read(1) in (b"\n", b"\r")
+    info_number = next_object_number(reader)
+    next_number = info_number + 1
+
+    update = BytesIO()
+    if not ends_with_newline:
+        update.write(b"\n")
+
+    entries = []
+
+    def write_object(number, generation, obj):
+        entries.append((number, file_size + update.tell(), generation))
+        update.write(f"{number} {generation} obj\n".encode())
+        update.write(serialize(obj))
+        update.write(b"\nendobj\n")
+
+    write_object(info_number, 0, build_info_dictionary(reader, info))
+    if prepend_cover:
+        cover_number = next_number
+        next_number += 1
+        cover, pages, pages_reference = build_cover_objects(reader)
+        pages[NameObject("/Kids")] = ArrayObject([IndirectObject(cover_number, 0, reader)] + list(pages["/Kids"]))
+        pages[NameObject("/Count")] = NumberObject(int(pages["/Count"]) + 1)
+        write_object(cover_number, 0, cover)
+        # The page tree root keeps its number, so this revision replaces it
+        write_object(pages_reference.idnum, pages_reference.generation, pages)
+
+    trailer = DictionaryObject()
+    trailer[NameObject("/Root")] = reader.trailer.raw_get("/Root")
+    trailer[NameObject("/Info")] = IndirectObject(info_number, 0, reader)
+    trailer[NameObject("/Prev")] = NumberObject(prev_xref)
+    if "/ID" in reader.trailer:
+        trailer[NameObject("/ID")] = ArrayObject(reader.trailer["/ID"])
+
+    xref_offset = file_size + update.tell()
+    if uses_xref_stream:
+        # Files indexed by xref streams get an xref stream section as well
+        xref_number = next_number
+        entries.append((xref_number, xref_offset, 0))
+        width = max(4, (xref_offset.bit_length() + 7) // 8)
+        index = []
+        rows = b""
+        for run in xref_subsections(entries):
+            index += [NumberObject(run[0][0]), NumberObject(len(run))]
+            for _, offset, generation in run:
+                rows += b"\x01" + offset.to_bytes(width, "big") + generation.to_bytes(2, "big")
+        trailer[NameObject("/Type")] = NameObject("/XRef")
+        trailer[NameObject("/Size")] = NumberObject(xref_number + 1)
+        trailer[NameObject("/W")] = ArrayObject([NumberObject(1), NumberObject(width), NumberObject(2)])
+        trailer[NameObject("/Index")] = ArrayObject(index)
+        trailer[NameObject("/Length")] = NumberObject(len(rows))
+        update.write(f"{xref_number} 0 obj\n".encode())
+        update.write(serialize(trailer))
+        update.write(b"\nstream\n" + rows + b"\nendstream\nendobj\n")
+    else:
+        trailer[NameObject("/Size")] = NumberObject(next_number)
+        update.write(b"xref\n")
+        for run in xref_subsections(entries):
+            update.write(f"{run[0][0]} {len(run)}\n".encode())
+            for _, offset, generation in run:
+                update.write(f"{offset:010d} {generation:05d} n \n".encode())
+        update.write(b"trailer\n")
+        update.write(serialize(trailer))
+        update.write(b"\n")
+
+    update.write(f"startxref\n{xref_offset}\n%%EOF\n".encode())
+    return update.getvalue()
+
+
+def append_metadata_update(input_pdf, output_pdf, info, reader=None, prepend_cover=False):
+    """
+    Write output_pdf as input_pdf plus an incremental update carrying the new /Info dictionary
+    (and the cover page, with `prepend_cover`).
+
+    Only the new objects are serialized; the original bytes are copied by the OS.
+    """
+    if reader is None:
+        reader = PdfReader(input_pdf)
+    with open(input_pdf, "rb") as source:
+        update = build_update(source, reader, info, prepend_cover=prepend_cover)
+
+    if output_pdf != input_pdf:
+        shutil.copyfile(input_pdf, output_pdf)
+    with open(output_pdf, "ab") as output:
+        output.write(update)
+    return len(update)
@@ -0,0 +1,327 @@
+import contextlib
+import functools
+import http.client
+import ipaddress
+import json
+import logging
+import os
+import queue
+import socket
+import sqlite3
+import threading
+import time
+import urllib.parse
+import urllib.request
+import uuid
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class CallbackURLError(Exception):
+    pass
+
+
+def check_callback_url(url, allowed_hosts=()):
+    """
+    Raise CallbackURLError unless url is http(s) and may be called back; return the addresses it was
+    checked against, for `pinned_opener` to connect to.
+
+    Hosts in allowed_hosts are always accepted and return no addresses, since they are trusted wherever
+    they resolve. Without an allowlist the host must resolve only to public addresses, so a callback
+    can't be pointed at loopback, link-local or private services.
+    """
+    parsed = urllib.parse.urlsplit(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise CallbackURLError("Callback URLs must be absolute http or https URLs.")
+    host = parsed.hostname.lower()
+    if allowed_hosts:
+        if host not in allowed_hosts:
+            raise CallbackURLError(f"Callback host {host} is not allowed.")
+        return []
+    try:
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)}
+    except (OSError, ValueError) as e:
+        raise CallbackURLError(f"Callback host {host} can't be resolved: {e}")
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split("%")[0])
+        if not ip.is_global or ip.is_multicast:
+            raise CallbackURLError(f"Callback host {host} resolves to a non-public address.")
+    return sorted(addresses)
+
+
+class NoRedirects(urllib.request.HTTPRedirectHandler):
+    # A redirect would let a public callback URL forward the request to an internal one
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class PinnedConnection:
+    """
+    Mixin for http.client connections that connect to addresses given in advance instead of resolving
+    the host. The host is still what the Host header, TLS SNI and certificate checks use.
+    """
+
+    def __init__(self, host, addresses=(), **kwargs):
+        super().__init__(host, **kwargs)
+        self.addresses = addresses
+        self._create_connection = self.connect_pinned
+
+    def connect_pinned(self, address, timeout, source_address=None):
+        error = OSError(f"No address to connect to for {self.host}")
+        for pinned in self.addresses:
+            try:
+                return socket.create_connection((pinned, address[1]), timeout, source_address)
+            except OSError as e:
+                error = e
+        raise error
+
+
+class PinnedHTTPConnection(PinnedConnection, http.client.HTTPConnection):
+    pass
+
+
+class PinnedHTTPSConnection(PinnedConnection, http.client.HTTPSConnection):
+    pass
+
+
+class PinnedHTTPHandler(urllib.request.HTTPHandler):
+    def __init__(self, addresses):
+        super().__init__()
+        self.addresses = addresses
+
+    def http_open(self, req):
+        return self.do_open(functools.partial(PinnedHTTPConnection, addresses=self.addresses), req)
+
+
+class PinnedHTTPSHandler(urllib.request.HTTPSHandler):
+    def __init__(self, addresses):
+        super().__init__()
+        self.addresses = addresses
+
+    def https_open(self, req):
+        connection = functools.partial(PinnedHTTPSConnection, addresses=self.addresses)
+        return self.do_open(connection, req, context=self._context)
+
+
+def pinned_opener(addresses):
+    """
+    URL opener for a callback that check_callback_url accepted. Connections go to the addresses it checked
+    rather than resolving the host again, so a host can't pass the check and then be re-pointed at an
+    internal address before the request is sent (DNS rebinding). Redirects and proxies aren't followed.
+    With no addresses (an allowlisted host) the host is resolved as usual.
+    """
+    handlers = [NoRedirects, urllib.request.ProxyHandler({})]
+    if addresses:
+        handlers += [PinnedHTTPHandler(addresses), PinnedHTTPSHandler(addresses)]
+    return urllib.request.build_opener(*handlers)
+
+
+class JobQueue:
+    """
+    Bounded worker pool whose job state is persisted in SQLite.
+
+    Jobs carry a JSON payload that is handed to `handler(payload, report_progress)`; the handler's
+    return value is stored as the job result and anything passed to report_progress is stored as
+    the job's progress. Jobs still queued or running when the process stopped are picked up again on start.
+    With a `memory_budget`, a worker only starts a job once `estimate_memory(payload)` bytes can be reserved.
+    `submit_once` coalesces submissions that share a key with a job still queued or running.
+    Callback URLs are checked with `check_callback_url` on submission and again before each call.
+    """
+
+    def __init__(self, handler, db_path, workers=2, max_depth=50, memory_budget=None, estimate_memory=None,
+                 callback_hosts=()):
+        self.handler = handler
+        self.callback_hosts = {host.lower() for host in callback_hosts}
+        self.db_path = db_path
+        self.workers = workers
+        self.max_depth = max_depth
+        self.memory_budget = memory_budget
+        self.estimate_memory = estimate_memory
+        self.pending = queue.Queue()
+        self.depth = 0
+        self.lock = threading.Lock()
+        self.threads = []
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, status TEXT NOT NULL, payload TEXT NOT NULL, result TEXT, error TEXT, "
+            "callback_url TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(jobs)")]
+        if "progress" not in columns:
+            self.connection.execute("ALTER TABLE jobs ADD COLUMN progress TEXT")
+        if "dedupe_key" not in columns:
+            self.connection.execute("ALTER TABLE jobs ADD COLUMN dedupe_key TEXT")
+            self.connection.execute("ALTER TABLE jobs ADD COLUMN callbacks TEXT")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS jobs_dedupe_key ON jobs (dedupe_key, status)")
+        self.connection.commit()
+
+    def start(self):
+        with self.lock:
+            if self.threads:
+                return
+            # Anything left queued or running by a previous process goes back on the queue
+            rows = self.connection.execute(
+                "SELECT id FROM jobs WHERE status IN ('queued', 'running') ORDER BY created_at"
+            ).fetchall()
+            for (job_id,) in rows:
+                self._update(job_id, status="queued")
+                self.pending.put(job_id)
+                self.depth += 1
+            if rows:
+                logging.info(f"Resumed {len(rows)} unfinished jobs.")
+
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"job-worker-{index}", daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def check_capacity(self):
+        # For callers that would rather refuse before doing work for a job; submitting checks again
+        with self.lock:
+            self._check_depth()
+
+    def _check_depth(self):
+        if self.depth >= self.max_depth:
+            raise QueueFullError(f"Job queue is full ({self.max_depth} jobs waiting or running).")
+
+    def submit(self, payload, callback_url=None):
+        if callback_url:
+            check_callback_url(callback_url, self.callback_hosts)
+        with self.lock:
+            job_id = self._insert(payload, callback_url)
+        self.pending.put(job_id)
+        return job_id
+
+    def submit_once(self, payload, dedupe_key, callback_url=None):
+        """
+        Submit a job unless one with the same key is still queued or running; then the caller shares
+        that job and its callback_url is notified along with the original one. Returns (job_id, coalesced).
+        """
+        if callback_url:
+            check_callback_url(callback_url, self.callback_hosts)
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT id, callbacks FROM jobs WHERE dedupe_key = ? AND status IN ('queued', 'running') "
+                "ORDER BY created_at LIMIT 1",
+                (dedupe_key,),
+            ).fetchone()
+            if row is not None:
+                if callback_url:
+                    callbacks = json.loads(row[1]) if row[1] else []
+                    self._update(row[0], callbacks=json.dumps(callbacks + [callback_url]))
+                return row[0], True
+            job_id = self._insert(payload, callback_url, dedupe_key)
+        self.pending.put(job_id)
+        return job_id, False
+
+    def _insert(self, payload, callback_url, dedupe_key=None):
+        self._check_depth()
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self.connection.execute(
+            "INSERT INTO jobs (id, status, payload, callback_url, dedupe_key, created_at, updated_at) "
+            "VALUES (?, 'queued', ?, ?, ?, ?, ?)",
+            (job_id, json.dumps(payload), callback_url, dedupe_key, now, now),
+        )
+        self.connection.commit()
+        self.depth += 1
+        return job_id
+
+    def get(self, job_id):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT id, status, payload, result, error, callback_url, created_at, updated_at, progress, callbacks "
+                "FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "job_id": row[0],
+            "status": row[1],
+            "payload": json.loads(row[2]),
+            "result": json.loads(row[3]) if row[3] else None,
+            "error": row[4],
+            "callback_url": row[5],
+            "created_at": row[6],
+            "updated_at": row[7],
+            "progress": json.loads(row[8]) if row[8] else None,
+            "callbacks": json.loads(row[9]) if row[9] else [],
+        }
+
+    def stats(self):
+        with self.lock:
+            counts = dict(self.connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        stats = {"workers": self.workers, "max_depth": self.max_depth, "depth": self.depth, "jobs": counts}
+        if self.memory_budget is not None:
+            stats["memory"] = self.memory_budget.stats()
+        return stats
+
+    def _update(self, job_id, **fields):
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        self.connection.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+        self.connection.commit()
+
+    def _work(self):
+        while True:
+            job_id = self.pending.get()
+            job = self.get(job_id)
+            try:
+                if job is None:
+                    continue
+
+                def report_progress(progress, job_id=job_id):
+                    with self.lock:
+                        self._update(job_id, progress=json.dumps(progress))
+
+                # Jobs stay queued until their memory estimate fits in the budget
+                with self.reserve_memory(job["payload"]):
+                    with self.lock:
+                        self._update(job_id, status="running")
+                    try:
+                        result = self.handler(job["payload"], report_progress)
+                        with self.lock:
+                            self._update(job_id, status="succeeded", result=json.dumps(result))
+                    except Exception as e:
+                        logging.error(f"Job {job_id} failed: {e}")
+                        with self.lock:
+                            self._update(job_id, status="failed", error=str(e))
+                # Callers coalesced onto this job registered their callbacks while it was queued or running
+                job = self.get(job_id)
+                for callback_url in [job["callback_url"], *job["callbacks"]]:
+                    if callback_url:
+                        self._notify(callback_url, job)
+            finally:
+                with self.lock:
+                    self.depth -= 1
+                self.pending.task_done()
+
+    def reserve_memory(self, payload):
+        if self.memory_budget is None or self.estimate_memory is None:
+            return contextlib.nullcontext()
+        return self.memory_budget.reserve(self.estimate_memory(payload))
+
+    def _notify(self, callback_url, job):
+        try:
+            # Checked again, since the host may resolve differently now than when the job was submitted,
+            # and then called at the address that passed
+            addresses = check_callback_url(callback_url, self.callback_hosts)
+            request = urllib.request.Request(
+                callback_url,
+                data=json.dumps(job).encode("utf-8"),
+                headers={"Content-Type": "application/json"},
+                method="POST",
+            )
+            with pinned_opener(addresses).open(request, timeout=10):
+                pass
+        except Exception as e:
+            logging.error(f"Error calling job callback {callback_url}: {e}")
@@ -0,0 +1,96 @@
+import mmap
+import os
+import threading
+from contextlib import contextmanager
+
+from PyPDF2 import PdfReader
+
+import config
+
+# Fixed overhead of a processing job: interpreter, parsed page tree, text extraction
+JOB_BASE_MEMORY = 64 * 1024 * 1024
+
+# The regular path holds the file in memory while parsing and a second copy while writing
+IN_MEMORY_FACTOR = 3
+
+
+def estimate_job_memory(file_size, large_file):
+    """
+    Rough peak memory of processing one file: proportional to its size in memory, fixed in large-file mode.
+    """
+    if large_file:
+        return config.LARGE_FILE_JOB_MEMORY
+    return JOB_BASE_MEMORY + IN_MEMORY_FACTOR * file_size
+
+
+def use_large_file_mode(file_size):
+    # Large files, and files whose in-memory processing would exceed the per-job ceiling
+    if config.LARGE_FILE_BYTES and file_size >= config.LARGE_FILE_BYTES:
+        return True
+    return bool(config.JOB_MEMORY_CEILING) and estimate_job_memory(file_size, False) > config.JOB_MEMORY_CEILING
+
+
+def file_memory(file_path):
+    # Memory to reserve for a file in whichever mode it will be processed in
+    try:
+        file_size = os.path.getsize(file_path)
+    except OSError:
+        return JOB_BASE_MEMORY
+    return estimate_job_memory(file_size, use_large_file_mode(file_size))
+
+
+def open_reader(file_path):
+    """
+    PdfReader over a read-only memory map of the file. PdfReader(path) reads the whole file into a
+    BytesIO; mapped pages are read on demand and can be dropped by the kernel under memory pressure.
+    """
+    with open(file_path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return PdfReader(file_path)
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    # Objects are read here and there, so readahead would only map pages nobody asked for
+    if hasattr(mmap, "MADV_RANDOM"):
+        mapped.madvise(mmap.MADV_RANDOM)
+    return PdfReader(mapped)
+
+
+class MemoryBudget:
+    """
+    Admission control for jobs by estimated memory.
+
+    `reserve(n)` blocks until `n` bytes fit in the budget alongside the running jobs; reservations are
+    granted in arrival order so a large job isn't starved by a stream of small ones. A job larger than
+    the whole budget runs once nothing else is reserved. A budget of 0 admits everything.
+    """
+
+    def __init__(self, total):
+        self.total = total
+        self.reserved = 0
+        self.condition = threading.Condition()
+        self.tickets = 0
+        self.serving = 0
+
+    @contextmanager
+    def reserve(self, amount):
+        if not self.total:
+            yield
+            return
+        amount = min(amount, self.total)
+        with self.condition:
+            ticket = self.tickets
+            self.tickets += 1
+            while ticket != self.serving or self.reserved + amount > self.total:
+                self.condition.wait()
+            self.serving += 1
+            self.reserved += amount
+            self.condition.notify_all()
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.reserved -= amount
+                self.condition.notify_all()
+
+    def stats(self):
+        with self.condition:
+            return {"total": self.total, "reserved": self.reserved, "waiting": self.tickets - self.serving}
@@ -0,0 +1,244 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+
+import config
+from pdf_manager.metrics import LLM_TOKENS
+
+
+class LLMError(Exception):
+    pass
+
+
+class RetryableLLMError(LLMError):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class LLMBackend:
+    """
+    Interface for chat-completion providers.
+
+    `chat` returns an OpenAI-shaped response dict (`choices[0].message.content`, optional `usage`).
+    Raise RetryableLLMError for rate limits and transient failures, LLMError for anything else.
+    """
+
+    async def chat(self, messages, max_tokens, temperature, model):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class OpenAIBackend(LLMBackend):
+    """
+    OpenAI-compatible HTTP backend sharing one pooled keep-alive session.
+
+    Point base_url at a local stand-in server to run tests and benchmarks without OpenAI.
+    """
+
+    def __init__(self, api_key, base_url="https://api.openai.com/v1", pool_size=16, timeout=60):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.session = None
+
+    def _session(self):
+        # aiohttp is imported on first use; it is a large share of the server's import time
+        import aiohttp
+
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers={"Authorization": f"Bearer {self.api_key}"},
+            )
+        return self.session
+
+    async def chat(self, messages, max_tokens, temperature, model):
+        import aiohttp
+
+        body = {"model": model, "messages": messages, "max_tokens": max_tokens, "temperature": temperature}
+        try:
+            async with self._session().post(f"{self.base_url}/chat/completions", json=body) as response:
+                if response.status == 429 or response.status >= 500:
+                    retry_after = response.headers.get("Retry-After", "")
+                    raise RetryableLLMError(
+                        f"LLM backend returned {response.status}: {await response.text()}",
+                        retry_after=float(retry_after) if retry_after.replace(".", "", 1).isdigit() else None,
+                    )
+                if response.status >= 400:
+                    raise LLMError(f"LLM backend returned {response.status}: {await response.text()}")
+                return await response.json()
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            raise RetryableLLMError(f"LLM backend unreachable: {e!r}")
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+
+
+class TokenBucket:
+    """
+    Async token bucket refilled continuously at `per_minute` units per minute.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = None
+
+    async def acquire(self, amount=1):
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        # A single request larger than the bucket would otherwise wait forever
+        amount = min(float(amount), self.capacity)
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def refund(self, amount):
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class LLMClient:
+    """
+    Rate-limited, retrying front end for an LLMBackend.
+
+    Requests/min and tokens/min are enforced with token buckets, in-flight requests are capped with a
+    semaphore and failures are retried with jittered exponential backoff. All work runs on one
+    background event loop so synchronous callers on any thread share the backend's connection pool.
+    """
+
+    def __init__(self, backend, requests_per_minute=500, tokens_per_minute=200000, max_in_flight=8,
+                 max_retries=5, base_delay=1.0, max_delay=30.0):
+        self.backend = backend
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.semaphore = None
+        self.loop = None
+        self.loop_lock = threading.Lock()
+        self.counters = {"requests": 0, "retries": 0, "failures": 0, "prompt_tokens": 0, "completion_tokens": 0}
+
+    @staticmethod
+    def estimate_tokens(messages, max_tokens):
+        # Roughly four characters per token, plus the completion budget
+        return sum(len(message["content"]) for message in messages) // 4 + max_tokens
+
+    async def chat_completion(self, messages, max_tokens=300, temperature=0, model=None):
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_in_flight)
+        model = model or config.OPENAI_MODEL
+        estimated = self.estimate_tokens(messages, max_tokens)
+
+        attempt = 0
+        while True:
+            await self.request_bucket.acquire(1)
+            await self.token_bucket.acquire(estimated)
+            try:
+                async with self.semaphore:
+                    self.counters["requests"] += 1
+                    response = await self.backend.chat(messages, max_tokens, temperature, model)
+                usage = response.get("usage") or {}
+                self.counters["prompt_tokens"] += usage.get("prompt_tokens", 0)
+                self.counters["completion_tokens"] += usage.get("completion_tokens", 0)
+                LLM_TOKENS.inc(usage.get("prompt_tokens", 0), kind="prompt")
+                LLM_TOKENS.inc(usage.get("completion_tokens", 0), kind="completion")
+                if usage.get("total_tokens") is not None and usage["total_tokens"] < estimated:
+                    self.token_bucket.refund(estimated - usage["total_tokens"])
+                return response
+            except RetryableLLMError as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    self.counters["failures"] += 1
+                    raise
+                self.counters["retries"] += 1
+                # Full jitter backoff, but never sooner than the server asked for
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+                if e.retry_after:
+                    delay = max(delay, e.retry_after)
+                logging.warning(f"LLM request failed ({e}); retry {attempt}/{self.max_retries} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+            except Exception:
+                self.counters["failures"] += 1
+                raise
+
+    def _ensure_loop(self):
+        with self.loop_lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                threading.Thread(target=self.loop.run_forever, name="llm-client", daemon=True).start()
+            return self.loop
+
+    def chat_completion_sync(self, messages, max_tokens=300, temperature=0, model=None):
+        """
+        Blocking wrapper for callers outside an event loop (pipeline threads, job workers).
+        """
+        future = asyncio.run_coroutine_threadsafe(
+            self.chat_completion(messages, max_tokens=max_tokens, temperature=temperature, model=model),
+            self._ensure_loop(),
+        )
+        return future.result()
+
+    def close(self):
+        with self.loop_lock:
+            if self.loop is None:
+                return
+            asyncio.run_coroutine_threadsafe(self.backend.close(), self.loop).result(timeout=5)
+
+    def stats(self):
+        return dict(self.counters)
+
+
+_llm_client = None
+_llm_client_lock = threading.Lock()
+
+
+def get_llm_client():
+    global _llm_client
+    with _llm_client_lock:
+        if _llm_client is None:
+            backend = OpenAIBackend(
+                config.OPENAI_API_KEY,
+                base_url=config.OPENAI_BASE_URL,
+                pool_size=config.LLM_MAX_IN_FLIGHT,
+                timeout=config.LLM_TIMEOUT_SECONDS,
+            )
+            _llm_client = LLMClient(
+                backend,
+                requests_per_minute=config.LLM_REQUESTS_PER_MINUTE,
+                tokens_per_minute=config.LLM_TOKENS_PER_MINUTE,
+                max_in_flight=config.LLM_MAX_IN_FLIGHT,
+                max_retries=config.LLM_MAX_RETRIES,
+            )
+        return _llm_client
+
+
+def close_llm_client():
+    # Release pooled connections on shutdown without creating a client that was never used
+    with _llm_client_lock:
+        if _llm_client is not None:
+            _llm_client.close()
+
+
+def set_llm_client(client):
+    # Swap in a client with a different backend, e.g. a stand-in server for tests or benchmarks
+    global _llm_client
+    with _llm_client_lock:
+        _llm_client = client
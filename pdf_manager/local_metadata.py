@@ -0,0 +1,186 @@
+import re
+
+METADATA_FIELDS = ["title", "authors", "language", "publisher", "edition", "publication_date", "ISBN"]
+
+ISBN_CANDIDATE = re.compile(r"(?<![\dXx])(?:97[89][\s\-‐]?)?(?:\d[\s\-‐]?){9}[\dXx](?![\dXx])")
+ISBN_LABEL = re.compile(r"ISBN(?:-1[03])?\s*:?\s*$", re.IGNORECASE)
+EDITION = re.compile(r"\b(\d{1,2})(?:st|nd|rd|th)\s+edition\b|\b(first|second|third|fourth|fifth)\s+edition\b", re.IGNORECASE)
+COPYRIGHT_YEAR = re.compile(r"(?:©|\(c\)|copyright)\s*(?:©\s*)?((?:19|20)\d{2})", re.IGNORECASE)
+PUBLISHED_BY = re.compile(r"published\s+by\s+(?!arrangement|permission|agreement|special)([^\n,.;]{3,80})", re.IGNORECASE)
+
+# Producer tools often leave their own names or layout labels in /Title and /Author
+PLACEHOLDER_TITLE = re.compile(r"(^untitled|layout \d|microsoft word|\.(docx?|pdf|indd|qxp|rtf)$|^document\d*$)", re.IGNORECASE)
+
+SOURCE_CONFIDENCE = {
+    "opf": 0.9,
+    "isbn_labelled": 0.95,
+    "isbn": 0.85,
+    "xmp": 0.8,
+    "text_pattern": 0.75,
+    # A /Info value that doesn't look like a producer placeholder is as good as the default threshold
+    "info": 0.7,
+    "cover_font": 0.55,
+    "info_placeholder": 0.2,
+}
+
+# Values below the threshold but at least this confident are kept as fallbacks for when the LLM has no answer
+FALLBACK_CONFIDENCE = 0.5
+
+
+def isbn_is_valid(digits):
+    if len(digits) == 10:
+        total = 0
+        for position, char in enumerate(digits):
+            if char in "Xx":
+                if position != 9:
+                    return False
+                value = 10
+            else:
+                value = int(char)
+            total += (10 - position) * value
+        return total % 11 == 0
+    if len(digits) == 13 and digits.isdigit() and digits[:3] in ("978", "979"):
+        total = sum(int(char) * (1 if position % 2 == 0 else 3) for position, char in enumerate(digits))
+        return total % 10 == 0
+    return False
+
+
+def find_isbn(text):
+    """
+    Return (isbn, labelled) for the first checksum-valid ISBN-10/13 in text, preferring ones labelled 'ISBN'.
+    """
+    fallback = None
+    for match in ISBN_CANDIDATE.finditer(text):
+        digits = re.sub(r"[\s\-‐]", "", match.group(0)).upper()
+        if not isbn_is_valid(digits):
+            continue
+        if ISBN_LABEL.search(text[max(match.start() - 12, 0):match.start()]):
+            return digits, True
+        if fallback is None:
+            fallback = digits
+    return (fallback, False) if fallback else (None, False)
+
+
+class LocalMetadataExtractor:
+    """
+    Reads metadata that is already in the document before anything is sent to the LLM.
+
+    Sources are the /Info dictionary, XMP, an ISBN scan over the extracted text and the largest
+    text run on the cover page; EPUBs offer their package document's fields as the "opf" source.
+    Every field comes back as (value, confidence).
+    """
+
+    def __init__(self, reader, text):
+        self.reader = reader
+        self.text = text or ""
+        self.fields = {}
+
+    def offer(self, field, value, source):
+        if isinstance(value, (list, tuple)):
+            value = ", ".join(str(item).strip() for item in value if str(item).strip())
+        value = str(value).strip() if value is not None else ""
+        if not value or value == "Unknown":
+            return
+        confidence = SOURCE_CONFIDENCE[source]
+        if source in ("info", "xmp", "opf") and self.looks_like_placeholder(field, value):
+            confidence = SOURCE_CONFIDENCE["info_placeholder"]
+        if field not in self.fields or self.fields[field][1] < confidence:
+            self.fields[field] = (value, confidence)
+
+    @staticmethod
+    def looks_like_placeholder(field, value):
+        if field == "title":
+            return bool(PLACEHOLDER_TITLE.search(value))
+        if field == "authors":
+            # A single word here is usually the account name of whoever made the file
+            return " " not in value
+        return False
+
+    def extract(self):
+        self.from_info()
+        self.from_xmp()
+        self.from_text()
+        self.from_cover_font()
+        return self.fields
+
+    def from_info(self):
+        try:
+            info = self.reader.metadata
+        except Exception as e:
+            print(f"Error reading document info: {e}")
+            return
+        if not info:
+            return
+        self.offer("title", info.get("/Title"), "info")
+        self.offer("authors", info.get("/Author"), "info")
+
+    def from_xmp(self):
+        try:
+            xmp = self.reader.xmp_metadata
+        except Exception as e:
+            print(f"Error reading XMP metadata: {e}")
+            return
+        if xmp is None:
+            return
+        try:
+            titles = xmp.dc_title or {}
+            self.offer("title", titles.get("x-default") or next(iter(titles.values()), None), "xmp")
+            self.offer("authors", xmp.dc_creator, "xmp")
+            self.offer("language", xmp.dc_language, "xmp")
+            self.offer("publisher", xmp.dc_publisher, "xmp")
+            if xmp.dc_date:
+                self.offer("publication_date", xmp.dc_date[0].strftime("%Y-%m-%d"), "xmp")
+            if xmp.dc_identifier:
+                isbn, _ = find_isbn(xmp.dc_identifier)
+                self.offer("ISBN", isbn, "isbn_labelled")
+        except Exception as e:
+            print(f"Error parsing XMP metadata: {e}")
+
+    def from_text(self):
+        isbn, labelled = find_isbn(self.text)
+        self.offer("ISBN", isbn, "isbn_labelled" if labelled else "isbn")
+
+        edition = EDITION.search(self.text)
+        if edition:
+            self.offer("edition", edition.group(1) or edition.group(2).capitalize(), "text_pattern")
+        year = COPYRIGHT_YEAR.search(self.text)
+        if year:
+            self.offer("publication_date", year.group(1), "text_pattern")
+        publisher = PUBLISHED_BY.search(self.text)
+        if publisher:
+            self.offer("publisher", publisher.group(1), "text_pattern")
+
+    def from_cover_font(self):
+        if len(self.reader.pages) == 0:
+            return
+        runs = []
+
+        def visitor(text, cm, tm, font_dict, font_size):
+            if text and text.strip():
+                scale = (tm[2] ** 2 + tm[3] ** 2) ** 0.5 * (cm[2] ** 2 + cm[3] ** 2) ** 0.5
+                runs.append((font_size * scale, text.strip()))
+
+        try:
+            self.reader.pages[0].extract_text(visitor_text=visitor)
+        except Exception as e:
+            print(f"Error reading cover page text: {e}")
+            return
+        if not runs:
+            return
+        largest = max(size for size, _ in runs)
+        title = " ".join(text for size, text in runs if size >= largest * 0.9)
+        if 2 < len(title) <= 200:
+            self.offer("title", title, "cover_font")
+
+
+def split_by_confidence(fields, threshold):
+    """
+    Return (metadata, missing): the local values, and the field names still needed from the LLM.
+    Fields below threshold are missing, but keep their value in metadata as a fallback when it is at least
+    FALLBACK_CONFIDENCE; the LLM only replaces it with an answer of its own (see PDFManager.merge_llm_metadata).
+    """
+    metadata = {field: value for field, (value, confidence) in fields.items() if confidence >= FALLBACK_CONFIDENCE}
+    missing = [
+        field for field in METADATA_FIELDS if field not in fields or fields[field][1] < threshold
+    ]
+    return metadata, missing
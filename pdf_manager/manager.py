@@ -2,17 +2,149 @@ import os
 import json
 from PyPDF2 import PdfReader, PdfWriter
 from pdf_manager.metadata_extractor import PDFMetadataExtractor, CoverPageExtractor
+from pdf_manager.incremental_update import append_metadata_update
+from pdf_manager.local_metadata import LocalMetadataExtractor, split_by_confidence
+from pdf_manager.optimizer import PDFOptimizer
+from pdf_manager.cover import save_cover
+from pdf_manager.large_file import open_reader, use_large_file_mode
+from pdf_manager.near_duplicates import get_near_duplicate_index, text_hash
+import config
+from pdf_manager.metrics import stage_timer, record_error, BYTES_PROCESSED
+
+# Fields that tell editions and printings of the same text apart; only an exact copy lends them
+EXACT_MATCH_FIELDS = ("title", "ISBN")
 
 class PDFManager:
-    def __init__(self, file_path, n_pages: int, save_metadata=False, save_cover_page=False):
-        self.metadata_extractor = PDFMetadataExtractor(file_path, n_pages)
-        self.cover_page_extractor = CoverPageExtractor(file_path, n_pages)
+    def __init__(self, file_path, n_pages: int, save_metadata=False, save_cover_page=False, large_file=None, sha256=None):
+        file_size = os.path.getsize(file_path)
+        # Large files are read through a memory map instead of being loaded whole
+        self.large_file = use_large_file_mode(file_size) if large_file is None else large_file
+        # Parse the PDF once; text, cover and write stages all work from this reader
+        with stage_timer("pdf_parse"):
+            self.reader = open_reader(file_path) if self.large_file else PdfReader(file_path)
+        BYTES_PROCESSED.inc(file_size)
+        self.metadata_extractor = PDFMetadataExtractor(file_path, n_pages, reader=self.reader, file_hash=sha256)
+        self.cover_page_extractor = CoverPageExtractor(file_path, n_pages, reader=self.reader)
         self.save_metadata = save_metadata
         self.save_cover_page = save_cover_page
+        # Filled in by write_outputs so callers can catalogue the result without re-parsing it
+        self.metadata = None
+        self.document_info = None
+        self.page_count = None
+        self.optimization = None
+        # Processed book whose metadata was reused, when this one is a near-duplicate of it
+        self.duplicate_of = None
+        self._near_duplicate_text = None
 
     def process_pdf(self):
+        extracted_text, new_metadata, missing_fields = self.collect_local_metadata()
+
+        if self.needs_llm(missing_fields):
+            try:
+                llm_metadata = self.metadata_extractor.query_openai_for_metadata(extracted_text, fields=missing_fields)
+                self.merge_llm_metadata(new_metadata, llm_metadata, missing_fields)
+            except Exception as e:
+                # Keep the locally found fields even when the LLM is unavailable
+                record_error("llm_call")
+                print(f"Error querying LLM for {missing_fields}: {e}")
+        else:
+            print("Local metadata is confident enough. Skipping LLM query.")
+
+        metadata = self.complete_metadata(new_metadata, extracted_text)
+        return self.write_outputs(metadata, extracted_text)
+
+    def collect_local_metadata(self):
         extracted_text = self.metadata_extractor.extract_metadata()
+        try:
+            # Use what the document already tells us and only ask the LLM for what is still uncertain
+            with stage_timer("local_metadata"):
+                local_fields = LocalMetadataExtractor(self.reader, extracted_text).extract()
+            print(f"Local metadata: {local_fields}")  # Debug: fields and confidences found locally
+        except Exception as e:
+            print(f"Error during local metadata extraction: {e}")
+            local_fields = {}
+        new_metadata, missing_fields = split_by_confidence(local_fields, config.LOCAL_METADATA_CONFIDENCE)
+        if not self.needs_llm(missing_fields):
+            return extracted_text, new_metadata, missing_fields
+
+        # A known copy of the book can stand in for the LLM; only worth signing the body text for when needed
+        duplicate = self.find_near_duplicate()
+        if duplicate is not None and duplicate["exact"]:
+            return extracted_text, {**duplicate["metadata"], **new_metadata}, []
+        if duplicate is not None:
+            new_metadata, missing_fields = self.reuse_near_duplicate(duplicate, new_metadata, missing_fields)
+        return extracted_text, new_metadata, missing_fields
+
+    def body_text(self):
+        return self.metadata_extractor.body_text(config.NEAR_DUPLICATE_SAMPLE_PAGES)
+
+    def near_duplicate_text(self):
+        # Body text rather than the prompt text: title and copyright pages read much alike across books
+        if self._near_duplicate_text is None:
+            self._near_duplicate_text = self.body_text()
+        return self._near_duplicate_text
+
+    def find_near_duplicate(self):
+        try:
+            index = get_near_duplicate_index()
+            if index is None:
+                return None
+            with stage_timer("near_duplicate"):
+                text = self.near_duplicate_text()
+                duplicate = index.find(index.signature(text), text_hash(text))
+        except Exception as e:
+            print(f"Error looking up near-duplicates: {e}")
+            return None
+        if duplicate is not None:
+            self.duplicate_of = duplicate["key"]
+            print(
+                f"{'Exact' if duplicate['exact'] else 'Near'}-duplicate of {duplicate['key']} "
+                f"(similarity {duplicate['similarity']:.2f}), reusing its metadata"
+            )
+        return duplicate
+
+    @staticmethod
+    def reuse_near_duplicate(duplicate, new_metadata, missing_fields):
+        """
+        Fill missing fields from a duplicate's metadata; return (new_metadata, fields still missing).
+        The title and ISBN are only taken from an exact copy.
+        """
+        still_missing = []
+        for field in missing_fields:
+            value = duplicate["metadata"].get(field)
+            if value and value != "Unknown" and (duplicate["exact"] or field not in EXACT_MATCH_FIELDS):
+                new_metadata[field] = value
+            else:
+                still_missing.append(field)
+        return new_metadata, still_missing
+
+    def register_near_duplicate(self, pdf_path, metadata):
+        # Only books whose title came from the document or the LLM, not from their file name
+        fallback_title = os.path.splitext(os.path.basename(self.metadata_extractor.file_path))[0]
+        if metadata.get("title") in (None, "Unknown", fallback_title):
+            return
+        try:
+            index = get_near_duplicate_index()
+            if index is not None:
+                # Reading and signing the body text happens on the index's background thread
+                index.add_later(os.path.basename(pdf_path), self.near_duplicate_text, metadata)
+        except Exception as e:
+            print(f"Error registering {pdf_path} for near-duplicate detection: {e}")
 
+    @staticmethod
+    def needs_llm(missing_fields):
+        return any(field in missing_fields for field in config.LOCAL_METADATA_REQUIRED_FIELDS)
+
+    @staticmethod
+    def merge_llm_metadata(new_metadata, llm_metadata, missing_fields):
+        # An "Unknown" or empty answer leaves the local fallback value in place
+        for field in missing_fields:
+            value = llm_metadata.get(field)
+            if value and value != "Unknown":
+                new_metadata[field] = value
+        return new_metadata
+
+    def complete_metadata(self, new_metadata, extracted_text):
         metadata = {
             "title": "Unknown",
             "authors": "Unknown",
@@ -24,94 +156,172 @@ class PDFManager:
         }
 
         try:
-            new_metadata = self.metadata_extractor.query_openai_for_metadata(extracted_text)
-            print(f"Parsed metadata: {new_metadata}")  # Debug: parsed metadata from OpenAI
-
+            print(f"Parsed metadata: {new_metadata}")  # Debug: merged local and LLM metadata
             metadata = self.metadata_extractor.ensure_metadata_fields(new_metadata, extracted_text)
             print(f"Final metadata after ensuring fields: {metadata}")  # Debug: final metadata
         except Exception as e:
             print(f"Error during metadata extraction: {e}")
+        return metadata
 
+    def output_dirs(self):
         # Define output directories
         base_dir = os.path.dirname(self.metadata_extractor.file_path)
         processed_dir = os.path.join(base_dir, "processed_pdfs")
         metadata_dir = os.path.join(base_dir, "metadata")
         os.makedirs(processed_dir, exist_ok=True)
         os.makedirs(metadata_dir, exist_ok=True)
+        return processed_dir, metadata_dir
+
+    def write_metadata_file(self, metadata, metadata_dir):
+        metadata_file = os.path.join(metadata_dir, f"{os.path.splitext(os.path.basename(self.metadata_extractor.file_path))[0]}_metadata.json")
+        with open(metadata_file, "w", encoding="utf-8") as file:
+            json.dump(metadata, file, indent=4, ensure_ascii=False)
+        return metadata_file
+
+    def write_outputs(self, metadata, extracted_text=None):
+        processed_dir, metadata_dir = self.output_dirs()
 
         # Save the cover page if enabled
         cover_file = None
+        cover_page = None
         if self.save_cover_page:
-            cover_file = self.extract_and_save_cover_page(metadata_dir)
+            with stage_timer("cover_extraction"):
+                cover_file = self.extract_and_save_cover_page(metadata_dir)
+            if cover_file:
+                # Prepend the cover straight from the parsed document instead of re-reading cover_file
+                cover_page = self.reader.pages[0]
 
         # Attach metadata and cover page to PDF
         updated_pdf_path = os.path.join(processed_dir, f"{os.path.splitext(os.path.basename(self.metadata_extractor.file_path))[0]}_with_metadata.pdf")
-        self.attach_metadata_and_cover_to_pdf(self.metadata_extractor.file_path, updated_pdf_path, metadata, cover_file)
+        with stage_timer("pdf_rewrite"):
+            self.document_info = self.attach_metadata_and_cover_to_pdf(
+                self.metadata_extractor.file_path, updated_pdf_path, metadata, cover_file,
+                reader=self.reader, cover_page=cover_page
+            )
+        self.metadata = metadata
+        self.page_count = len(self.reader.pages) + (1 if cover_page is not None else 0)
+
+        # Shrink the output towards the Kindle size budget
+        if config.OUTPUT_BYTE_BUDGET and os.path.getsize(updated_pdf_path) > config.OUTPUT_BYTE_BUDGET:
+            with stage_timer("optimize"):
+                self.optimization = self.optimize_pdf(updated_pdf_path, config.OUTPUT_BYTE_BUDGET, lazy=self.large_file)
 
         # Rename the file based on the title
-        renamed_pdf_path = self.rename_pdf_by_title(updated_pdf_path, metadata["title"])
+        with stage_timer("rename_move"):
+            renamed_pdf_path = self.rename_pdf_by_title(updated_pdf_path, metadata["title"])
+
+        # Later uploads of the same book, under another name or as another scan, can reuse this metadata
+        if extracted_text is not None and self.duplicate_of is None:
+            self.register_near_duplicate(renamed_pdf_path, metadata)
 
         # Save metadata as a JSON file if enabled
-        metadata_file = None
-        if self.save_metadata:
-            metadata_file = os.path.join(metadata_dir, f"{os.path.splitext(os.path.basename(self.metadata_extractor.file_path))[0]}_metadata.json")
-            with open(metadata_file, "w", encoding="utf-8") as file:
-                json.dump(metadata, file, indent=4, ensure_ascii=False)
+        metadata_file = self.write_metadata_file(metadata, metadata_dir) if self.save_metadata else None
 
         print(f"Metadata attached and saved to: {renamed_pdf_path}")
         return metadata_file, cover_file, renamed_pdf_path
 
-    def extract_and_save_cover_page(self, metadata_dir):
+    @staticmethod
+    def optimize_pdf(pdf_path, target_bytes, dpi=None, lazy=None):
         try:
-            reader = PdfReader(self.metadata_extractor.file_path)
-            cover_page = reader.pages[0]  # Assuming the first page is the cover page
-            cover_page_path = os.path.join(metadata_dir, f"{os.path.splitext(os.path.basename(self.metadata_extractor.file_path))[0]}_cover_page.pdf")
-
-            writer = PdfWriter()
-            writer.add_page(cover_page)
+            if lazy is None:
+                lazy = use_large_file_mode(os.path.getsize(pdf_path))
+            optimizer = PDFOptimizer(
+                pdf_path, target_bytes=target_bytes, dpi=dpi or config.OUTPUT_OPTIMIZE_DPI, min_dpi=config.OUTPUT_MIN_DPI,
+                lazy=lazy
+            )
+            report = optimizer.run(pdf_path)
+            print(f"Optimized {pdf_path}: {report['original_bytes']} -> {report['final_bytes']} bytes")
+            return report
+        except Exception as e:
+            record_error("optimize")
+            print(f"Error optimizing PDF: {e}")
+            return None
 
-            with open(cover_page_path, "wb") as cover_pdf:
-                writer.write(cover_pdf)
+    def extract_and_save_cover_page(self, metadata_dir):
+        try:
+            # Assuming the first page is the cover page; only the resources it uses are copied
+            cover_page_base = os.path.join(metadata_dir, f"{os.path.splitext(os.path.basename(self.metadata_extractor.file_path))[0]}_cover_page")
+            cover_page_path = save_cover(
+                self.reader, cover_page_base, thumbnail_format=config.COVER_THUMBNAIL_FORMAT,
+                thumbnail_size=config.COVER_THUMBNAIL_SIZE, thumbnail_quality=config.COVER_THUMBNAIL_QUALITY
+            )
 
             print(f"Cover page successfully saved to: {cover_page_path}")
             return cover_page_path
         except Exception as e:
+            record_error("cover_extraction")
             print(f"Error extracting cover page: {e}")
             return None
 
     @staticmethod
-    def attach_metadata_and_cover_to_pdf(input_pdf, output_pdf, metadata, cover_file):
+    def build_info(metadata):
+        # Map our metadata fields onto the standard /Info keys
+        return {
+            "/Title": metadata.get("title", "Unknown"),
+            "/Author": metadata.get("authors", "Unknown"),
+            "/Subject": metadata.get("publisher", "Unknown"),
+            "/Keywords": metadata.get("ISBN", "Unknown"),
+            "/CreationDate": metadata.get("publication_date", "Unknown"),
+            "/Producer": "PDF Metadata Manager"
+        }
+
+    @staticmethod
+    def attach_metadata_incrementally(input_pdf, output_pdf, metadata, reader=None, prepend_cover=False):
+        # Append a new /Info object, xref section and trailer instead of re-serializing every page
+        try:
+            if reader is None:
+                reader = PdfReader(input_pdf)
+            info = PDFManager.build_info(metadata)
+            written = append_metadata_update(input_pdf, output_pdf, info, reader=reader, prepend_cover=prepend_cover)
+            print(f"Metadata appended as incremental update ({written} bytes): {output_pdf}")
+            # The update keeps the keys of the original /Info that we don't set
+            return {**{key: str(value) for key, value in (reader.metadata or {}).items()}, **info}
+        except Exception as e:
+            print(f"Incremental metadata update failed, falling back to full rewrite: {e}")
+            return None
+
+    @staticmethod
+    def attach_metadata_and_cover_to_pdf(input_pdf, output_pdf, metadata, cover_file, reader=None, cover_page=None, incremental=True):
         try:
-            # Open the existing PDF
-            reader = PdfReader(input_pdf)
+            if cover_page is None and cover_file:
+                cover_page = PdfReader(cover_file).pages[0]
+
+            # Metadata changes, and a cover that is the book's own first page, don't need the pages rewritten
+            prepend_cover = cover_page is not None and reader is not None and cover_page is reader.pages[0]
+            if (cover_page is None or prepend_cover) and incremental:
+                info = PDFManager.attach_metadata_incrementally(
+                    input_pdf, output_pdf, metadata, reader=reader, prepend_cover=prepend_cover
+                )
+                if info is not None:
+                    return info
+
+            # Reuse an already parsed PDF when the caller has one
+            if reader is None:
+                reader = PdfReader(input_pdf)
             writer = PdfWriter()
 
             # Add the cover page first, if available
-            if cover_file:
-                cover_reader = PdfReader(cover_file)
-                writer.add_page(cover_reader.pages[0])
+            if cover_page is not None:
+                writer.add_page(cover_page)
 
             # Copy pages from the original PDF
             for page in reader.pages:
                 writer.add_page(page)
 
             # Set metadata with standard keys
-            writer.add_metadata({
-                "/Title": metadata.get("title", "Unknown"),
-                "/Author": metadata.get("authors", "Unknown"),
-                "/Subject": metadata.get("publisher", "Unknown"),
-                "/Keywords": metadata.get("ISBN", "Unknown"),
-                "/CreationDate": metadata.get("publication_date", "Unknown"),
-                "/Producer": "PDF Metadata Manager"
-            })
+            info = PDFManager.build_info(metadata)
+            writer.add_metadata(info)
 
             # Write to the output file
             with open(output_pdf, "wb") as output:
                 writer.write(output)
 
             print(f"Metadata and cover page successfully attached to PDF: {output_pdf}")
+            return info
         except Exception as e:
+            record_error("pdf_rewrite")
             print(f"Error attaching metadata and cover page to PDF: {e}")
+            return None
 
     @staticmethod
     def rename_pdf_by_title(pdf_path, title):
@@ -122,12 +332,14 @@ class PDFManager:
 
             dir_path = os.path.dirname(pdf_path)
             formatted_title = " ".join([word.capitalize() for word in title.strip().split()])
-            new_name = f"{formatted_title}.pdf"
+            # Keep the book's format: .pdf, or .epub for EPUBs
+            new_name = f"{formatted_title}{os.path.splitext(pdf_path)[1] or '.pdf'}"
             renamed_path = os.path.join(dir_path, new_name)
 
             os.rename(pdf_path, renamed_path)
             print(f"PDF renamed to: {renamed_path}")
             return renamed_path
         except Exception as e:
+            record_error("rename_move")
             print(f"Error renaming PDF: {e}")
             return pdf_path
@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import config
+
+
+class MetadataCache:
+    """
+    Content-addressed cache of LLM metadata results.
+
+    Entries are keyed by a hash of the extracted text plus the model name. A small in-memory
+    LRU sits in front of a SQLite table that is trimmed by total size and expires entries by age.
+    """
+
+    def __init__(self, db_path, memory_items=256, max_bytes=50 * 1024 * 1024, ttl_seconds=30 * 24 * 3600):
+        self.db_path = db_path
+        self.memory_items = memory_items
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS metadata_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS metadata_cache_accessed ON metadata_cache (accessed_at)")
+        self.connection.commit()
+
+    @staticmethod
+    def make_key(text, model, fields=None):
+        digest = hashlib.sha256()
+        digest.update(model.encode("utf-8"))
+        digest.update(b"\0")
+        if fields:
+            digest.update(",".join(fields).encode("utf-8"))
+            digest.update(b"\0")
+        digest.update(text.encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, text, model, fields=None):
+        key = self.make_key(text, model, fields)
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None and entry[0] + self.ttl_seconds > now:
+                self.memory.move_to_end(key)
+                self.counters["hits"] += 1
+                self.counters["memory_hits"] += 1
+                return json.loads(entry[1])
+            if entry is not None:
+                del self.memory[key]
+
+            row = self.connection.execute(
+                "SELECT value, created_at FROM metadata_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[1] + self.ttl_seconds <= now:
+                if row is not None:
+                    self.connection.execute("DELETE FROM metadata_cache WHERE key = ?", (key,))
+                    self.connection.commit()
+                self.counters["misses"] += 1
+                return None
+
+            self.connection.execute("UPDATE metadata_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self.connection.commit()
+            self._remember(key, row[1], row[0])
+            self.counters["hits"] += 1
+            self.counters["disk_hits"] += 1
+            return json.loads(row[0])
+
+    def set(self, text, model, metadata, fields=None):
+        key = self.make_key(text, model, fields)
+        value = json.dumps(metadata, ensure_ascii=False)
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO metadata_cache (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value.encode("utf-8")), now, now),
+            )
+            self._evict()
+            self.connection.commit()
+            self._remember(key, now, value)
+            self.counters["writes"] += 1
+
+    def _remember(self, key, created_at, value):
+        self.memory[key] = (created_at, value)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_items:
+            self.memory.popitem(last=False)
+
+    def _evict(self):
+        # Drop expired rows, then least recently used rows until the table fits in max_bytes
+        cutoff = time.time() - self.ttl_seconds
+        expired = self.connection.execute("DELETE FROM metadata_cache WHERE created_at <= ?", (cutoff,)).rowcount
+        self.counters["evictions"] += max(expired, 0)
+
+        total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM metadata_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self.connection.execute(
+            "SELECT key, size FROM metadata_cache ORDER BY accessed_at ASC"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            self.connection.execute("DELETE FROM metadata_cache WHERE key = ?", (key,))
+            self.memory.pop(key, None)
+            total -= size
+            self.counters["evictions"] += 1
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            self.connection.execute("DELETE FROM metadata_cache")
+            self.connection.commit()
+
+    def stats(self):
+        with self.lock:
+            entries, size = self.connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM metadata_cache"
+            ).fetchone()
+            lookups = self.counters["hits"] + self.counters["misses"]
+            return {
+                **self.counters,
+                "hit_ratio": round(self.counters["hits"] / lookups, 4) if lookups else 0.0,
+                "memory_entries": len(self.memory),
+                "disk_entries": entries,
+                "disk_bytes": size,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+            }
+
+
+_metadata_cache = None
+_metadata_cache_lock = threading.Lock()
+
+
+def get_metadata_cache():
+    # Shared process-wide instance, created on first use
+    global _metadata_cache
+    with _metadata_cache_lock:
+        if _metadata_cache is None:
+            _metadata_cache = MetadataCache(
+                config.METADATA_CACHE_PATH,
+                memory_items=config.METADATA_CACHE_MEMORY_ITEMS,
+                max_bytes=config.METADATA_CACHE_MAX_BYTES,
+                ttl_seconds=config.METADATA_CACHE_TTL_SECONDS,
+            )
+        return _metadata_cache
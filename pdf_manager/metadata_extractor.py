@@ -1,43 +1,96 @@
-import openai
 import os
-from PyPDF2 import PdfReader, PdfWriter
-from dotenv import load_dotenv
+from PyPDF2 import PdfReader
 import json
-
-load_dotenv()
+import config
+from pdf_manager.metadata_cache import get_metadata_cache
+from pdf_manager.llm_client import get_llm_client
+from pdf_manager.page_selector import PageTextSelector
+from pdf_manager.page_text import get_page_text_cache
+from pdf_manager.metrics import stage_timer, PAGES_PARSED
+from pdf_manager.cover import save_cover
 
 class PDFMetadataExtractor:
-    def __init__(self, file_path, n_pages: int):
+    def __init__(self, file_path, n_pages: int, reader=None, file_hash=None):
         self.file_path = file_path
         self.n_pages = n_pages
+        self._reader = reader
+        # SHA-256 of the file when the caller has it, so the page text cache doesn't hash the file again
+        self.file_hash = file_hash
 
-    def extract_metadata(self):
-        reader = PdfReader(self.file_path)
-        total_pages = len(reader.pages)
-
-        # Determine unique pages to extract
-        unique_pages = set(range(0, min(self.n_pages, total_pages))) | set(range(max(total_pages - self.n_pages, 0), total_pages))
+    @property
+    def reader(self):
+        # Parse the document at most once; stages that share a reader also share its xref table
+        if self._reader is None:
+            self._reader = PdfReader(self.file_path)
+        return self._reader
 
-        # Extract text from the pages
-        extracted_text = []
-        for page_num in sorted(unique_pages):
-            page = reader.pages[page_num]
-            extracted_text.append(page.extract_text())
+    def extract_metadata(self):
+        # Score the first and last n_pages for metadata signals, stop once enough is found
+        # and pack the best snippets into the prompt token budget
+        selector = PageTextSelector(
+            self.reader,
+            self.n_pages,
+            token_budget=config.PROMPT_TOKEN_BUDGET,
+            signal_target=config.PAGE_SIGNAL_TARGET,
+            file_path=self.file_path,
+            workers=config.PAGE_TEXT_WORKERS,
+            cache=get_page_text_cache(),
+            file_hash=self.file_hash,
+            pool_min_pages=config.PAGE_TEXT_POOL_MIN_PAGES,
+        )
+        with stage_timer("text_extraction"):
+            extracted_text = selector.select()
+        self.file_hash = selector.file_hash
+        PAGES_PARSED.inc(selector.pages_extracted)
+        print(
+            f"Extracted text from {selector.pages_extracted} pages ({len(extracted_text)} characters), "
+            f"{selector.pages_cached} cached, {selector.pages_skipped} without text"
+        )
+        return extracted_text
+
+    def body_text(self, n_samples):
+        # Pages spread over the body, past the first and last n_pages the prompt is taken from; short books whole
+        total_pages = len(self.reader.pages)
+        body = range(self.n_pages, total_pages - self.n_pages)
+        if len(body) < n_samples:
+            page_nums = list(range(total_pages))
+        else:
+            page_nums = [body[index * len(body) // n_samples] for index in range(n_samples)]
+        selector = PageTextSelector(
+            self.reader, self.n_pages, file_path=self.file_path, cache=get_page_text_cache(), file_hash=self.file_hash,
+        )
+        texts = selector.extract_pages(page_nums)
+        self.file_hash = selector.file_hash
+        PAGES_PARSED.inc(selector.pages_extracted)
+        return "\n".join(texts[page_num] for page_num in page_nums)
 
-        return "\n".join(extracted_text)
 
+    @staticmethod
+    def query_openai_for_metadata(text, fields=None):
+        # Identical text sent to the same model gives the same answer, so skip the round trip
+        cache = get_metadata_cache()
+        cached = cache.get(text, config.OPENAI_MODEL, fields)
+        if cached is not None:
+            print("Metadata cache hit")
+            return cached
+
+        with stage_timer("llm_call"):
+            metadata = PDFMetadataExtractor._request_openai_metadata(text, fields)
+        cache.set(text, config.OPENAI_MODEL, metadata, fields)
+        return metadata
 
     @staticmethod
-    def query_openai_for_metadata(text):
+    def _request_openai_metadata(text, fields=None):
         try:
+            field_list = ", ".join(fields) if fields else "title, authors, language, publisher, edition, publication_date, and ISBN"
             prompt = f"""
-            Extract metadata from the following text and return it in JSON format with the fields: title, authors, language, publisher, edition, publication_date, and ISBN. 
+            Extract metadata from the following text and return it in JSON format with the fields: {field_list}. 
             If a field cannot be extracted, return it as \"Unknown\".
             {text}
             """
 
-            response = openai.ChatCompletion.create(
-                model=os.getenv("OPENAI_MODEL", "gpt-3.5-turbo"),
+            response = get_llm_client().chat_completion_sync(
+                model=config.OPENAI_MODEL,
                 messages=[
                     {"role": "system", "content": "You are a helpful assistant that extracts metadata from text."},
                     {"role": "user", "content": prompt}
@@ -46,27 +99,85 @@ class PDFMetadataExtractor:
                 temperature=0
             )
 
-            if "choices" not in response or not response["choices"]:
-                raise ValueError("Empty response from OpenAI API")
+            return PDFMetadataExtractor._parse_json_content(response)
+
+        except Exception as e:
+            print(f"Error querying OpenAI API: {e}")
+            raise
+
+    @staticmethod
+    def _parse_json_content(response):
+        if "choices" not in response or not response["choices"]:
+            raise ValueError("Empty response from OpenAI API")
 
-            content = response["choices"][0]["message"]["content"]
+        content = response["choices"][0]["message"]["content"]
+        try:
             if isinstance(content, str):
                 # Clean up the response to ensure it can be parsed as JSON
                 if content.startswith("```json"):
                     content = content.replace("```json", "").replace("```", "").strip()
                 return json.loads(content)
-            elif isinstance(content, dict):
+            elif isinstance(content, (dict, list)):
                 return content
             else:
                 raise ValueError("Unexpected format in OpenAI response")
-
         except json.JSONDecodeError:
             print(f"Error decoding JSON: {content}")
             raise ValueError("Failed to decode JSON from OpenAI API response")
 
+    @staticmethod
+    def query_openai_for_metadata_batch(texts, fields=None):
+        """
+        Extract metadata for several books with one LLM request.
+        Returns one dict per text, in order; cached books are not sent again.
+        """
+        cache = get_metadata_cache()
+        results = [cache.get(text, config.OPENAI_MODEL, fields) for text in texts]
+        pending = [index for index, result in enumerate(results) if result is None]
+        if not pending:
+            return results
+        if len(pending) == 1:
+            results[pending[0]] = PDFMetadataExtractor.query_openai_for_metadata(texts[pending[0]], fields)
+            return results
+
+        field_list = ", ".join(fields) if fields else "title, authors, language, publisher, edition, publication_date, and ISBN"
+        books = "\n\n".join(f"### Book {number}\n{texts[index]}" for number, index in enumerate(pending, start=1))
+        prompt = f"""
+            The text below comes from {len(pending)} different books, each starting with a "### Book N" header.
+            Extract metadata for every book and return a JSON array with one object per book, in the same order,
+            each with the fields: {field_list}.
+            If a field cannot be extracted, return it as \"Unknown\".
+            {books}
+            """
+        try:
+            with stage_timer("llm_call"):
+                response = get_llm_client().chat_completion_sync(
+                    model=config.OPENAI_MODEL,
+                    messages=[
+                        {"role": "system", "content": "You are a helpful assistant that extracts metadata from text."},
+                        {"role": "user", "content": prompt}
+                    ],
+                    max_tokens=300 * len(pending),
+                    temperature=0
+                )
+            parsed = PDFMetadataExtractor._parse_json_content(response)
+            if not isinstance(parsed, list) or len(parsed) != len(pending):
+                raise ValueError(f"Expected {len(pending)} metadata objects in batch response")
         except Exception as e:
-            print(f"Error querying OpenAI API: {e}")
-            raise
+            # Fall back to one request per book rather than losing the whole batch
+            print(f"Batch metadata query failed, querying books one by one: {e}")
+            for index in pending:
+                try:
+                    results[index] = PDFMetadataExtractor.query_openai_for_metadata(texts[index], fields)
+                except Exception as book_error:
+                    print(f"Error querying OpenAI API for book {index}: {book_error}")
+                    results[index] = {}
+            return results
+
+        for index, metadata in zip(pending, parsed):
+            cache.set(texts[index], config.OPENAI_MODEL, metadata, fields)
+            results[index] = metadata
+        return results
 
 
 
@@ -110,25 +221,22 @@ class PDFMetadataExtractor:
 
 
 class CoverPageExtractor(PDFMetadataExtractor):
-    def __init__(self, file_path, n_pages: int):
-        super().__init__(file_path, n_pages)
+    def __init__(self, file_path, n_pages: int, reader=None):
+        super().__init__(file_path, n_pages, reader=reader)
 
     def extract_cover_page(self, output_dir):
         try:
-            reader = PdfReader(self.file_path)
+            reader = self.reader
 
             if len(reader.pages) == 0:
                 print("Error: The PDF file has no pages.")
                 return None
 
-            first_page = reader.pages[0]
-            writer = PdfWriter()
-            writer.add_page(first_page)
-
-            os.makedirs(output_dir, exist_ok=True)
-            output_file = os.path.join(output_dir, f"{os.path.splitext(os.path.basename(self.file_path))[0]}_cover.pdf")
-            with open(output_file, "wb") as out_pdf:
-                writer.write(out_pdf)
+            output_base = os.path.join(output_dir, f"{os.path.splitext(os.path.basename(self.file_path))[0]}_cover")
+            output_file = save_cover(
+                reader, output_base, thumbnail_format=config.COVER_THUMBNAIL_FORMAT,
+                thumbnail_size=config.COVER_THUMBNAIL_SIZE, thumbnail_quality=config.COVER_THUMBNAIL_QUALITY
+            )
             print(f"Cover page saved to: {output_file}")
             return output_file
 
@@ -137,12 +245,11 @@ class CoverPageExtractor(PDFMetadataExtractor):
             return None
 if __name__ == "__main__":
     file_path = "./books/7 thoi quen de thanh dat.pdf"
-    openai.api_key = os.getenv("OPENAI_API_KEY")
 
-    if not openai.api_key:
+    if not config.OPENAI_API_KEY:
         print("Error: OpenAI API key not found. Ensure it is set in the environment.")
         exit(1)
 
-    print(f"Using OpenAI model: {os.getenv('OPENAI_MODEL', 'gpt-3.5-turbo')}")
+    print(f"Using OpenAI model: {config.OPENAI_MODEL}")
 
 
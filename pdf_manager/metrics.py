@@ -0,0 +1,168 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values)) + (extra or [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+# Increments and observations made in a worker process, sent back to the parent with the result
+_recorded_metrics = contextvars.ContextVar("recorded_metrics", default=None)
+
+
+def _record(name, value, labels):
+    recorded = _recorded_metrics.get()
+    if recorded is not None:
+        recorded.append((name, value, labels))
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+        _record(self.name, amount, labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self.lock:
+            counts, total = self.series.get(key, ([0] * len(self.buckets), 0.0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self.series[key] = (counts, total + value)
+        _record(self.name, value, labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, (counts, total) in sorted(self.series.items()):
+                for bound, count in zip(self.buckets, counts):
+                    labels = _format_labels(self.labelnames, key, [("le", _format_value(bound))])
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+                lines.append(f"{self.name}_count{labels} {counts[-1]}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("pdf_stage_duration_seconds", "Time spent in each processing stage.", ["stage"])
+BYTES_PROCESSED = Counter("pdf_bytes_processed_total", "Bytes of PDF input processed.")
+PAGES_PARSED = Counter("pdf_pages_parsed_total", "Pages whose text was extracted.")
+LLM_TOKENS = Counter("llm_tokens_total", "LLM tokens used, by kind.", ["kind"])
+ERRORS = Counter("pdf_errors_total", "Errors raised or caught, by stage.", ["stage"])
+
+REGISTRY = [STAGE_SECONDS, BYTES_PROCESSED, PAGES_PARSED, LLM_TOKENS, ERRORS]
+
+# Per-request stage breakdown, only collected when a caller asks for it
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+@contextmanager
+def stage_timer(stage):
+    """
+    Time a block into the stage histogram (and the current request's breakdown, if one is being collected).
+    Exceptions escaping the block are counted as errors for the stage.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        ERRORS.inc(stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[stage] = round(timings.get(stage, 0.0) + elapsed, 6)
+
+
+def record_error(stage):
+    ERRORS.inc(stage=stage)
+
+
+@contextmanager
+def collect_timings():
+    """
+    Collect the stage timings recorded in this context into the yielded dict.
+    """
+    timings = {}
+    token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(token)
+
+
+@contextmanager
+def record_metrics():
+    """
+    Collect the counter increments and histogram observations made in this context into the yielded
+    list, for a worker process to return with its result and the parent to pass to `replay_metrics`.
+    """
+    recorded = []
+    token = _recorded_metrics.set(recorded)
+    try:
+        yield recorded
+    finally:
+        _recorded_metrics.reset(token)
+
+
+def replay_metrics(recorded):
+    # Apply metrics recorded in a worker process to this process's registry
+    metrics = {metric.name: metric for metric in REGISTRY}
+    for name, value, labels in recorded:
+        metric = metrics[name]
+        if isinstance(metric, Histogram):
+            metric.observe(value, **labels)
+        else:
+            metric.inc(value, **labels)
+
+
+def render_metrics():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,275 @@
+import hashlib
+import json
+import os
+import random
+import re
+import sqlite3
+import queue
+import struct
+import sys
+import threading
+import time
+
+import config
+
+# Shingle hashes are packed 16 bytes apart, room for a 64-bit multiplier times a 32-bit hash plus a 64-bit addend
+LANE_BYTES = 16
+ONE_LANE = (1).to_bytes(LANE_BYTES, "little")
+
+# Books waiting to be signed in the background; each holds its reader, so callers wait once this many are queued
+PENDING_REGISTRATIONS = 4
+
+# Bumped whenever signatures are computed differently; entries signed another way are dropped, not compared
+SIGNATURE_VERSION = 2
+
+SHINGLE_WORDS = 3
+# Fewer shingles than this (a few lines of text) match unrelated books too easily to be signed
+MIN_SHINGLES = 100
+WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def shingles(text, size=SHINGLE_WORDS):
+    # Overlapping runs of `size` words, case-folded, so reflowed or re-OCRed text still shares most of them
+    words = WORD.findall(text.lower())
+    if len(words) <= size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[index:index + size]) for index in range(len(words) - size + 1)}
+
+
+def text_hash(text):
+    # Digest of the words alone, so text that only differs in case, spacing or punctuation counts as exact
+    return hashlib.sha256(" ".join(WORD.findall(text.lower())).encode("utf-8")).hexdigest()
+
+
+def lane_minimum(data):
+    # Smallest of bits 32-63 over the little-endian lanes of `data`
+    if sys.byteorder == "little":
+        return min(memoryview(data).cast("I")[1::LANE_BYTES // 4])
+    return min(struct.iter_unpack(f"<4xI{LANE_BYTES - 8}x", data))[0]
+
+
+class MinHasher:
+    """
+    MinHash signatures of text: the fraction of positions two signatures agree on estimates the
+    Jaccard similarity of their shingle sets.
+
+    Each permutation is a multiply-add-shift hash, the top 32 bits of (a * x + b) mod 2**64. The shingle
+    hashes are packed into one integer, a lane each, so a permutation of the whole set is one big-integer
+    multiply and add, and its minimum is read from the result's bytes rather than computed shingle by shingle.
+    """
+
+    def __init__(self, num_perm=128, seed=1):
+        generator = random.Random(seed)
+        self.permutations = [(generator.getrandbits(64) | 1, generator.getrandbits(64)) for _ in range(num_perm)]
+
+    def signature(self, text, min_shingles=1):
+        hashes = [hashlib.blake2b(shingle.encode("utf-8"), digest_size=4).digest() for shingle in shingles(text)]
+        if not hashes or len(hashes) < min_shingles:
+            return None
+        padding = bytes(LANE_BYTES - 4)
+        packed = int.from_bytes(b"".join(value + padding for value in hashes), "little")
+        ones = int.from_bytes(ONE_LANE * len(hashes), "little")
+        size = LANE_BYTES * len(hashes)
+        return [lane_minimum((packed * a + ones * b).to_bytes(size, "little")) for a, b in self.permutations]
+
+
+def similarity(first, second):
+    return sum(1 for a, b in zip(first, second) if a == b) / len(first)
+
+
+class NearDuplicateIndex:
+    """
+    Locality-sensitive hashing index of MinHash signatures of processed books' body text, in SQLite.
+
+    Signatures are cut into `bands` bands; books sharing any band bucket become candidates, and only
+    those are compared in full, so a lookup reads a handful of rows rather than the whole library.
+    A book matches when its estimated similarity reaches `threshold`; its stored metadata can then be reused.
+    Entries also keep a `text_hash` of the signed text, so a match can tell an exact copy from a near one.
+    Text with fewer than `min_shingles` shingles isn't signed. `add_later` signs and adds books on a
+    background thread, so reading and signing their text is kept off the caller's path.
+    """
+
+    def __init__(self, db_path, num_perm=128, bands=16, threshold=0.8, min_shingles=MIN_SHINGLES):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands.")
+        self.db_path = db_path
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.min_shingles = min_shingles
+        self.hasher = MinHasher(num_perm)
+        self.lock = threading.Lock()
+        self.counters = {"lookups": 0, "candidates": 0, "matches": 0, "exact_matches": 0, "added": 0, "removed": 0}
+        # Background registrations: key -> ticket of its latest queued add, so a removal cancels it
+        self.pending = None
+        self.queued = {}
+        self.tickets = 0
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS books ("
+            "key TEXT PRIMARY KEY, signature BLOB NOT NULL, metadata TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            "band INTEGER NOT NULL, bucket INTEGER NOT NULL, key TEXT NOT NULL, "
+            "PRIMARY KEY (band, bucket, key)) WITHOUT ROWID"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS buckets_key ON buckets (key)")
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(books)")]
+        if "text_hash" not in columns:
+            self.connection.execute("ALTER TABLE books ADD COLUMN text_hash TEXT")
+        if "signature_version" not in columns:
+            self.connection.execute("ALTER TABLE books ADD COLUMN signature_version INTEGER")
+        stale = "SELECT key FROM books WHERE signature_version IS NOT ?"
+        self.connection.execute(f"DELETE FROM buckets WHERE key IN ({stale})", (SIGNATURE_VERSION,))
+        dropped = self.connection.execute(
+            "DELETE FROM books WHERE signature_version IS NOT ?", (SIGNATURE_VERSION,)
+        ).rowcount
+        if dropped:
+            print(f"Dropped {dropped} near-duplicate entries signed by an older version.")
+        self.connection.commit()
+
+    def signature(self, text):
+        return self.hasher.signature(text or "", self.min_shingles)
+
+    def band_buckets(self, signature):
+        for band in range(self.bands):
+            values = signature[band * self.rows:(band + 1) * self.rows]
+            digest = hashlib.blake2b(struct.pack(f"<{self.rows}I", *values), digest_size=8).digest()
+            yield band, int.from_bytes(digest, "little", signed=True)
+
+    def add(self, key, signature, metadata, text_hash=None):
+        if signature is None:
+            return
+        with self.lock:
+            self.queued.pop(key, None)
+            self._insert(key, signature, metadata, text_hash)
+
+    def _insert(self, key, signature, metadata, text_hash):
+        # Called with the lock held
+        self.connection.execute("DELETE FROM buckets WHERE key = ?", (key,))
+        self.connection.execute(
+            "INSERT OR REPLACE INTO books (key, signature, metadata, created_at, text_hash, signature_version) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                key, struct.pack(f"<{self.num_perm}I", *signature), json.dumps(metadata, ensure_ascii=False),
+                time.time(), text_hash, SIGNATURE_VERSION,
+            ),
+        )
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO buckets (band, bucket, key) VALUES (?, ?, ?)",
+            [(band, bucket, key) for band, bucket in self.band_buckets(signature)],
+        )
+        self.connection.commit()
+        self.counters["added"] += 1
+
+    def add_later(self, key, text, metadata):
+        """
+        Queue a book to be signed and added by the background thread. `text` is called there to get the
+        text to sign. Blocks while PENDING_REGISTRATIONS books are already waiting.
+        """
+        with self.lock:
+            if self.pending is None:
+                self.pending = queue.Queue(maxsize=PENDING_REGISTRATIONS)
+                threading.Thread(target=self._add_pending, name="near-duplicate-register", daemon=True).start()
+            self.tickets += 1
+            self.queued[key] = ticket = self.tickets
+        self.pending.put((key, ticket, text, metadata))
+
+    def _add_pending(self):
+        while True:
+            key, ticket, text, metadata = self.pending.get()
+            try:
+                text = text()
+                signature = self.signature(text)
+                with self.lock:
+                    # Skipped when the book was removed, added or queued again in the meantime
+                    if self.queued.get(key) == ticket:
+                        del self.queued[key]
+                        if signature is not None:
+                            self._insert(key, signature, metadata, text_hash(text))
+            except Exception as e:
+                print(f"Error registering {key} for near-duplicate detection: {e}")
+            finally:
+                self.pending.task_done()
+
+    def wait(self):
+        # Block until every queued book has been added
+        if self.pending is not None:
+            self.pending.join()
+
+    def remove(self, key):
+        with self.lock:
+            self.queued.pop(key, None)
+            self.connection.execute("DELETE FROM buckets WHERE key = ?", (key,))
+            removed = self.connection.execute("DELETE FROM books WHERE key = ?", (key,)).rowcount
+            self.connection.commit()
+            self.counters["removed"] += removed
+        return bool(removed)
+
+    def find(self, signature, text_hash=None):
+        """
+        Best match for a signature as {"key", "similarity", "exact", "metadata"}, or None below the threshold.
+        A match is exact when its stored text_hash equals `text_hash`.
+        """
+        if signature is None:
+            return None
+        with self.lock:
+            self.counters["lookups"] += 1
+            candidates = set()
+            for band, bucket in self.band_buckets(signature):
+                candidates.update(
+                    key for (key,) in self.connection.execute(
+                        "SELECT key FROM buckets WHERE band = ? AND bucket = ?", (band, bucket)
+                    )
+                )
+            self.counters["candidates"] += len(candidates)
+
+            best = None
+            for key in candidates:
+                row = self.connection.execute(
+                    "SELECT signature, metadata, text_hash FROM books WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None or len(row[0]) != 4 * self.num_perm:
+                    continue
+                score = similarity(signature, struct.unpack(f"<{self.num_perm}I", row[0]))
+                exact = text_hash is not None and row[2] == text_hash
+                if score >= self.threshold and (best is None or (exact, score) > (best["exact"], best["similarity"])):
+                    best = {"key": key, "similarity": score, "exact": exact, "metadata": json.loads(row[1])}
+            if best is not None:
+                self.counters["matches"] += 1
+                self.counters["exact_matches"] += best["exact"]
+        return best
+
+    def stats(self):
+        with self.lock:
+            entries = self.connection.execute("SELECT COUNT(*) FROM books").fetchone()[0]
+        return {
+            **self.counters, "entries": entries, "pending": len(self.queued), "num_perm": self.num_perm,
+            "bands": self.bands, "threshold": self.threshold,
+        }
+
+
+_near_duplicate_index = None
+_near_duplicate_index_lock = threading.Lock()
+
+
+def get_near_duplicate_index():
+    # Shared process-wide instance, created on first use; None when detection is turned off
+    global _near_duplicate_index
+    if not config.NEAR_DUPLICATE_THRESHOLD:
+        return None
+    with _near_duplicate_index_lock:
+        if _near_duplicate_index is None:
+            _near_duplicate_index = NearDuplicateIndex(
+                config.NEAR_DUPLICATE_DB_PATH,
+                num_perm=config.NEAR_DUPLICATE_PERMUTATIONS,
+                bands=config.NEAR_DUPLICATE_BANDS,
+                threshold=config.NEAR_DUPLICATE_THRESHOLD,
+            )
+        return _near_duplicate_index
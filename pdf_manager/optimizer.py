@@ -0,0 +1,558 @@
+import hashlib
+import math
+import os
+import re
+import zlib
+from io import BytesIO
+
+from PyPDF2 import PdfReader
+from PyPDF2.generic import (
+    ArrayObject,
+    DictionaryObject,
+    EncodedStreamObject,
+    IndirectObject,
+    NameObject,
+    NullObject,
+    NumberObject,
+    StreamObject,
+)
+
+from pdf_manager.large_file import open_reader
+
+# Filters that only inflate the data; streams using them are re-encoded with Flate
+TEXT_FILTERS = {"/ASCIIHexDecode", "/ASCII85Decode", "/AHx", "/A85"}
+
+# Page resource categories whose unused entries are dropped
+PRUNABLE_RESOURCES = ("/XObject", "/Font", "/ExtGState")
+
+# Dictionaries that must stay distinct objects even when identical
+UNMERGEABLE_TYPES = {"/Catalog", "/Pages", "/Page"}
+
+NAME_TOKEN = re.compile(rb"/([^\s/\[\]<>(){}%]+)")
+
+
+class HashingSink:
+    # Hashes serialized objects without holding their bytes
+    def __init__(self):
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.digest.update(data)
+        self.size += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.size
+
+
+class CountingSink:
+    # Stands in for a file when only the serialized size is needed
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.size
+
+
+def references(obj):
+    """
+    Yield every indirect reference held by an object, however deeply nested.
+    """
+    stack = [obj]
+    while stack:
+        current = stack.pop()
+        if isinstance(current, IndirectObject):
+            yield current
+        elif isinstance(current, dict):
+            stack.extend(current.values())
+        elif isinstance(current, list):
+            stack.extend(current)
+
+
+def remap(obj, mapping, undo=None):
+    """
+    Point references at the keys they map to, in place, and return how many were changed. With `undo`,
+    references missing from `mapping` become null and every replacement is recorded so `restore` can put
+    the originals back.
+    """
+    changed = 0
+    stack = [obj]
+    while stack:
+        current = stack.pop()
+        if isinstance(current, dict):
+            items = list(current.items())
+        elif isinstance(current, list):
+            items = list(enumerate(current))
+        else:
+            continue
+        for key, value in items:
+            if isinstance(value, IndirectObject):
+                target = mapping.get((value.idnum, value.generation))
+                if target is not None:
+                    replacement = IndirectObject(target[0], target[1], value.pdf)
+                elif undo is not None:
+                    replacement = NullObject()
+                else:
+                    continue
+                if undo is not None:
+                    undo.append((current, key, value))
+                current[key] = replacement
+                changed += 1
+            else:
+                stack.append(value)
+    return changed
+
+
+def restore(undo):
+    for container, key, value in reversed(undo):
+        container[key] = value
+
+
+def compress_stream(obj):
+    """
+    Flate-compressed copy of an uncompressed or ASCII-encoded stream, or the stream itself when that
+    wouldn't be smaller.
+    """
+    filters = obj.get("/Filter")
+    if filters is None:
+        data = obj._data
+    elif isinstance(filters, str) and filters in TEXT_FILTERS and "/DecodeParms" not in obj:
+        try:
+            data = obj.get_data()
+        except Exception:
+            return obj
+    else:
+        return obj
+    if not data:
+        return obj
+    compressed = flate_stream(obj, data)
+    return compressed if len(compressed._data) < len(obj._data) else obj
+
+
+def flate_stream(source, data, level=9):
+    # Copy of a stream's dictionary with the data Flate-encoded
+    stream = EncodedStreamObject()
+    for key, value in source.items():
+        if key not in ("/Length", "/Filter", "/DecodeParms"):
+            stream[NameObject(key)] = value
+    stream[NameObject("/Filter")] = NameObject("/FlateDecode")
+    stream._data = zlib.compress(data, level)
+    return stream
+
+
+def image_mode(color_space, resolve):
+    """
+    Pillow mode for an image colour space whose samples Pillow can read as they are, or None.
+    """
+    color_space = resolve(color_space)
+    if isinstance(color_space, list) and len(color_space) == 2 and color_space[0] == "/ICCBased":
+        profile = resolve(color_space[1])
+        components = profile.get("/N") if isinstance(profile, StreamObject) else None
+        return {1: "L", 3: "RGB"}.get(components)
+    return {"/DeviceRGB": "RGB", "/DeviceGray": "L", "/DeviceCMYK": "CMYK"}.get(
+        color_space if isinstance(color_space, str) else None
+    )
+
+
+def decode_image(image, mode, draft_size=None):
+    """
+    Decode an 8-bit DCT, Flate or unfiltered image stream with Pillow. JPEGs are decoded at reduced scale
+    when `draft_size` allows it.
+    """
+    from PIL import Image
+
+    if image.get("/Filter") == "/DCTDecode":
+        decoded = Image.open(BytesIO(image._data))
+        if draft_size:
+            decoded.draft(mode, draft_size)
+        return decoded.convert(mode)
+    return Image.frombytes(mode, (int(image["/Width"]), int(image["/Height"])), image.get_data())
+
+
+class PDFOptimizer:
+    """
+    Shrinks a PDF towards a byte budget and reports the bytes saved by each step.
+
+    The document is loaded as the object graph reachable from its trailer, which drops unused objects
+    and superseded incremental revisions. Lossless steps run first (merge identical objects, drop unused
+    page resources, Flate-compress uncompressed streams); if the budget still isn't met and `dpi` is set,
+    images are downsampled to that resolution at page size and re-encoded as JPEG, with the resolution
+    and quality lowered each round down to `min_dpi`. Steps stop as soon as the budget is met; without
+    a budget every lossless step runs and images are only downsampled when `dpi` is given.
+
+    With `lazy`, the file is memory-mapped and only changed dictionaries are kept in memory: unchanged
+    objects are read back from the file whenever they are needed, and compression and downsampling are
+    applied to streams as they are written. Memory stays flat as the input grows, at the cost of
+    re-reading the file and re-encoding images for every size measurement.
+    """
+
+    def __init__(self, input_pdf, target_bytes=None, dpi=None, min_dpi=72, jpeg_quality=80, lazy=False):
+        self.input_pdf = input_pdf
+        self.target_bytes = target_bytes
+        self.dpi = dpi
+        self.min_dpi = min_dpi
+        self.jpeg_quality = jpeg_quality
+        self.lazy = lazy
+        self.reader = open_reader(input_pdf) if lazy else PdfReader(input_pdf)
+        if self.reader.is_encrypted:
+            raise ValueError("Optimizing encrypted PDFs is not supported")
+        # Key -> object; in lazy mode None for objects that are read from the file when needed
+        self.objects = {}
+        # Lazy mode: functions applied to objects read from the file, and (dpi, quality) for downsampled images
+        self.deferred = {}
+        self.downsampled = {}
+        self.original_images = {}
+        self.root = None
+        self.info = None
+        self.page_inches = None
+
+    # Object graph
+
+    def load(self):
+        trailer = self.reader.trailer
+        self.root = trailer.raw_get("/Root")
+        self.info = trailer.raw_get("/Info") if "/Info" in trailer else None
+        self.collect()
+
+    def collect(self):
+        # Keep only what is reachable from the catalog and the document info
+        reachable = {}
+        stack = [ref for ref in (self.root, self.info) if isinstance(ref, IndirectObject)]
+        while stack:
+            ref = stack.pop()
+            key = (ref.idnum, ref.generation)
+            if key in reachable:
+                continue
+            obj = self.get(key) if key in self.objects else self.read(key)
+            if obj is None:
+                continue
+            reachable[key] = self.objects.get(key) if self.lazy else obj
+            stack.extend(references(obj))
+        self.objects = reachable
+        for state in (self.deferred, self.downsampled, self.original_images):
+            for key in [key for key in state if key not in reachable]:
+                del state[key]
+
+    def read(self, key):
+        obj = self.reader.get_object(IndirectObject(key[0], key[1], self.reader))
+        if self.lazy:
+            # Keep the reader's cache from growing into a copy of the file
+            self.reader.resolved_objects.pop((key[1], key[0]), None)
+        return obj
+
+    def get(self, key, downsampled=True):
+        """
+        The object as it will be written.
+        """
+        obj = self.objects[key]
+        if obj is not None:
+            return obj
+        obj = self.read(key)
+        for function in self.deferred.get(key, ()):
+            obj = function(obj)
+        if downsampled and key in self.downsampled:
+            obj = self.downsample_image(obj, *self.downsampled[key]) or obj
+        return obj
+
+    def store(self, key, obj):
+        # Keep a changed object in memory; it replaces whatever would be read from the file
+        self.objects[key] = obj
+        self.deferred.pop(key, None)
+        self.downsampled.pop(key, None)
+
+    def resolve(self, value):
+        if isinstance(value, IndirectObject):
+            key = (value.idnum, value.generation)
+            return self.get(key) if key in self.objects else None
+        return value
+
+    def size(self):
+        sink = CountingSink()
+        self.write_to(sink)
+        return sink.size
+
+    def write_to(self, stream):
+        numbers = {key: index + 1 for index, key in enumerate(sorted(self.objects))}
+        mapping = {key: (number, 0) for key, number in numbers.items()}
+
+        stream.write(self.reader.pdf_header.encode("latin-1") + b"\n%\xe2\xe3\xcf\xd3\n")
+        offsets = []
+        for key in sorted(self.objects):
+            offsets.append(stream.tell())
+            stream.write(f"{numbers[key]} 0 obj\n".encode("latin-1"))
+            obj = self.get(key)
+            undo = []
+            remap(obj, mapping, undo)
+            try:
+                obj.write_to_stream(stream, None)
+            finally:
+                # Put the original references back so the graph stays usable for further steps
+                restore(undo)
+            stream.write(b"\nendobj\n")
+
+        xref_offset = stream.tell()
+        stream.write(f"xref\n0 {len(offsets) + 1}\n0000000000 65535 f \n".encode("latin-1"))
+        for offset in offsets:
+            stream.write(f"{offset:010d} 00000 n \n".encode("latin-1"))
+        trailer = DictionaryObject()
+        trailer[NameObject("/Size")] = NumberObject(len(offsets) + 1)
+        trailer[NameObject("/Root")] = IndirectObject(*mapping[(self.root.idnum, self.root.generation)], None)
+        if self.info is not None and (self.info.idnum, self.info.generation) in mapping:
+            trailer[NameObject("/Info")] = IndirectObject(*mapping[(self.info.idnum, self.info.generation)], None)
+        if "/ID" in self.reader.trailer:
+            trailer[NameObject("/ID")] = self.reader.trailer["/ID"]
+        stream.write(b"trailer\n")
+        trailer.write_to_stream(stream, None)
+        stream.write(f"\nstartxref\n{xref_offset}\n%%EOF\n".encode("latin-1"))
+
+    # Steps
+
+    def dedupe(self):
+        # Merge identical objects; repeat, since merging children can make their parents identical
+        while True:
+            canonical = {}
+            mapping = {}
+            for key in sorted(self.objects):
+                obj = self.get(key)
+                if isinstance(obj, DictionaryObject) and obj.get("/Type") in UNMERGEABLE_TYPES:
+                    continue
+                sink = HashingSink()
+                sink.write(type(obj).__name__.encode())
+                obj.write_to_stream(sink, None)
+                digest = sink.digest.digest()
+                if digest in canonical:
+                    mapping[key] = canonical[digest]
+                else:
+                    canonical[digest] = key
+            if not mapping:
+                return
+            for key in mapping:
+                del self.objects[key]
+            for key in list(self.objects):
+                obj = self.get(key)
+                if remap(obj, mapping):
+                    self.store(key, obj)
+
+    def pages(self):
+        # (key, page dictionary) pairs, walking the page tree
+        stack = [self.root.get_object().raw_get("/Pages")]
+        seen = set()
+        while stack:
+            ref = stack.pop()
+            if not isinstance(ref, IndirectObject):
+                continue
+            key = (ref.idnum, ref.generation)
+            node = self.resolve(ref)
+            if not isinstance(node, DictionaryObject) or key in seen:
+                continue
+            seen.add(key)
+            if node.get("/Type") == "/Pages" or "/Kids" in node:
+                stack.extend(reversed(list(self.resolve(node.raw_get("/Kids")) or [])))
+            else:
+                yield key, node
+
+    def page_content(self, page):
+        contents = self.resolve(page.raw_get("/Contents")) if "/Contents" in page else None
+        streams = contents if isinstance(contents, list) else [contents]
+        data = b""
+        for stream in streams:
+            stream = self.resolve(stream)
+            if not isinstance(stream, StreamObject):
+                continue
+            data += stream.get_data() + b"\n"
+        return data
+
+    def prune_resources(self):
+        for key, page in self.pages():
+            if "/Resources" not in page:
+                continue
+            try:
+                used = set(NAME_TOKEN.findall(self.page_content(page)))
+            except Exception:
+                continue
+            # Names with #xx escapes would need decoding to compare; leave such pages alone
+            if any(b"#" in name for name in used):
+                continue
+            resources = self.resolve(page.raw_get("/Resources"))
+            if not isinstance(resources, DictionaryObject):
+                continue
+            # Forms without their own resources draw with the page's, so their names count as used too
+            forms = self.resolve(resources.raw_get("/XObject")) if "/XObject" in resources else None
+            if isinstance(forms, DictionaryObject) and any(
+                isinstance(form, StreamObject) and form.get("/Subtype") == "/Form" and "/Resources" not in form
+                for form in map(self.resolve, forms.values())
+            ):
+                continue
+            pruned = DictionaryObject(resources)
+            changed = False
+            for category in PRUNABLE_RESOURCES:
+                entries = self.resolve(resources.raw_get(category)) if category in resources else None
+                if not isinstance(entries, DictionaryObject):
+                    continue
+                kept = DictionaryObject(
+                    {name: value for name, value in entries.items() if name[1:].encode("latin-1", "replace") in used}
+                )
+                if len(kept) < len(entries):
+                    pruned[NameObject(category)] = kept
+                    changed = True
+            # A copy per page, since the original dictionary may be shared with other pages
+            if changed:
+                page[NameObject("/Resources")] = pruned
+                self.store(key, page)
+        self.collect()
+
+    def compress_streams(self):
+        for key in list(self.objects):
+            obj = self.get(key)
+            if not isinstance(obj, StreamObject):
+                continue
+            compressed = compress_stream(obj)
+            if compressed is obj:
+                continue
+            if self.objects[key] is None:
+                self.deferred.setdefault(key, []).append(compress_stream)
+            else:
+                self.objects[key] = compressed
+
+    def page_size_inches(self):
+        width = height = 0.0
+        for _, page in self.pages():
+            box = self.resolve(page.raw_get("/MediaBox")) if "/MediaBox" in page else None
+            if isinstance(box, list) and len(box) == 4:
+                values = [float(self.resolve(value)) for value in box]
+                width = max(width, abs(values[2] - values[0]) / 72)
+                height = max(height, abs(values[3] - values[1]) / 72)
+        return (width or 8.5), (height or 11.0)
+
+    def downsample_images(self, dpi, quality):
+        """
+        Re-encode images larger than `dpi` at page size as JPEG, starting from the original image each round.
+        Returns the number of images replaced.
+        """
+        try:
+            import PIL  # noqa: F401
+        except ImportError:
+            print("Pillow is not installed; skipping image downsampling.")
+            return 0
+
+        self.page_inches = self.page_size_inches()
+        replaced = 0
+        for key in list(self.objects):
+            if self.objects[key] is None:
+                # Lazy mode: record the settings; the image is re-encoded whenever it is written
+                if self.downsample_image(self.get(key, downsampled=False), dpi, quality) is None:
+                    continue
+                self.downsampled[key] = (dpi, quality)
+            else:
+                original = self.original_images.get(key, self.objects[key])
+                stream = self.downsample_image(original, dpi, quality)
+                if stream is None:
+                    continue
+                self.original_images.setdefault(key, original)
+                self.objects[key] = stream
+            replaced += 1
+        return replaced
+
+    def downsample_image(self, original, dpi, quality):
+        """
+        JPEG copy of an image stream at `dpi` for the page size, or None when the image can't be
+        re-encoded or wouldn't get smaller.
+        """
+        from PIL import Image
+
+        if not isinstance(original, StreamObject) or original.get("/Subtype") != "/Image":
+            return None
+        if original.get("/BitsPerComponent") != 8 or original.get("/ImageMask") or "/Decode" in original:
+            return None
+        mode = image_mode(original.get("/ColorSpace"), self.resolve)
+        if mode is None or isinstance(original.get("/Mask"), list):
+            return None
+        page_width, page_height = self.page_inches
+        width, height = int(original["/Width"]), int(original["/Height"])
+        scale = min(page_width * dpi / width, page_height * dpi / height, 1.0)
+        if scale > 0.95 and original.get("/Filter") == "/DCTDecode":
+            return None
+        try:
+            image = decode_image(original, mode, (math.ceil(width * scale), math.ceil(height * scale)))
+        except Exception:
+            return None
+        if scale < 1.0:
+            size = (max(math.ceil(width * scale), 1), max(math.ceil(height * scale), 1))
+            image = image.resize(size, Image.LANCZOS)
+        if mode == "CMYK":
+            # CMYK JPEGs are stored inverted by some encoders; RGB renders the same everywhere
+            image = image.convert("RGB")
+        output = BytesIO()
+        image.save(output, format="JPEG", quality=quality, optimize=True)
+        if output.tell() >= len(original._data):
+            return None
+
+        stream = EncodedStreamObject()
+        for name, value in original.items():
+            if name not in ("/Length", "/Filter", "/DecodeParms", "/Width", "/Height"):
+                stream[NameObject(name)] = value
+        stream[NameObject("/Width")] = NumberObject(image.width)
+        stream[NameObject("/Height")] = NumberObject(image.height)
+        stream[NameObject("/Filter")] = NameObject("/DCTDecode")
+        if mode == "CMYK":
+            stream[NameObject("/ColorSpace")] = NameObject("/DeviceRGB")
+        stream._data = output.getvalue()
+        return stream
+
+    # Driver
+
+    def budget_met(self, size):
+        return self.target_bytes is not None and size <= self.target_bytes
+
+    def run(self, output_pdf):
+        """
+        Optimize into `output_pdf` (which may be the input path) and return the per-step report.
+        The output is only written when it ends up smaller than the input.
+        """
+        original_size = os.path.getsize(self.input_pdf)
+        report = {"original_bytes": original_size, "target_bytes": self.target_bytes, "steps": []}
+
+        def record(step, before, **details):
+            after = self.size()
+            report["steps"].append({"step": step, "bytes": after, "saved": before - after, **details})
+            return after
+
+        self.load()
+        size = record("rewrite", original_size)
+        for step, action in (
+            ("dedupe", self.dedupe),
+            ("prune_resources", self.prune_resources),
+            ("compress_streams", self.compress_streams),
+        ):
+            if self.budget_met(size):
+                break
+            action()
+            size = record(step, size)
+
+        if self.dpi and not self.budget_met(size):
+            dpi, quality = self.dpi, self.jpeg_quality
+            while True:
+                images = self.downsample_images(dpi, quality)
+                size = record("downsample_images", size, dpi=dpi, quality=quality, images=images)
+                if self.target_bytes is None or self.budget_met(size) or dpi <= self.min_dpi:
+                    break
+                dpi = max(int(dpi * 0.75), self.min_dpi)
+                quality = max(quality - 10, 40)
+
+        report["final_bytes"] = min(size, original_size)
+        report["saved"] = original_size - report["final_bytes"]
+        report["met_target"] = self.target_bytes is None or report["final_bytes"] <= self.target_bytes
+        report["written"] = size < original_size
+        if report["written"]:
+            temp_path = f"{output_pdf}.optimizing"
+            with open(temp_path, "wb") as output:
+                self.write_to(output)
+            os.replace(temp_path, output_pdf)
+        elif output_pdf != self.input_pdf:
+            report["output"] = self.input_pdf
+        return report
@@ -0,0 +1,213 @@
+import re
+
+from pdf_manager.page_text import extract_text_in_worker, page_has_text
+from pdf_manager.process_pool import get_process_pool, in_worker_process
+
+# Patterns that usually sit on title, copyright and colophon pages, with their weights
+METADATA_SIGNALS = [
+    (re.compile(r"\bISBN", re.IGNORECASE), 5),
+    (re.compile(r"©|\(c\)\s*(?:19|20)\d{2}|\bcopyright\b", re.IGNORECASE), 3),
+    (re.compile(r"\bpublished\s+by\b|\bpublisher\b|\bnhà xuất bản\b|\bNXB\b", re.IGNORECASE), 3),
+    (re.compile(r"\bedition\b|\btái bản\b", re.IGNORECASE), 2),
+    (re.compile(r"\ball rights reserved\b|\bprinted in\b|\blibrary of congress\b", re.IGNORECASE), 2),
+    (re.compile(r"\btranslated by\b|\bauthor\b|\btác giả\b", re.IGNORECASE), 1),
+]
+
+SNIPPET_RADIUS = 300
+CHARS_PER_TOKEN = 4
+# The first pages with text are kept even without signals: the title page carries the title and author in
+# large type and little else, and may come after an image-only cover. Each takes at most a quarter of the budget.
+FRONT_MATTER_PAGES = 2
+FRONT_MATTER_SHARE = 4
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def score_text(text):
+    """
+    Return (score, spans): weighted count of metadata signals and the character spans where they matched.
+    """
+    score = 0
+    spans = []
+    for pattern, weight in METADATA_SIGNALS:
+        for match in pattern.finditer(text):
+            score += weight
+            spans.append((match.start(), match.end()))
+    return score, spans
+
+
+def candidate_pages(total_pages, n_pages):
+    # Alternate between the front and the back of the book, where metadata pages live
+    front = list(range(0, min(n_pages, total_pages)))
+    back = list(range(total_pages - 1, max(total_pages - n_pages, 0) - 1, -1))
+    ordered = []
+    for index in range(max(len(front), len(back))):
+        for pages in (front, back):
+            if index < len(pages) and pages[index] not in ordered:
+                ordered.append(pages[index])
+    return ordered
+
+
+def snippets_for_page(text, spans):
+    # Merge the windows around every signal so the same text isn't included twice
+    windows = []
+    for start, end in sorted(spans):
+        start, end = max(start - SNIPPET_RADIUS, 0), min(end + SNIPPET_RADIUS, len(text))
+        if windows and start <= windows[-1][1]:
+            windows[-1] = (windows[-1][0], max(windows[-1][1], end))
+        else:
+            windows.append((start, end))
+    return [text[start:end].strip() for start, end in windows]
+
+
+class PageTextSelector:
+    """
+    Picks the page text worth sending to the LLM.
+
+    Pages are extracted front/back alternately and scored for metadata signals; extraction stops once
+    enough signal is found and the title page has been read, and the best snippets are packed into a
+    token budget. The first pages with text are always kept because they usually carry the title and
+    author, whether or not the cover before them is an image.
+
+    With a `file_path`, more than one worker and at least `pool_min_pages` candidate pages, pages are
+    extracted on the process pool in waves of `workers` pages, so the early stop is checked after each wave;
+    fewer pages are extracted in process, which is cheaper than every worker parsing the file again. Pages
+    that draw no text are skipped without decoding, and extracted text is kept in `cache` under the file's
+    hash, `file_hash` when the caller already knows it.
+    """
+
+    def __init__(self, reader, n_pages, token_budget=1500, signal_target=10, file_path=None, workers=1, cache=None,
+                 file_hash=None, pool_min_pages=0):
+        self.reader = reader
+        self.n_pages = n_pages
+        self.token_budget = token_budget
+        self.signal_target = signal_target
+        self.file_path = file_path
+        # Workers of the pool itself extract serially instead of queueing behind their own pages
+        self.workers = workers if file_path is not None and not in_worker_process() else 1
+        self.cache = cache if file_path else None
+        self.file_hash = file_hash
+        self.pool_min_pages = pool_min_pages
+        self.pages_extracted = 0
+        self.pages_skipped = 0
+        self.pages_cached = 0
+
+    def extract_page(self, page_num):
+        try:
+            return self.reader.pages[page_num].extract_text() or ""
+        except Exception as e:
+            print(f"Error extracting text from page {page_num}: {e}")
+            return None
+
+    def extract_pages(self, page_nums):
+        """
+        Text of each page in `page_nums`, from the cache, the text pre-check or the extractor.
+        """
+        texts = {}
+        if self.cache is not None:
+            try:
+                if self.file_hash is None:
+                    self.file_hash = self.cache.file_hash(self.file_path)
+                texts = self.cache.get_many(self.file_hash, page_nums)
+            except Exception as e:
+                print(f"Error reading page text cache: {e}")
+                self.cache = None
+        self.pages_cached += len(texts)
+        cached = set(texts)
+
+        pending = []
+        for page_num in page_nums:
+            if page_num in texts:
+                continue
+            if page_has_text(self.reader.pages[page_num]):
+                pending.append(page_num)
+            else:
+                texts[page_num] = ""
+                self.pages_skipped += 1
+
+        extracted = {}
+        if self.workers > 1 and len(pending) > 1:
+            pool = get_process_pool()
+            futures = {page_num: pool.submit(extract_text_in_worker, self.file_path, page_num) for page_num in pending}
+            for page_num, future in futures.items():
+                try:
+                    extracted[page_num] = future.result()
+                except Exception as e:
+                    print(f"Error extracting text from page {page_num}: {e}")
+                    extracted[page_num] = None
+        else:
+            for page_num in pending:
+                extracted[page_num] = self.extract_page(page_num)
+        self.pages_extracted += len(pending)
+
+        # Failed pages count as empty but aren't cached, so they are tried again next time
+        for page_num, text in extracted.items():
+            texts[page_num] = text or ""
+        if self.cache is not None:
+            try:
+                self.cache.set_many(self.file_hash, {
+                    page_num: texts[page_num] for page_num in page_nums
+                    if page_num not in cached and extracted.get(page_num, "") is not None
+                })
+            except Exception as e:
+                print(f"Error writing page text cache: {e}")
+        return texts
+
+    def select(self):
+        total_pages = len(self.reader.pages)
+        candidates = candidate_pages(total_pages, self.n_pages)
+        if len(candidates) < self.pool_min_pages:
+            self.workers = 1
+        wave = max(self.workers, 1)
+        scored = []
+        signal = 0
+        for start in range(0, len(candidates), wave):
+            page_nums = candidates[start:start + wave]
+            texts = self.extract_pages(page_nums)
+            for page_num in page_nums:
+                score, spans = score_text(texts[page_num])
+                scored.append((page_num, texts[page_num], score, spans))
+                signal += score
+            if signal >= self.signal_target and self.title_page_read(scored, min(self.n_pages, total_pages)):
+                break
+        return self.pack(scored)
+
+    @staticmethod
+    def title_page_read(scored, front_pages):
+        # Front pages are extracted in order, so the first one with text is the title page
+        front = [text for page_num, text, _, _ in scored if page_num < front_pages]
+        return any(text.strip() for text in front) or len(front) == front_pages
+
+    def front_matter(self, scored):
+        front = sorted(page_num for page_num, text, _, _ in scored if page_num < self.n_pages and text.strip())
+        return set(front[:FRONT_MATTER_PAGES])
+
+    def pack(self, scored):
+        # Front matter first, then pages by descending signal; whole pages when they fit, snippets otherwise
+        keep = self.front_matter(scored)
+        ranked = sorted(scored, key=lambda item: (item[0] not in keep, -item[2], item[0]))
+        remaining = self.token_budget
+        chosen = {}
+        for page_num, text, score, spans in ranked:
+            if remaining <= 0 or not text.strip():
+                continue
+            if page_num not in keep and score == 0:
+                continue
+            limit = remaining if score else min(remaining, self.token_budget // FRONT_MATTER_SHARE)
+            if estimate_tokens(text) <= limit:
+                piece = text.strip()
+            else:
+                # The top of a page without signals is where its title sits
+                pieces = snippets_for_page(text, spans) if spans else [text]
+                piece = "\n...\n".join(pieces)
+                piece = piece[:limit * CHARS_PER_TOKEN]
+            chosen[page_num] = piece
+            remaining -= estimate_tokens(piece)
+
+        # Fall back to plain text when no page carried any signal
+        if not chosen:
+            budget_chars = self.token_budget * CHARS_PER_TOKEN
+            return "\n".join(text for _, text, _, _ in sorted(scored))[:budget_chars]
+        return "\n".join(chosen[page_num] for page_num in sorted(chosen))
@@ -0,0 +1,176 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from PyPDF2.generic import StreamObject
+
+import config
+from pdf_manager.catalog import file_sha256
+from pdf_manager.cover import content_data
+from pdf_manager.large_file import open_reader
+
+# A text object starts with the BT operator; pages without one draw no text
+TEXT_OBJECT = re.compile(rb"(?<![^\s\[\]()<>{}/%])BT(?![^\s\[\]()<>{}/%])")
+XOBJECT_CALL = re.compile(rb"/([^\s/\[\]<>(){}%]+)\s*Do(?![^\s\[\]()<>{}/%])")
+
+
+def content_has_text(data, resources, depth=0):
+    if TEXT_OBJECT.search(data):
+        return True
+    resources = resources.get_object() if resources is not None else None
+    xobjects = resources.get("/XObject") if resources is not None else None
+    if not xobjects or depth >= 4:
+        return False
+    for name in set(XOBJECT_CALL.findall(data)):
+        # Escaped names would need decoding to look up; assume they may draw text
+        if b"#" in name:
+            return True
+        form = xobjects.get("/" + name.decode("latin-1"))
+        form = form.get_object() if form is not None else None
+        if isinstance(form, StreamObject) and form.get("/Subtype") == "/Form":
+            if content_has_text(form.get_data(), form.get("/Resources") or resources, depth + 1):
+                return True
+    return False
+
+
+def page_has_text(page):
+    """
+    Whether a page draws any text, from its content stream and the forms it draws. Much cheaper than
+    running the text extractor, so image-only pages (scans) are skipped without a full decode.
+    """
+    try:
+        data = content_data(page.raw_get("/Contents") if "/Contents" in page else None)
+        return content_has_text(data, page.get("/Resources"))
+    except Exception:
+        # When in doubt, let the extractor decide
+        return True
+
+
+_worker_reader = None
+
+
+def extract_text_in_worker(file_path, page_num):
+    # Runs in a pool worker; the parsed document is kept for the next pages of the same file
+    global _worker_reader
+    stat = os.stat(file_path)
+    identity = (file_path, stat.st_size, stat.st_mtime_ns)
+    if _worker_reader is None or _worker_reader[0] != identity:
+        _worker_reader = (identity, open_reader(file_path))
+    return _worker_reader[1].pages[page_num].extract_text() or ""
+
+
+class PageTextCache:
+    """
+    Extracted page text keyed by the file's SHA-256 and the page number, stored in SQLite.
+
+    File hashes are remembered by path, size and modification time, so a file is only hashed once.
+    The table is trimmed to `max_bytes` by least recent access.
+    """
+
+    def __init__(self, db_path, max_bytes=100 * 1024 * 1024):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS page_text ("
+            "file_hash TEXT NOT NULL, page INTEGER NOT NULL, text TEXT NOT NULL, size INTEGER NOT NULL, "
+            "accessed_at REAL NOT NULL, PRIMARY KEY (file_hash, page))"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS page_text_accessed ON page_text (accessed_at)")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS file_hashes ("
+            "path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, sha256 TEXT NOT NULL)"
+        )
+        self.connection.commit()
+
+    def file_hash(self, path):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT sha256 FROM file_hashes WHERE path = ? AND size = ? AND mtime_ns = ?",
+                (path, stat.st_size, stat.st_mtime_ns),
+            ).fetchone()
+        if row is not None:
+            return row[0]
+        sha256 = file_sha256(path)
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO file_hashes (path, size, mtime_ns, sha256) VALUES (?, ?, ?, ?)",
+                (path, stat.st_size, stat.st_mtime_ns, sha256),
+            )
+            self.connection.commit()
+        return sha256
+
+    def get_many(self, file_hash, pages):
+        if not pages:
+            return {}
+        placeholders = ", ".join("?" for _ in pages)
+        with self.lock:
+            rows = self.connection.execute(
+                f"SELECT page, text FROM page_text WHERE file_hash = ? AND page IN ({placeholders})",
+                (file_hash, *pages),
+            ).fetchall()
+            if rows:
+                self.connection.execute(
+                    f"UPDATE page_text SET accessed_at = ? WHERE file_hash = ? AND page IN ({placeholders})",
+                    (time.time(), file_hash, *pages),
+                )
+                self.connection.commit()
+            self.counters["hits"] += len(rows)
+            self.counters["misses"] += len(pages) - len(rows)
+        return dict(rows)
+
+    def set_many(self, file_hash, texts):
+        if not texts:
+            return
+        now = time.time()
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO page_text (file_hash, page, text, size, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                [(file_hash, page, text, len(text.encode("utf-8")), now) for page, text in texts.items()],
+            )
+            self._evict()
+            self.connection.commit()
+            self.counters["writes"] += len(texts)
+
+    def _evict(self):
+        total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM page_text").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for file_hash, page, size in self.connection.execute(
+            "SELECT file_hash, page, size FROM page_text ORDER BY accessed_at ASC"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            self.connection.execute("DELETE FROM page_text WHERE file_hash = ? AND page = ?", (file_hash, page))
+            total -= size
+            self.counters["evictions"] += 1
+
+    def stats(self):
+        with self.lock:
+            entries, size = self.connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM page_text"
+            ).fetchone()
+            return {**self.counters, "entries": entries, "bytes": size, "max_bytes": self.max_bytes}
+
+
+_page_text_cache = None
+_page_text_cache_lock = threading.Lock()
+
+
+def get_page_text_cache():
+    # Shared process-wide instance, created on first use
+    global _page_text_cache
+    with _page_text_cache_lock:
+        if _page_text_cache is None:
+            _page_text_cache = PageTextCache(config.PAGE_TEXT_CACHE_PATH, max_bytes=config.PAGE_TEXT_CACHE_MAX_BYTES)
+        return _page_text_cache
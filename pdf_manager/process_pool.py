@@ -0,0 +1,33 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import config
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def get_process_pool():
+    # Spawned workers so forking a threaded server process is never an issue
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(
+                max_workers=config.BATCH_PROCESS_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _process_pool
+
+
+def shutdown_process_pool():
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=False, cancel_futures=True)
+            _process_pool = None
+
+
+def in_worker_process():
+    # Work already running in a pool worker stays there instead of fanning out again
+    return multiprocessing.parent_process() is not None
@@ -0,0 +1,308 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+
+class UploadError(Exception):
+    pass
+
+
+class UploadNotFoundError(UploadError):
+    pass
+
+
+class UploadConflictError(UploadError):
+    pass
+
+
+class ChecksumMismatchError(UploadError):
+    pass
+
+
+# How long a chunk waits for the one before it on the same upload before it is turned away
+CHUNK_LOCK_TIMEOUT = 30
+
+
+def merge_ranges(ranges, start, end):
+    # Keep the received byte ranges sorted and non-overlapping
+    merged = []
+    for range_start, range_end in sorted(ranges + [[start, end]]):
+        if merged and range_start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], range_end)
+        else:
+            merged.append([range_start, range_end])
+    return merged
+
+
+def committed_offset(ranges):
+    # Bytes received without a gap from the start of the file
+    return ranges[0][1] if ranges and ranges[0][0] == 0 else 0
+
+
+class _HashState:
+    def __init__(self):
+        self.digest = hashlib.sha256()
+        self.offset = 0
+
+
+class ChunkWriter:
+    """
+    Writes one chunk of an upload at its offset while holding the upload's lock. Bytes written before
+    the stream breaks off are kept on close, which releases the lock, so the client can resume from the new offset.
+    """
+
+    def __init__(self, uploads, upload_id, offset, length, lock):
+        self.uploads = uploads
+        self.upload_id = upload_id
+        self.offset = offset
+        self.position = offset
+        self.length = length
+        self.lock = lock
+        self.fd = os.open(uploads.partial_path(upload_id), os.O_WRONLY)
+        # The chunk that continues the hashed prefix feeds the digest directly
+        self.state = uploads.hash_state(upload_id)
+        self.hashing = self.state.offset == offset
+
+    def write(self, data):
+        if self.position + len(data) > self.length:
+            raise UploadConflictError("Chunk runs past the end of the upload.")
+        os.pwrite(self.fd, data, self.position)
+        if self.hashing:
+            self.state.digest.update(data)
+        self.position += len(data)
+
+    def close(self):
+        if self.fd is None:
+            return
+        os.close(self.fd)
+        self.fd = None
+        try:
+            if self.position > self.offset:
+                self.uploads._commit(self.upload_id, self.offset, self.position)
+            if self.hashing:
+                self.state.offset = self.position
+            self.uploads._catch_up_hash(self.upload_id)
+        finally:
+            self.lock.release()
+
+
+class ResumableUploads:
+    """
+    Resumable uploads in the style of the tus protocol, with their state persisted in SQLite.
+
+    An upload is created with its total length, and chunks are then written at any offset and in any order
+    straight into a partial file in the upload directory; finishing renames that file into place, so the
+    bytes are never copied twice. Chunks of one upload are written one at a time under a per-upload lock,
+    and bytes already hashed can't be written again. The SHA-256 is updated from the chunk bytes as they
+    arrive whenever a chunk continues the hashed prefix; chunks that arrived early are read back once the
+    gap before them is filled. The digest lives in memory only: after a restart it is rebuilt by reading
+    the received prefix back from the partial file.
+    """
+
+    def __init__(self, db_path, directory, max_bytes=None):
+        self.db_path = db_path
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hashes = {}
+        self.upload_locks = {}
+
+        os.makedirs(directory, exist_ok=True)
+        db_directory = os.path.dirname(db_path)
+        if db_directory:
+            os.makedirs(db_directory, exist_ok=True)
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS uploads ("
+            "id TEXT PRIMARY KEY, file_name TEXT NOT NULL, length INTEGER NOT NULL, ranges TEXT NOT NULL, "
+            "status TEXT NOT NULL, sha256 TEXT, expected_sha256 TEXT, options TEXT, job_id TEXT, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self.connection.commit()
+
+    def partial_path(self, upload_id):
+        return os.path.join(self.directory, f".{upload_id}.part")
+
+    def create(self, file_name, length, expected_sha256=None, options=None):
+        if length < 0:
+            raise UploadError("Upload length must not be negative.")
+        if self.max_bytes and length > self.max_bytes:
+            raise UploadError(f"Upload length exceeds the {self.max_bytes} byte limit.")
+        upload_id = uuid.uuid4().hex
+        # Sized up front so chunks can land at any offset
+        with open(self.partial_path(upload_id), "wb") as file:
+            file.truncate(length)
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                "INSERT INTO uploads (id, file_name, length, ranges, status, expected_sha256, options, created_at, updated_at) "
+                "VALUES (?, ?, ?, '[]', 'uploading', ?, ?, ?, ?)",
+                (upload_id, file_name, length, expected_sha256, json.dumps(options or {}), now, now),
+            )
+            self.connection.commit()
+            self.hashes[upload_id] = _HashState()
+        return self.get(upload_id)
+
+    def upload_lock(self, upload_id):
+        with self.lock:
+            return self.upload_locks.setdefault(upload_id, threading.Lock())
+
+    def hash_state(self, upload_id):
+        with self.lock:
+            return self.hashes.setdefault(upload_id, _HashState())
+
+    def acquire(self, upload_id):
+        # Chunks of one upload are serialized; a chunk that waits too long is refused rather than queued forever
+        lock = self.upload_lock(upload_id)
+        if not lock.acquire(timeout=CHUNK_LOCK_TIMEOUT):
+            raise UploadConflictError(f"Upload {upload_id} is busy with another chunk.")
+        return lock
+
+    def get(self, upload_id):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT id, file_name, length, ranges, status, sha256, expected_sha256, options, job_id, created_at, updated_at "
+                "FROM uploads WHERE id = ?",
+                (upload_id,),
+            ).fetchone()
+        if row is None:
+            raise UploadNotFoundError(f"Upload {upload_id} not found.")
+        ranges = json.loads(row[3])
+        return {
+            "upload_id": row[0],
+            "file_name": row[1],
+            "length": row[2],
+            "offset": committed_offset(ranges),
+            "ranges": ranges,
+            "status": row[4],
+            "sha256": row[5],
+            "expected_sha256": row[6],
+            "options": json.loads(row[7]) if row[7] else {},
+            "job_id": row[8],
+            "created_at": row[9],
+            "updated_at": row[10],
+        }
+
+    def _update(self, upload_id, **fields):
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        self.connection.execute(f"UPDATE uploads SET {assignments} WHERE id = ?", (*fields.values(), upload_id))
+        self.connection.commit()
+
+    def open_chunk(self, upload_id, offset):
+        """
+        Start writing a chunk at `offset`; write pieces with the returned writer and close it when done.
+        Other chunks of the same upload wait until it is closed.
+        """
+        lock = self.acquire(upload_id)
+        try:
+            upload = self.get(upload_id)
+            if upload["status"] != "uploading":
+                raise UploadConflictError(f"Upload {upload_id} is {upload['status']}.")
+            if offset < 0 or offset > upload["length"]:
+                raise UploadConflictError(f"Offset {offset} is outside the upload's {upload['length']} bytes.")
+            if offset < self.hash_state(upload_id).offset:
+                raise UploadConflictError(f"Bytes before {self.hash_state(upload_id).offset} were already received.")
+            return ChunkWriter(self, upload_id, offset, upload["length"], lock)
+        except Exception:
+            lock.release()
+            raise
+
+    def write_chunk(self, upload_id, offset, chunks):
+        writer = self.open_chunk(upload_id, offset)
+        try:
+            for chunk in chunks:
+                writer.write(chunk)
+        finally:
+            writer.close()
+        return self.get(upload_id)
+
+    def _commit(self, upload_id, start, end):
+        with self.lock:
+            row = self.connection.execute("SELECT ranges FROM uploads WHERE id = ?", (upload_id,)).fetchone()
+            self._update(upload_id, ranges=json.dumps(merge_ranges(json.loads(row[0]), start, end)))
+
+    def _catch_up_hash(self, upload_id):
+        # Hash chunks that arrived before the gap in front of them was filled; called with the upload's lock held
+        state = self.hash_state(upload_id)
+        with self.lock:
+            row = self.connection.execute("SELECT ranges FROM uploads WHERE id = ?", (upload_id,)).fetchone()
+        target = committed_offset(json.loads(row[0]))
+        if target <= state.offset:
+            return
+        with open(self.partial_path(upload_id), "rb") as file:
+            file.seek(state.offset)
+            while state.offset < target:
+                chunk = file.read(min(1024 * 1024, target - state.offset))
+                if not chunk:
+                    break
+                state.digest.update(chunk)
+                state.offset += len(chunk)
+
+    def finish(self, upload_id, final_path):
+        """
+        Verify a fully received upload, move it to `final_path` and return its state with the SHA-256.
+        """
+        upload = self.get(upload_id)
+        if upload["status"] != "uploading":
+            raise UploadConflictError(f"Upload {upload_id} is {upload['status']}.")
+        if upload["offset"] < upload["length"]:
+            raise UploadConflictError(f"Upload {upload_id} has {upload['offset']} of {upload['length']} bytes.")
+
+        lock = self.acquire(upload_id)
+        try:
+            self._catch_up_hash(upload_id)
+            with self.lock:
+                # Another request may have finished it in the meantime
+                status = self.connection.execute("SELECT status FROM uploads WHERE id = ?", (upload_id,)).fetchone()[0]
+                if status != "uploading":
+                    raise UploadConflictError(f"Upload {upload_id} is {status}.")
+                state = self.hashes.get(upload_id)
+                if state is None or state.offset != upload["length"]:
+                    raise UploadConflictError(f"Upload {upload_id} is still being written.")
+                sha256 = state.digest.hexdigest()
+                if upload["expected_sha256"] and upload["expected_sha256"].lower() != sha256:
+                    self._update(upload_id, status="failed", sha256=sha256)
+                    raise ChecksumMismatchError(f"Upload {upload_id} SHA-256 {sha256} does not match the expected checksum.")
+                os.replace(self.partial_path(upload_id), final_path)
+                self._update(upload_id, status="complete", sha256=sha256)
+                self.hashes.pop(upload_id, None)
+                self.upload_locks.pop(upload_id, None)
+        finally:
+            lock.release()
+        return self.get(upload_id)
+
+    def set_job(self, upload_id, job_id):
+        with self.lock:
+            self._update(upload_id, job_id=job_id)
+
+    def set_options(self, upload_id, options):
+        with self.lock:
+            self._update(upload_id, options=json.dumps(options))
+
+    def delete(self, upload_id):
+        self.get(upload_id)
+        with self.lock:
+            self.connection.execute("DELETE FROM uploads WHERE id = ?", (upload_id,))
+            self.connection.commit()
+            self.hashes.pop(upload_id, None)
+            self.upload_locks.pop(upload_id, None)
+        if os.path.exists(self.partial_path(upload_id)):
+            os.remove(self.partial_path(upload_id))
+
+    def expire(self, max_age_seconds):
+        """
+        Drop unfinished uploads that haven't received data for `max_age_seconds`, with their partial files.
+        """
+        cutoff = time.time() - max_age_seconds
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT id FROM uploads WHERE status IN ('uploading', 'failed') AND updated_at < ?", (cutoff,)
+            ).fetchall()
+        for (upload_id,) in rows:
+            self.delete(upload_id)
+        return len(rows)
@@ -0,0 +1,245 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+class RetentionManager:
+    """
+    Keeps directories within byte quotas and an age limit, driven by an index of their files.
+
+    Files are recorded with their size and last access as they are written and read, so a quota is
+    enforced on every write by evicting the least recently used files, without listing or stat-ing the
+    directory. Files accessed within `grace_seconds`, and pinned files, are never evicted. `sweep`
+    reconciles the index with a directory for files written or removed behind its back, scanning in batches.
+    `on_evict(directory, file_name)` is called for every file removed.
+    """
+
+    def __init__(self, db_path, quotas=None, max_age_seconds=None, grace_seconds=3600, on_evict=None):
+        self.db_path = db_path
+        self.quotas = {os.path.normpath(directory): quota for directory, quota in (quotas or {}).items()}
+        self.max_age_seconds = max_age_seconds
+        self.grace_seconds = grace_seconds
+        self.on_evict = on_evict
+        self.pins = {}
+        self.lock = threading.Lock()
+        self.counters = {"evicted": 0, "evicted_bytes": 0, "expired": 0, "expired_bytes": 0}
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "directory TEXT NOT NULL, name TEXT NOT NULL, size INTEGER NOT NULL, mtime REAL NOT NULL, "
+            "accessed_at REAL NOT NULL, PRIMARY KEY (directory, name))"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS files_accessed ON files (directory, accessed_at)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS files_mtime ON files (mtime)")
+        self.connection.commit()
+
+    @staticmethod
+    def _split(path):
+        return os.path.normpath(os.path.dirname(path) or "."), os.path.basename(path)
+
+    def track(self, path):
+        """
+        Record a file that was just written, then bring its directory back within its quota.
+        Returns the names of the files evicted to make room.
+        """
+        directory, name = self._split(path)
+        stat = os.stat(path)
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO files (directory, name, size, mtime, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (directory, name, stat.st_size, stat.st_mtime, time.time()),
+            )
+            self.connection.commit()
+        return self.enforce(directory, keep=name)
+
+    def touch(self, *paths):
+        # Reads move files to the back of the eviction order
+        now = time.time()
+        with self.lock:
+            self.connection.executemany(
+                "UPDATE files SET accessed_at = ? WHERE directory = ? AND name = ?",
+                [(now, *self._split(path)) for path in paths],
+            )
+            self.connection.commit()
+
+    def forget(self, path):
+        with self.lock:
+            self.connection.execute("DELETE FROM files WHERE directory = ? AND name = ?", self._split(path))
+            self.connection.commit()
+
+    @contextmanager
+    def pin(self, *paths):
+        # Files in use, e.g. by a running job, are skipped by eviction and expiry
+        keys = [self._split(path) for path in paths]
+        with self.lock:
+            for key in keys:
+                self.pins[key] = self.pins.get(key, 0) + 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                for key in keys:
+                    self.pins[key] -= 1
+                    if not self.pins[key]:
+                        del self.pins[key]
+
+    def enforce(self, directory, keep=None):
+        """
+        Evict least recently used files, other than `keep`, until the directory fits its quota.
+        Returns the evicted names.
+        """
+        directory = os.path.normpath(directory)
+        quota = self.quotas.get(directory)
+        if not quota:
+            return []
+        evicted = []
+        with self.lock:
+            total = self.connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM files WHERE directory = ?", (directory,)
+            ).fetchone()[0]
+            if total <= quota:
+                return []
+            cutoff = time.time() - self.grace_seconds
+            rows = self.connection.execute(
+                "SELECT name, size FROM files WHERE directory = ? AND accessed_at < ? ORDER BY accessed_at",
+                (directory, cutoff),
+            ).fetchall()
+            for name, size in rows:
+                if total <= quota:
+                    break
+                if name == keep or (directory, name) in self.pins or not self._remove(directory, name):
+                    continue
+                total -= size
+                evicted.append(name)
+                self.counters["evicted"] += 1
+                self.counters["evicted_bytes"] += size
+            self.connection.commit()
+        if total > quota:
+            logging.warning(f"{directory} is {total} bytes, over its {quota} byte quota, with nothing left to evict.")
+        self._notify(directory, evicted)
+        return evicted
+
+    def expire(self):
+        """
+        Remove files last modified more than max_age_seconds ago. Returns how many were removed.
+        """
+        if not self.max_age_seconds:
+            return 0
+        removed = {}
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT directory, name, size FROM files WHERE mtime < ?", (time.time() - self.max_age_seconds,)
+            ).fetchall()
+            for directory, name, size in rows:
+                if (directory, name) in self.pins or not self._remove(directory, name):
+                    continue
+                removed.setdefault(directory, []).append(name)
+                self.counters["expired"] += 1
+                self.counters["expired_bytes"] += size
+            self.connection.commit()
+        for directory, names in removed.items():
+            logging.info(f"Expired {len(names)} files from {directory}.")
+            self._notify(directory, names)
+        return sum(len(names) for names in removed.values())
+
+    def _remove(self, directory, name):
+        # Delete the file and its row; a file that is already gone only loses its row
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.error(f"Error removing {os.path.join(directory, name)}: {e}")
+            return False
+        self.connection.execute("DELETE FROM files WHERE directory = ? AND name = ?", (directory, name))
+        return True
+
+    def _notify(self, directory, names):
+        if not self.on_evict:
+            return
+        for name in names:
+            try:
+                self.on_evict(directory, name)
+            except Exception as e:
+                logging.error(f"Error handling removal of {os.path.join(directory, name)}: {e}")
+
+    def sweep(self, directory, batch_size=500):
+        """
+        Reconcile the index with a directory: add files it doesn't know, drop rows for files that are gone.
+        Entries are read with os.scandir and checked against the index a batch at a time; only unknown
+        files are stat-ed. Hidden files (partial uploads) and subdirectories are left alone.
+        """
+        directory = os.path.normpath(directory)
+        seen = set()
+        added = 0
+        batch = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.startswith(".") or not entry.is_file(follow_symlinks=False):
+                    continue
+                seen.add(entry.name)
+                batch.append(entry)
+                if len(batch) >= batch_size:
+                    added += self._add_unknown(directory, batch)
+                    batch = []
+        if batch:
+            added += self._add_unknown(directory, batch)
+
+        with self.lock:
+            known = [name for (name,) in self.connection.execute("SELECT name FROM files WHERE directory = ?", (directory,))]
+            gone = [name for name in known if name not in seen]
+            self.connection.executemany(
+                "DELETE FROM files WHERE directory = ? AND name = ?", [(directory, name) for name in gone]
+            )
+            self.connection.commit()
+        logging.info(f"Retention index swept for {directory}: {added} added, {len(gone)} removed.")
+        return {"added": added, "removed": len(gone)}
+
+    def _add_unknown(self, directory, entries):
+        names = [entry.name for entry in entries]
+        placeholders = ", ".join("?" for _ in names)
+        now = time.time()
+        rows = []
+        with self.lock:
+            known = {
+                name for (name,) in self.connection.execute(
+                    f"SELECT name FROM files WHERE directory = ? AND name IN ({placeholders})", (directory, *names)
+                )
+            }
+        for entry in entries:
+            if entry.name in known:
+                continue
+            try:
+                stat = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            # Never read through the index before, so its last access is its last modification
+            rows.append((directory, entry.name, stat.st_size, stat.st_mtime, min(stat.st_mtime, now)))
+        if rows:
+            with self.lock:
+                self.connection.executemany(
+                    "INSERT OR IGNORE INTO files (directory, name, size, mtime, accessed_at) VALUES (?, ?, ?, ?, ?)", rows
+                )
+                self.connection.commit()
+        return len(rows)
+
+    def stats(self):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT directory, COUNT(*), COALESCE(SUM(size), 0) FROM files GROUP BY directory"
+            ).fetchall()
+            pinned = len(self.pins)
+        directories = {directory: {"files": 0, "bytes": 0, "quota": quota} for directory, quota in self.quotas.items()}
+        for directory, files, size in rows:
+            directories[directory] = {"files": files, "bytes": size, "quota": self.quotas.get(directory, 0)}
+        return {
+            **self.counters, "pinned": pinned, "max_age_seconds": self.max_age_seconds,
+            "grace_seconds": self.grace_seconds, "directories": directories,
+        }
@@ -0,0 +1,231 @@
+import atexit
+import bisect
+import logging
+import os
+import queue
+import re
+import threading
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# Start of a record written with LOG_FORMAT; lines that don't match continue the previous record (tracebacks)
+RECORD_START = re.compile(rb"^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}),(\d{3}) - .*? - (DEBUG|INFO|WARNING|ERROR|CRITICAL) - ")
+
+CHUNK_SIZE = 64 * 1024
+
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def configure_logging(path, level=logging.INFO, max_bytes=0, backup_count=10, when=None):
+    """
+    Log to a rotating file through a queue, so request threads never wait on disk writes.
+
+    With `when` (e.g. "midnight", "H") the file rotates on time, otherwise once it reaches `max_bytes`.
+    """
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            return _listener
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if when:
+            handler = TimedRotatingFileHandler(path, when=when, backupCount=backup_count, encoding="utf-8")
+        else:
+            handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+        records = queue.Queue(-1)
+        root = logging.getLogger()
+        root.setLevel(level)
+        root.addHandler(QueueHandler(records))
+        _listener = QueueListener(records, handler, respect_handler_level=True)
+        _listener.start()
+        # Flush whatever is still queued when the process exits
+        atexit.register(_listener.stop)
+        return _listener
+
+
+def parse_record_start(line):
+    """
+    Return (timestamp, level) for a line that starts a log record, or None for a continuation line.
+    """
+    match = RECORD_START.match(line)
+    if not match:
+        return None
+    timestamp = datetime.strptime(match.group(1).decode("ascii"), "%Y-%m-%d %H:%M:%S")
+    return timestamp.replace(microsecond=int(match.group(2)) * 1000), match.group(3).decode("ascii")
+
+
+def level_number(name):
+    value = logging.getLevelName(name.upper()) if name else logging.NOTSET
+    if not isinstance(value, int):
+        raise ValueError(f"Unknown log level: {name}")
+    return value
+
+
+class LogIndex:
+    """
+    Sparse offset index over a log file, for tail, byte-range and time-window reads.
+
+    Every `stride` bytes the offset and timestamp of the next record are recorded; building a checkpoint
+    reads one small chunk, so the index never reads the whole file. The index is extended as the file
+    grows and rebuilt when it is rotated (different inode or smaller size).
+    """
+
+    def __init__(self, path, stride=1024 * 1024):
+        self.path = path
+        self.stride = stride
+        self.lock = threading.Lock()
+        self.identity = None
+        self.checkpoints = []
+        self.indexed_size = 0
+
+    def refresh(self):
+        stat = os.stat(self.path)
+        with self.lock:
+            if self.identity != stat.st_ino or stat.st_size < self.indexed_size:
+                self.identity = stat.st_ino
+                self.checkpoints = []
+                self.indexed_size = 0
+            if stat.st_size <= self.indexed_size:
+                return stat.st_size
+            with open(self.path, "rb") as file:
+                position = self.checkpoints[-1][0] + self.stride if self.checkpoints else 0
+                while position < stat.st_size:
+                    record = self._next_record(file, position, stat.st_size)
+                    if record is None:
+                        break
+                    if not self.checkpoints or record[0] > self.checkpoints[-1][0]:
+                        self.checkpoints.append(record)
+                    position = record[0] + self.stride
+            self.indexed_size = stat.st_size
+            return stat.st_size
+
+    @staticmethod
+    def _next_record(file, position, size):
+        # Offset and timestamp of the first record starting at or after position, reading a chunk at a time
+        file.seek(position)
+        offset = position
+        if position > 0:
+            file.seek(position - 1)
+            if file.read(1) != b"\n":
+                skipped = file.readline()
+                offset = position + len(skipped)
+        while offset < size:
+            line = file.readline()
+            if not line:
+                return None
+            parsed = parse_record_start(line)
+            if parsed:
+                return offset, parsed[0]
+            offset += len(line)
+        return None
+
+    def offset_for_time(self, when):
+        """
+        Byte offset of the first record at or after `when`.
+        """
+        size = self.refresh()
+        with self.lock:
+            times = [timestamp for _, timestamp in self.checkpoints]
+            index = bisect.bisect_left(times, when)
+            start = self.checkpoints[index - 1][0] if index > 0 else 0
+        for offset, timestamp, _, _ in self.records(start, size):
+            if timestamp is not None and timestamp >= when:
+                return offset
+        return size
+
+    def records(self, start=0, end=None):
+        """
+        Yield (offset, timestamp, level, text) for every record between two byte offsets.
+        A start offset in the middle of a line moves on to the next line.
+        """
+        end = os.path.getsize(self.path) if end is None else end
+        with open(self.path, "rb") as file:
+            if start > 0:
+                file.seek(start - 1)
+                if file.read(1) != b"\n":
+                    start += len(file.readline())
+            file.seek(start)
+            offset = start
+            current = None
+            while offset < end:
+                line = file.readline()
+                if not line:
+                    break
+                parsed = parse_record_start(line)
+                if parsed or current is None:
+                    if current is not None:
+                        yield current
+                    timestamp, level = parsed or (None, None)
+                    current = (offset, timestamp, level, [line])
+                else:
+                    current[3].append(line)
+                offset += len(line)
+            if current is not None:
+                yield current
+
+    def tail(self, count, end=None, min_level=logging.NOTSET, max_scan=16 * 1024 * 1024):
+        """
+        Last `count` records before `end` at or above `min_level`, read backwards from the end of the file.
+        Stops after `max_scan` bytes so a rare level can't turn a tail into a full read.
+        Returns (records oldest first, offset where the scan stopped).
+        """
+        size = self.refresh()
+        end = size if end is None else min(end, size)
+        found = []
+        pending = []
+        scanned_from = end
+        with open(self.path, "rb") as file:
+            for offset, line in self._reverse_lines(file, end):
+                if end - offset > max_scan:
+                    break
+                scanned_from = offset
+                pending.append(line)
+                parsed = parse_record_start(line)
+                if parsed is None:
+                    continue
+                lines, pending = list(reversed(pending)), []
+                if level_number(parsed[1]) >= min_level:
+                    found.append((offset, parsed[0], parsed[1], lines))
+                    if len(found) >= count:
+                        break
+        return list(reversed(found)), scanned_from
+
+    @staticmethod
+    def _reverse_lines(file, end):
+        # (offset, line) pairs from `end` backwards, one chunk at a time
+        position = end
+        remainder = b""
+        while position > 0:
+            size = min(CHUNK_SIZE, position)
+            position -= size
+            file.seek(position)
+            data = file.read(size) + remainder
+            lines = data.split(b"\n")
+            offsets = []
+            offset = position
+            for line in lines:
+                offsets.append(offset)
+                offset += len(line) + 1
+            remainder = lines[0]
+            for offset, line in zip(reversed(offsets[1:]), reversed(lines[1:])):
+                if line:
+                    yield offset, line + b"\n"
+        if remainder:
+            yield 0, remainder + b"\n"
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_log_index(path):
+    with _indexes_lock:
+        if path not in _indexes:
+            _indexes[path] = LogIndex(path)
+        return _indexes[path]
@@ -0,0 +1,47 @@
+import threading
+
+
+class SingleFlight:
+    """
+    Runs a function once per key among concurrent callers.
+
+    The first caller for a key runs the function; callers arriving while it runs wait and get the same
+    result or exception. Once it finishes the key is free again, so later calls run afresh.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, function):
+        """
+        Return (result, shared): `shared` is True when the result came from another caller's run.
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            if call is None:
+                call = self.calls[key] = {"done": threading.Event(), "result": None, "error": None}
+                leader = True
+            else:
+                leader = False
+
+        if not leader:
+            call["done"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"], True
+
+        try:
+            call["result"] = function()
+            return call["result"], False
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call["done"].set()
+
+    def in_flight(self):
+        with self.lock:
+            return len(self.calls)
@@ -0,0 +1,100 @@
+import asyncio
+import importlib
+import inspect
+import logging
+import time
+
+from starlette.concurrency import run_in_threadpool
+
+
+class LazyRouters:
+    """
+    Includes routers in the app on first use instead of at import time.
+
+    Routers are registered by module name and prefix. In lazy mode the first request under a prefix
+    imports the module off the event loop, and with it the router's dependencies, then includes the
+    router and runs its startup handlers. `prewarm` does the same for every router in the background
+    right after startup. Shutdown handlers run with the app's as usual.
+    """
+
+    def __init__(self, app, dependencies=None):
+        self.app = app
+        self.dependencies = dependencies or []
+        self.pending = {}
+        self.lock = asyncio.Lock()
+        self.load_seconds = {}
+        self.prewarm_task = None
+
+    def add(self, module_name, prefix, tags=None):
+        self.pending[prefix] = (module_name, tags)
+
+    def include_all(self):
+        # Eager mode: everything is imported now and the startup handlers run with the app's
+        for prefix, (module_name, tags) in self.pending.items():
+            router = importlib.import_module(module_name).router
+            self.app.include_router(router, prefix=prefix, tags=tags, dependencies=self.dependencies)
+        self.pending.clear()
+
+    def install(self, prewarm=False, prewarm_modules=()):
+        self.app.add_middleware(LazyRouterMiddleware, routers=self)
+        if prewarm:
+            async def start_prewarm():
+                self.prewarm_task = asyncio.get_running_loop().create_task(self.prewarm(prewarm_modules))
+
+            self.app.router.add_event_handler("startup", start_prewarm)
+
+    def prefixes_for(self, path):
+        # The API docs list every route, so they need every router
+        if path in (self.app.openapi_url, self.app.docs_url, self.app.redoc_url):
+            return list(self.pending)
+        return [prefix for prefix in self.pending if path == prefix or path.startswith(prefix + "/")]
+
+    async def load(self, prefix):
+        async with self.lock:
+            entry = self.pending.get(prefix)
+            if entry is None:
+                return
+            module_name, tags = entry
+            started = time.perf_counter()
+            module = await run_in_threadpool(importlib.import_module, module_name)
+            router = module.router
+
+            startup = list(self.app.router.on_startup)
+            self.app.include_router(router, prefix=prefix, tags=tags, dependencies=self.dependencies)
+            # The app has already started, so the router's startup handlers are run here instead
+            self.app.router.on_startup[:] = startup
+            del self.pending[prefix]
+            for handler in router.on_startup:
+                if inspect.iscoroutinefunction(handler):
+                    await handler()
+                else:
+                    await run_in_threadpool(handler)
+
+            self.app.openapi_schema = None
+            self.load_seconds[prefix] = round(time.perf_counter() - started, 4)
+            logging.info(f"Loaded {module_name} for {prefix} in {self.load_seconds[prefix]}s")
+
+    async def prewarm(self, modules=()):
+        try:
+            for module_name in modules:
+                await run_in_threadpool(importlib.import_module, module_name)
+            for prefix in list(self.pending):
+                await self.load(prefix)
+        except Exception as e:
+            logging.error(f"Error pre-warming routers: {e}")
+
+
+class LazyRouterMiddleware:
+    """
+    ASGI middleware that loads the routers a request needs before it is routed.
+    """
+
+    def __init__(self, app, routers):
+        self.app = app
+        self.routers = routers
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and self.routers.pending:
+            for prefix in self.routers.prefixes_for(scope["path"]):
+                await self.routers.load(prefix)
+        await self.app(scope, receive, send)
@@ -1,17 +1,204 @@
 # routes/log_routes.py
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import FileResponse
+import asyncio
 import os
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Header, Query, Request
+from fastapi.responses import FileResponse, StreamingResponse
+from pdf_manager.server_log import get_log_index, level_number, parse_record_start
+import config
 
-LOG_FILE = "./server.log"
+LOG_FILE = config.LOG_FILE
 
 router = APIRouter()
 
+def log_files():
+    # The current log and its rotated backups, newest first
+    directory = os.path.dirname(LOG_FILE) or "."
+    base = os.path.basename(LOG_FILE)
+    files = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file() and (entry.name == base or entry.name.startswith(base + ".")):
+                stat = entry.stat()
+                files.append({"name": entry.name, "size": stat.st_size, "modified": stat.st_mtime})
+    return sorted(files, key=lambda item: (item["name"] != base, -item["modified"]))
+
+def resolve_log_file(name: Optional[str]):
+    if not name:
+        path = LOG_FILE
+    elif name in {item["name"] for item in log_files()}:
+        path = os.path.join(os.path.dirname(LOG_FILE) or ".", name)
+    else:
+        raise HTTPException(status_code=404, detail="Log file not found.")
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Log file not found.")
+    return path
+
+def local_time(value: Optional[datetime]):
+    # Log timestamps are naive local time
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone().replace(tzinfo=None)
+    return value
+
+def record_to_dict(record):
+    offset, timestamp, level, lines = record
+    return {
+        "offset": offset,
+        "timestamp": timestamp.isoformat(sep=" ", timespec="milliseconds") if timestamp else None,
+        "level": level,
+        "message": b"".join(lines).decode("utf-8", errors="replace").rstrip("\n"),
+    }
+
+async def follow_log(request: Request, path: str, position: int, min_level: int):
+    # Server-sent events for every record appended after `position`; the open file is drained before
+    # following a rotation to the new file
+    file = open(path, "rb")
+    file.seek(position)
+    pending = b""
+    current_level = None
+    idle = 0.0
+    try:
+        while not await request.is_disconnected():
+            data = file.read(1024 * 1024)
+            if not data:
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    stat = None
+                if stat is not None and stat.st_ino != os.fstat(file.fileno()).st_ino:
+                    file.close()
+                    file = open(path, "rb")
+                    position, pending = 0, b""
+                    continue
+                if stat is not None and stat.st_size < position:
+                    file.seek(0)
+                    position, pending = 0, b""
+                    continue
+                await asyncio.sleep(0.5)
+                idle += 0.5
+                if idle >= 15:
+                    idle = 0.0
+                    yield ": keep-alive\n\n"
+                continue
+
+            start = position - len(pending)
+            position += len(data)
+            lines = (pending + data).split(b"\n")
+            pending = lines.pop()
+            idle = 0.0
+            for line in lines:
+                start += len(line) + 1
+                parsed = parse_record_start(line)
+                if parsed:
+                    current_level = level_number(parsed[1])
+                if current_level is not None and current_level < min_level:
+                    continue
+                text = line.decode("utf-8", errors="replace")
+                yield f"id: {start}\ndata: {text}\n\n"
+    finally:
+        file.close()
+
 @router.get("/")
-def get_log():
+async def get_log(
+    request: Request,
+    tail: Optional[int] = Query(None, ge=1, le=10000),
+    start: Optional[int] = Query(None, ge=0),
+    end: Optional[int] = Query(None, ge=0),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    level: Optional[str] = None,
+    limit: int = Query(1000, ge=1, le=10000),
+    follow: bool = False,
+    file: Optional[str] = None,
+    last_event_id: Optional[int] = Header(None),
+):
     """
     Endpoint to retrieve the server log.
+    Without parameters the whole file is returned. Otherwise records are returned as JSON:
+    `tail` for the last N, `start`/`end` for a byte range, `since`/`until` for a time window and
+    `level` for a minimum level; page on with `next_offset`. `follow=true` streams new records as
+    server-sent events (after the `tail` records, if given) and resumes from Last-Event-ID.
     """
-    if not os.path.exists(LOG_FILE):
-        raise HTTPException(status_code=404, detail="Log file not found.")
-    return FileResponse(LOG_FILE, media_type="text/plain")
+    path = resolve_log_file(file)
+    try:
+        min_level = level_number(level)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    index = get_log_index(path)
+    if follow:
+        size = await asyncio.to_thread(index.refresh)
+        position = size if last_event_id is None else min(last_event_id, size)
+        backlog = []
+        if tail and last_event_id is None:
+            backlog, _ = await asyncio.to_thread(index.tail, tail, size, min_level)
+
+        async def events():
+            for record in backlog:
+                item = record_to_dict(record)
+                for line in item["message"].split("\n"):
+                    yield f"data: {line}\n\n"
+            async for event in follow_log(request, path, position, min_level):
+                yield event
+
+        return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+    if all(value is None for value in (tail, start, end, since, until, level)):
+        return FileResponse(path, media_type="text/plain")
+
+    return await asyncio.to_thread(
+        read_log, index, tail, start, end, local_time(since), local_time(until), min_level, limit, os.path.basename(path)
+    )
+
+def read_log(index, tail, start, end, since, until, min_level, limit, name):
+    size = index.refresh()
+    end = size if end is None else min(end, size)
+    # Without a starting point, level and `until` filters read backwards from the end like a tail
+    if tail is None and start is None and since is None:
+        tail = limit
+    if tail:
+        if until is not None:
+            end = min(end, index.offset_for_time(until))
+        records, scanned_from = index.tail(tail, end, min_level)
+        if since is not None:
+            records = [record for record in records if record[1] is None or record[1] >= since]
+        return {
+            "file": name,
+            "size": size,
+            "start": records[0][0] if records else scanned_from,
+            "next_offset": end,
+            "records": [record_to_dict(record) for record in records],
+        }
+
+    if start is None:
+        start = index.offset_for_time(since) if since is not None else 0
+    records = []
+    next_offset = end
+    for record in index.records(start, end):
+        timestamp = record[1]
+        if until is not None and timestamp is not None and timestamp >= until:
+            next_offset = record[0]
+            break
+        if len(records) >= limit:
+            next_offset = record[0]
+            break
+        if since is not None and timestamp is not None and timestamp < since:
+            continue
+        if record[2] is not None and level_number(record[2]) < min_level:
+            continue
+        records.append(record)
+    return {
+        "file": name,
+        "size": size,
+        "start": start,
+        "next_offset": next_offset,
+        "records": [record_to_dict(record) for record in records],
+    }
+
+@router.get("/files")
+def list_log_files():
+    """
+    Endpoint to list the server log and its rotated backups.
+    """
+    return {"files": log_files()}
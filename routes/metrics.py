@@ -0,0 +1,13 @@
+# routes/metrics.py
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from pdf_manager.metrics import render_metrics
+
+router = APIRouter()
+
+@router.get("/")
+def get_metrics():
+    """
+    Endpoint to expose stage timings, throughput, token and error counters in Prometheus text format.
+    """
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
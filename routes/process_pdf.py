@@ -1,115 +1,884 @@
 import os
+import base64
+import hashlib
 import shutil
 import logging
-from datetime import datetime, timedelta
-from fastapi import APIRouter, File, UploadFile, HTTPException, Query, Body
-from fastapi.responses import FileResponse, JSONResponse
+import tempfile
+import threading
+import zipfile
+from typing import List, Optional
+from fastapi import APIRouter, File, UploadFile, HTTPException, Query, Body, Form, Header, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, JSONResponse, Response
 from fastapi_utils.tasks import repeat_every
 from pdf_manager.manager import PDFManager
-from pdf_manager.check_metadata import check_pdf_metadata
+from pdf_manager.epub import book_manager, is_epub, EPUBPackage, EPUB_MEDIA_TYPE
+from pdf_manager.check_metadata import check_pdf_metadata, format_pdf_metadata
+from pdf_manager.catalog import LibraryCatalog
+from pdf_manager.metadata_cache import get_metadata_cache
+from pdf_manager.job_queue import JobQueue, QueueFullError, CallbackURLError, check_callback_url
+from pdf_manager.llm_client import close_llm_client
+from pdf_manager.batch import BatchProcessor
+from pdf_manager.process_pool import shutdown_process_pool
+from pdf_manager.metrics import stage_timer, collect_timings
+from pdf_manager.delivery import DeliveryQueue, SMTPConnection
+from pdf_manager.large_file import MemoryBudget, file_memory
+from pdf_manager.near_duplicates import get_near_duplicate_index
+from pdf_manager.single_flight import SingleFlight
+from pdf_manager.retention import RetentionManager
+from pdf_manager.resumable_upload import (
+    ResumableUploads, UploadError, UploadNotFoundError, UploadConflictError, ChecksumMismatchError
+)
+import config
 
 UPLOAD_DIR = "./uploaded_files"
 PROCESSED_DIR = "./processed_files"
 router = APIRouter()
 
-# Ensure the upload and processed directories exist
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-os.makedirs(PROCESSED_DIR, exist_ok=True)
+# Databases and workers behind the routes are created on first use, not at import, so loading this module
+# (a lazy startup, a benchmark, a test) doesn't create directories or open and migrate SQLite files
+_catalog = None
+_catalog_lock = threading.Lock()
+_retention = None
+_retention_lock = threading.Lock()
+_job_queue = None
+_job_queue_lock = threading.Lock()
+_resumable_uploads = None
+_resumable_uploads_lock = threading.Lock()
+_delivery_queue = None
+_delivery_queue_lock = threading.Lock()
 
-def clean_old_files(directory: str, days: int = 30):
+def get_catalog():
+    # Index of both libraries; list, search and pdf-check read from here instead of the filesystem
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = LibraryCatalog(config.CATALOG_DB_PATH)
+        return _catalog
+
+LIBRARIES = {os.path.normpath(UPLOAD_DIR): "uploaded", os.path.normpath(PROCESSED_DIR): "processed"}
+
+def forget_near_duplicate(file_name: str):
+    # The index is keyed by output file name; a removed book mustn't lend its metadata to later uploads
+    try:
+        index = get_near_duplicate_index()
+        if index is not None:
+            index.remove(file_name)
+    except Exception as e:
+        logging.error(f"Error removing {file_name} from the near-duplicate index: {e}")
+
+def uncatalog_removed(directory: str, file_name: str):
+    # Files removed by retention leave the catalog and the near-duplicate index too
+    library = LIBRARIES.get(directory)
+    if library and file_name.endswith((".pdf", ".epub")):
+        get_catalog().remove(library, file_name)
+        if library == "processed":
+            forget_near_duplicate(file_name)
+    logging.info(f"Deleted old file: {os.path.join(directory, file_name)}")
+
+def get_retention():
+    # Quotas are enforced as files are written; age-based expiry runs with the daily cleanup
+    global _retention
+    with _retention_lock:
+        if _retention is None:
+            _retention = RetentionManager(
+                config.RETENTION_DB_PATH,
+                quotas={UPLOAD_DIR: config.UPLOAD_QUOTA_BYTES, PROCESSED_DIR: config.PROCESSED_QUOTA_BYTES},
+                max_age_seconds=config.RETENTION_MAX_AGE_DAYS * 86400,
+                grace_seconds=config.RETENTION_GRACE_SECONDS,
+                on_evict=uncatalog_removed,
+            )
+        return _retention
+
+def retain(*paths):
+    """
+    Record newly written files for retention, evicting older ones if their directory is over quota.
+    """
+    for path in paths:
+        if not path:
+            continue
+        try:
+            evicted = get_retention().track(path)
+            if evicted:
+                logging.info(f"Evicted {len(evicted)} files to keep {os.path.dirname(path)} within its quota.")
+        except Exception as e:
+            logging.error(f"Error recording {path} for retention: {e}")
+
+def sweep_retention():
+    """
+    Reconcile the retention index with the upload and processed directories.
+    """
+    for directory in (UPLOAD_DIR, PROCESSED_DIR):
+        try:
+            get_retention().sweep(directory, batch_size=config.RETENTION_SWEEP_BATCH)
+        except Exception as e:
+            logging.error(f"Error sweeping {directory} for retention: {e}")
+
+def process_uploaded_file(file_path: str, n_pages: int, sha256: Optional[str] = None):
+    """
+    Run the processing pipeline on an uploaded file and move the results to the processed directory.
+    The upload's SHA-256, when known, keys the page text cache so the file isn't hashed again.
+    """
+    # The upload can't be evicted while the pipeline is reading it
+    with get_retention().pin(file_path):
+        pdf_manager = book_manager(file_path, n_pages=n_pages, sha256=sha256)
+        metadata_file, cover_file, renamed_pdf_path = pdf_manager.process_pdf()
+    with stage_timer("rename_move"):
+        result = move_to_processed(metadata_file, cover_file, renamed_pdf_path)
+    catalog_processed(result["renamed_pdf"], pdf_manager.metadata, pdf_manager.document_info, pdf_manager.page_count)
+    if pdf_manager.duplicate_of:
+        result["duplicate_of"] = pdf_manager.duplicate_of
+    return result
+
+# Concurrent processing of the same content runs once and every caller gets that run's result
+processing_flights = SingleFlight()
+
+def process_upload_once(file_path: str, n_pages: int, sha256: Optional[str], reserve_memory=False):
     """
-    Remove files older than the specified number of days from the given directory.
+    Process an uploaded file unless the same content is already being processed, in which case wait for
+    that run and share its result. Returns (result, coalesced).
     """
+    def process():
+        if reserve_memory:
+            with memory_budget.reserve(file_memory(file_path)):
+                return process_uploaded_file(file_path, n_pages, sha256)
+        return process_uploaded_file(file_path, n_pages, sha256)
+
+    if not sha256:
+        return process(), False
+    return processing_flights.do((sha256, n_pages), process)
+
+def write_upload(source, file_path: str):
+    """
+    Stream an upload to disk and return its SHA-256, computed on the way so the file isn't read again.
+    The file is written under a hidden name and renamed into place, so a run still reading an earlier
+    upload of the same name keeps its complete copy.
+    """
+    digest = hashlib.sha256()
+    fd, partial_path = tempfile.mkstemp(dir=os.path.dirname(file_path), prefix=f".{os.path.basename(file_path)}.", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as buffer:
+            for chunk in iter(lambda: source.read(1024 * 1024), b""):
+                digest.update(chunk)
+                buffer.write(chunk)
+        # mkstemp creates the file owner-only; uploads get the usual permissions
+        os.chmod(partial_path, 0o644)
+        os.replace(partial_path, file_path)
+    except BaseException:
+        os.unlink(partial_path)
+        raise
+    return digest.hexdigest()
+
+def catalog_processed(pdf_path, metadata, document_info, page_count):
+    # The output isn't hashed here; content_etag hashes it on its first download
     try:
-        now = datetime.now()
-        cutoff_date = now - timedelta(days=days)
+        get_catalog().upsert(
+            "processed", pdf_path, metadata=metadata, info=document_info, page_count=page_count, hash_file=False
+        )
+    except Exception as e:
+        logging.error(f"Error adding {pdf_path} to the catalog: {e}")
+
+def catalog_upload(file_path, sha256=None):
+    try:
+        get_catalog().upsert("uploaded", file_path, sha256=sha256)
+    except Exception as e:
+        logging.error(f"Error adding {file_path} to the catalog: {e}")
+    retain(file_path)
+
+def discard_uploads(file_paths):
+    """
+    Remove uploads written for a request that was then refused, along with their catalog and retention entries.
+    """
+    for file_path in file_paths:
+        try:
+            os.remove(file_path)
+            get_catalog().remove("uploaded", os.path.basename(file_path))
+            get_retention().forget(file_path)
+        except Exception as e:
+            logging.error(f"Error discarding refused upload {file_path}: {e}")
+
+def content_etag(file_path):
+    """
+    Strong ETag from the file's SHA-256, taken from the catalog and only recomputed when the file changed.
+    """
+    stat = os.stat(file_path)
+    file_name = os.path.basename(file_path)
+    book = get_catalog().get("processed", file_name)
+    if book is None or not book["sha256"] or book["size"] != stat.st_size or book["mtime"] != stat.st_mtime:
+        get_catalog().upsert("processed", file_path)
+        book = get_catalog().get("processed", file_name)
+    return f'"{book["sha256"]}"'
+
+def etag_matches(if_none_match, etag):
+    # If-None-Match uses the weak comparison: W/ prefixes are ignored
+    if if_none_match.strip() == "*":
+        return True
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return etag in (tag[2:] if tag.startswith("W/") else tag for tag in tags)
+
+def reconcile_catalog():
+    """
+    Sync the catalog with the upload and processed directories.
+    """
+    try:
+        get_catalog().reconcile("uploaded", UPLOAD_DIR)
+        get_catalog().reconcile("processed", PROCESSED_DIR, read_info=True)
+    except Exception as e:
+        logging.error(f"Error reconciling catalog: {e}")
+
+def move_to_processed(metadata_file, cover_file, renamed_pdf_path):
+    """
+    Move the pipeline outputs to the processed directory and return their new paths.
+    """
+    shutil.move(renamed_pdf_path, os.path.join(PROCESSED_DIR, os.path.basename(renamed_pdf_path)))
+    if metadata_file:
+        shutil.move(metadata_file, os.path.join(PROCESSED_DIR, os.path.basename(metadata_file)))
+    if cover_file:
+        shutil.move(cover_file, os.path.join(PROCESSED_DIR, os.path.basename(cover_file)))
+
+    result = {
+        "metadata_file": os.path.join(PROCESSED_DIR, os.path.basename(metadata_file)) if metadata_file else None,
+        "cover_file": os.path.join(PROCESSED_DIR, os.path.basename(cover_file)) if cover_file else None,
+        "renamed_pdf": os.path.join(PROCESSED_DIR, os.path.basename(renamed_pdf_path))
+    }
+    retain(result["renamed_pdf"], result["metadata_file"], result["cover_file"])
+    return result
+
+def process_uploaded_batch(file_paths: List[str], n_pages: int, report_progress=None):
+    """
+    Run the processing pipeline on many uploaded files at once, reporting per-item progress.
+    """
+    def on_progress(items):
+        if report_progress:
+            report_progress({
+                "total": len(items),
+                "completed": sum(1 for item in items if item["status"] in ("processed", "failed")),
+                "items": items,
+            })
 
-        for file_name in os.listdir(directory):
-            file_path = os.path.join(directory, file_name)
-            if os.path.isfile(file_path):
-                file_mtime = datetime.fromtimestamp(os.path.getmtime(file_path))
-                if file_mtime < cutoff_date:
-                    os.remove(file_path)
-                    logging.info(f"Deleted old file: {file_path}")
+    hashes = [upload_hash(path) for path in file_paths]
+    with get_retention().pin(*file_paths):
+        items = BatchProcessor(n_pages=n_pages, on_progress=on_progress).run(file_paths, hashes)
+    for item in items:
+        if item["status"] != "processed":
+            continue
+        try:
+            item.update(move_to_processed(item["metadata_file"], item["cover_file"], item["renamed_pdf"]))
+            catalog_processed(item["renamed_pdf"], item["metadata"], item["document_info"], item["page_count"])
+        except Exception as e:
+            logging.error(f"Error moving processed files for {item['file_path']}: {e}")
+            item.update(status="failed", error=str(e))
+    on_progress(items)
+    return {"items": items}
 
+def upload_hash(file_path):
+    """
+    SHA-256 recorded for an upload when it was written, or None if the file has changed since.
+    """
+    try:
+        book = get_catalog().get("uploaded", os.path.basename(file_path))
+        stat = os.stat(file_path)
     except Exception as e:
-        logging.error(f"Error cleaning directory {directory}: {e}")
+        logging.error(f"Error reading the catalog entry for {file_path}: {e}")
+        return None
+    if book is None or (book["size"], book["mtime"]) != (stat.st_size, stat.st_mtime):
+        return None
+    return book["sha256"]
+
+def run_processing_job(payload: dict, report_progress=None):
+    if payload.get("kind") == "batch":
+        return process_uploaded_batch(payload["file_paths"], payload["n_pages"], report_progress)
+    result, coalesced = process_upload_once(payload["file_path"], payload["n_pages"], payload.get("sha256"))
+    return {**result, "coalesced": coalesced}
+
+def save_batch_upload(upload: UploadFile):
+    """
+    Store an uploaded PDF or EPUB, or every one inside an uploaded zip archive, and return the stored paths.
+    """
+    if upload.filename.lower().endswith(".zip"):
+        saved = []
+        with zipfile.ZipFile(upload.file) as archive:
+            for entry in archive.infolist():
+                name = os.path.basename(entry.filename)
+                if entry.is_dir() or not name.lower().endswith((".pdf", ".epub")) or name.startswith("."):
+                    continue
+                # Stream each entry to disk instead of extracting the whole archive in memory
+                file_path = os.path.join(UPLOAD_DIR, name)
+                with archive.open(entry) as source:
+                    sha256 = write_upload(source, file_path)
+                catalog_upload(file_path, sha256=sha256)
+                saved.append(file_path)
+        return saved
+
+    file_path = os.path.join(UPLOAD_DIR, os.path.basename(upload.filename))
+    catalog_upload(file_path, sha256=write_upload(upload.file, file_path))
+    return [file_path]
+
+def job_memory(payload: dict):
+    """
+    Memory to reserve for a processing job: its file's estimate, or for a batch the files that can be
+    processed at the same time.
+    """
+    if payload.get("kind") == "batch":
+        estimates = sorted((file_memory(file_path) for file_path in payload["file_paths"]), reverse=True)
+        return sum(estimates[:config.BATCH_PROCESS_WORKERS])
+    return file_memory(payload["file_path"])
+
+# Shared by queued jobs and synchronous processing so both count against the same budget
+memory_budget = MemoryBudget(config.JOB_MEMORY_BUDGET)
+
+def get_job_queue():
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = JobQueue(
+                run_processing_job,
+                config.JOB_DB_PATH,
+                workers=config.JOB_WORKERS,
+                max_depth=config.JOB_QUEUE_DEPTH,
+                memory_budget=memory_budget,
+                estimate_memory=job_memory,
+                callback_hosts=config.JOB_CALLBACK_ALLOWED_HOSTS,
+            )
+        return _job_queue
+
+def get_resumable_uploads():
+    # Chunked uploads land in UPLOAD_DIR as hidden partial files and are renamed into place when complete
+    global _resumable_uploads
+    with _resumable_uploads_lock:
+        if _resumable_uploads is None:
+            _resumable_uploads = ResumableUploads(config.UPLOAD_DB_PATH, UPLOAD_DIR, max_bytes=config.UPLOAD_MAX_BYTES)
+        return _resumable_uploads
+
+TUS_HEADERS = {"Tus-Resumable": "1.0.0"}
+
+def make_smtp_connection():
+    return SMTPConnection(
+        config.SMTP_HOST,
+        config.SMTP_PORT,
+        username=config.SMTP_USERNAME,
+        password=config.SMTP_PASSWORD,
+        starttls=config.SMTP_STARTTLS,
+        use_ssl=config.SMTP_SSL,
+        timeout=config.SMTP_TIMEOUT_SECONDS,
+        idle_timeout=config.SMTP_IDLE_SECONDS,
+        max_messages=config.SMTP_MESSAGES_PER_CONNECTION,
+    )
+
+def get_delivery_queue():
+    # Kindle deliveries: books for the same address are packed into shared messages over a persistent connection
+    global _delivery_queue
+    with _delivery_queue_lock:
+        if _delivery_queue is None:
+            _delivery_queue = DeliveryQueue(
+                config.DELIVERY_DB_PATH,
+                make_smtp_connection,
+                sender=config.DELIVERY_SENDER,
+                workers=config.DELIVERY_WORKERS,
+                max_message_bytes=config.DELIVERY_MAX_MESSAGE_BYTES,
+                max_attachments=config.DELIVERY_MAX_ATTACHMENTS,
+                max_retries=config.DELIVERY_MAX_RETRIES,
+                base_delay=config.DELIVERY_RETRY_BASE_SECONDS,
+            )
+        return _delivery_queue
+
+def check_callback(callback_url: Optional[str]):
+    # Rejected before anything is written, with a 400 instead of failing later when the job is submitted
+    if callback_url:
+        try:
+            check_callback_url(callback_url, {host.lower() for host in config.JOB_CALLBACK_ALLOWED_HOSTS})
+        except CallbackURLError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+def upload_error(e: UploadError):
+    if isinstance(e, UploadNotFoundError):
+        return HTTPException(status_code=404, detail=str(e), headers=TUS_HEADERS)
+    if isinstance(e, UploadConflictError):
+        return HTTPException(status_code=409, detail=str(e), headers=TUS_HEADERS)
+    if isinstance(e, ChecksumMismatchError):
+        return HTTPException(status_code=460, detail=str(e), headers=TUS_HEADERS)
+    return HTTPException(status_code=400, detail=str(e), headers=TUS_HEADERS)
+
+def parse_upload_metadata(header: Optional[str]):
+    # tus Upload-Metadata: comma-separated "key base64value" pairs
+    metadata = {}
+    for pair in (header or "").split(","):
+        parts = pair.strip().split(" ", 1)
+        if parts[0]:
+            metadata[parts[0]] = base64.b64decode(parts[1]).decode("utf-8") if len(parts) > 1 else ""
+    return metadata
+
+def finish_resumable_upload(upload_id: str):
+    """
+    Move a fully received upload into the upload directory and queue it for processing if it asked for that.
+    """
+    upload = get_resumable_uploads().get(upload_id)
+    file_path = os.path.join(UPLOAD_DIR, os.path.basename(upload["file_name"]))
+    upload = get_resumable_uploads().finish(upload_id, file_path)
+    logging.info(f"Resumable upload {upload_id} complete: {file_path}")
+    catalog_upload(file_path, sha256=upload["sha256"])
+    options = upload["options"]
+    if options.get("process"):
+        n_pages = options.get("n_pages", 5)
+        job_id, coalesced = get_job_queue().submit_once(
+            {"file_path": file_path, "n_pages": n_pages, "sha256": upload["sha256"]},
+            f"{upload['sha256']}:{n_pages}", callback_url=options.get("callback_url"),
+        )
+        get_resumable_uploads().set_job(upload_id, job_id)
+        upload["job_id"] = job_id
+        upload["coalesced"] = coalesced
+    return {**upload, "file_path": file_path}
+
+@router.on_event("startup")
+def create_directories():
+    """
+    Ensure the upload and processed directories exist.
+    """
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    os.makedirs(PROCESSED_DIR, exist_ok=True)
+
+@router.on_event("startup")
+def start_job_workers():
+    """
+    Start the background processing workers and resume jobs left over from a previous run.
+    """
+    get_job_queue().start()
+    get_delivery_queue().start()
+
+@router.on_event("startup")
+def start_catalog_reconcile():
+    """
+    Reconcile the catalog and the retention index with the directories in the background so startup isn't held up.
+    """
+    threading.Thread(target=reconcile_catalog, name="catalog-reconcile", daemon=True).start()
+    threading.Thread(target=sweep_retention, name="retention-sweep", daemon=True).start()
+
+@router.on_event("shutdown")
+def close_llm_connections():
+    """
+    Close the pooled LLM connections, the process pool and the delivery workers' SMTP connections.
+    """
+    close_llm_client()
+    shutdown_process_pool()
+    get_delivery_queue().stop()
 
 @router.on_event("startup")
 @repeat_every(seconds=86400)  # Run every 24 hours
 def schedule_cleanup():
     """
-    Periodically clean the upload and processed directories of files older than 30 days.
+    Periodically remove files older than RETENTION_MAX_AGE_DAYS, and expired resumable uploads.
+    Runs in the thread pool; expiry reads the retention index rather than the directories.
     """
     logging.info("Starting scheduled cleanup task.")
-    clean_old_files(UPLOAD_DIR, days=30)
-    clean_old_files(PROCESSED_DIR, days=30)
+    try:
+        expired = get_retention().expire()
+        if expired:
+            logging.info(f"Removed {expired} files past the retention age.")
+        for directory in (UPLOAD_DIR, PROCESSED_DIR):
+            get_retention().enforce(directory)
+    except Exception as e:
+        logging.error(f"Error applying retention: {e}")
+    try:
+        expired = get_resumable_uploads().expire(config.UPLOAD_EXPIRY_SECONDS)
+        if expired:
+            logging.info(f"Removed {expired} expired resumable uploads.")
+    except Exception as e:
+        logging.error(f"Error expiring resumable uploads: {e}")
 
 @router.get("/pdf-list")
-def list_uploaded_files():
+def list_uploaded_files(offset: int = Query(0, ge=0), limit: Optional[int] = Query(None, ge=1)):
     """
-    Endpoint to list all uploaded PDF files as a list and string.
+    Endpoint to list uploaded PDF files as a list and string, optionally paginated.
     """
     try:
-        files = os.listdir(UPLOAD_DIR)
-        pdf_files = [file for file in files if file.endswith(".pdf")]
+        books, total = get_catalog().list("uploaded", offset=offset, limit=limit)
+        pdf_files = [book["file_name"] for book in books]
         pdf_files_string = ", ".join(pdf_files)
         return {
             "uploaded_files": pdf_files,
-            "uploaded_files_string": pdf_files_string
+            "uploaded_files_string": pdf_files_string,
+            "total": total,
+            "offset": offset,
+            "limit": limit
         }
     except Exception as e:
         logging.error(f"Error listing uploaded files: {e}")
         raise HTTPException(status_code=500, detail="Error listing uploaded files.")
 
 @router.get("/processed-pdf-list")
-def list_processed_files():
+def list_processed_files(offset: int = Query(0, ge=0), limit: Optional[int] = Query(None, ge=1)):
     """
-    Endpoint to list all processed PDF files.
+    Endpoint to list processed PDF files, optionally paginated.
     """
     try:
-        files = os.listdir(PROCESSED_DIR)
-        pdf_files = [file for file in files if file.endswith(".pdf")]
-        return {"processed_files": pdf_files}
+        books, total = get_catalog().list("processed", offset=offset, limit=limit)
+        return {
+            "processed_files": [book["file_name"] for book in books],
+            "total": total,
+            "offset": offset,
+            "limit": limit
+        }
     except Exception as e:
         logging.error(f"Error listing processed files: {e}")
         raise HTTPException(status_code=500, detail="Error listing processed files.")
 
-@router.post("/pdf-upload-and-process")
-def upload_and_process_file(file: UploadFile = File(...), n_pages: int = 5):
+@router.get("/search")
+def search_library(
+    q: str = Query(..., min_length=1, description="Title, author or ISBN to search for"),
+    library: Optional[str] = Query(None, description="Restrict to 'uploaded' or 'processed'"),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=200),
+):
     """
-    Endpoint to upload and immediately process a PDF file.
+    Endpoint to search the catalog by title, author, ISBN or file name.
     """
     try:
-        # Save the uploaded file
-        file_path = os.path.join(UPLOAD_DIR, file.filename)
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        books, total = get_catalog().search(q, library=library, offset=offset, limit=limit)
+        return {"results": books, "total": total, "offset": offset, "limit": limit}
+    except Exception as e:
+        logging.error(f"Error searching catalog: {e}")
+        raise HTTPException(status_code=500, detail="Error searching catalog.")
 
-        logging.info(f"File uploaded: {file_path}")
+@router.post("/pdf-upload-and-process")
+def upload_and_process_file(file: UploadFile = File(...), n_pages: int = 5, timing: bool = False):
+    """
+    Endpoint to upload and immediately process a PDF or EPUB file.
+    EPUB metadata is read from the book's package document; the LLM is only asked for what it lacks.
+    Pass timing=true to get the per-stage timings of this request in the response.
+    """
+    try:
+        with collect_timings() as timings:
+            # Save the uploaded file
+            file_path = os.path.join(UPLOAD_DIR, file.filename)
+            with stage_timer("upload_write"):
+                sha256 = write_upload(file.file, file_path)
 
-        # Process the uploaded file
-        pdf_manager = PDFManager(file_path, n_pages=n_pages)
-        metadata_file, cover_file, renamed_pdf_path = pdf_manager.process_pdf()
+            logging.info(f"File uploaded: {file_path}")
+            catalog_upload(file_path, sha256=sha256)
 
-        # Move processed files to the processed directory
-        shutil.move(renamed_pdf_path, os.path.join(PROCESSED_DIR, os.path.basename(renamed_pdf_path)))
-        if metadata_file:
-            shutil.move(metadata_file, os.path.join(PROCESSED_DIR, os.path.basename(metadata_file)))
-        if cover_file:
-            shutil.move(cover_file, os.path.join(PROCESSED_DIR, os.path.basename(cover_file)))
+            # Process the uploaded file, or share the result of a run already processing the same content
+            result, coalesced = process_upload_once(file_path, n_pages, sha256, reserve_memory=True)
 
-        return {
-            "message": "PDF uploaded and processed successfully.",
-            "metadata_file": os.path.join(PROCESSED_DIR, os.path.basename(metadata_file)) if metadata_file else None,
-            "cover_file": os.path.join(PROCESSED_DIR, os.path.basename(cover_file)) if cover_file else None,
-            "renamed_pdf": os.path.join(PROCESSED_DIR, os.path.basename(renamed_pdf_path))
-        }
+        response = {"message": "PDF uploaded and processed successfully.", **result, "coalesced": coalesced}
+        if timing:
+            response["timings"] = timings
+        return response
 
     except Exception as e:
         logging.error(f"Error uploading and processing PDF: {e}")
         raise HTTPException(status_code=500, detail=f"Error uploading and processing PDF: {e}")
 
+@router.post("/jobs", status_code=202)
+def submit_processing_job(file: UploadFile = File(...), n_pages: int = 5, callback_url: Optional[str] = Form(None)):
+    """
+    Endpoint to upload a PDF or EPUB file and queue it for background processing.
+    Returns a job ID immediately; poll /pdf/jobs/{job_id} or pass callback_url to be notified.
+    """
+    check_callback(callback_url)
+    written = []
+    try:
+        # Refused before anything is written when the queue is already full
+        get_job_queue().check_capacity()
+        file_path = os.path.join(UPLOAD_DIR, file.filename)
+        with stage_timer("upload_write"):
+            sha256 = write_upload(file.file, file_path)
+        written.append(file_path)
+
+        logging.info(f"File uploaded for background processing: {file_path}")
+        catalog_upload(file_path, sha256=sha256)
+        # A job already queued or running for the same content is shared instead of processing it twice
+        job_id, coalesced = get_job_queue().submit_once(
+            {"file_path": file_path, "n_pages": n_pages, "sha256": sha256}, f"{sha256}:{n_pages}", callback_url=callback_url
+        )
+        if coalesced:
+            return {
+                "message": "PDF uploaded; the same content is already queued for processing.",
+                "job_id": job_id, "status": get_job_queue().get(job_id)["status"], "coalesced": True,
+            }
+        return {"message": "PDF uploaded and queued for processing.", "job_id": job_id, "status": "queued", "coalesced": False}
+
+    except QueueFullError as e:
+        logging.warning(f"Rejected upload, job queue full: {e}")
+        # Filled up while the upload was being written
+        discard_uploads(written)
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
+    except Exception as e:
+        logging.error(f"Error queueing PDF for processing: {e}")
+        raise HTTPException(status_code=500, detail=f"Error queueing PDF for processing: {e}")
+
+@router.post("/batch-upload-and-process", status_code=202)
+def submit_batch_job(files: List[UploadFile] = File(...), n_pages: int = 5, callback_url: Optional[str] = Form(None)):
+    """
+    Endpoint to upload many PDF or EPUB files, or zip archives of them, and process them as one background batch.
+    Returns a job ID immediately; poll /pdf/jobs/{job_id} for per-item progress.
+    """
+    check_callback(callback_url)
+    file_paths = []
+    try:
+        get_job_queue().check_capacity()
+        for upload in files:
+            file_paths.extend(save_batch_upload(upload))
+        if not file_paths:
+            raise HTTPException(status_code=400, detail="No PDF files found in the upload.")
+
+        logging.info(f"Batch of {len(file_paths)} files uploaded for background processing.")
+        job_id = get_job_queue().submit(
+            {"kind": "batch", "file_paths": file_paths, "n_pages": n_pages}, callback_url=callback_url
+        )
+        return {"message": f"{len(file_paths)} PDFs uploaded and queued for processing.", "job_id": job_id, "status": "queued", "files": file_paths}
+
+    except HTTPException:
+        raise
+    except QueueFullError as e:
+        logging.warning(f"Rejected batch upload, job queue full: {e}")
+        discard_uploads(file_paths)
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
+    except zipfile.BadZipFile as e:
+        raise HTTPException(status_code=400, detail=f"Invalid zip archive: {e}")
+    except Exception as e:
+        logging.error(f"Error queueing PDF batch for processing: {e}")
+        raise HTTPException(status_code=500, detail=f"Error queueing PDF batch for processing: {e}")
+
+@router.get("/jobs/{job_id}")
+def get_processing_job(job_id: str):
+    """
+    Endpoint to poll the status and result of a background processing job.
+    """
+    job = get_job_queue().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
+
+@router.get("/jobs")
+def get_job_queue_stats():
+    """
+    Endpoint to report worker count, queue depth and job counts by status.
+    """
+    return get_job_queue().stats()
+
+@router.post("/uploads", status_code=201)
+def create_resumable_upload(
+    request: Request,
+    upload_length: int = Header(...),
+    upload_metadata: Optional[str] = Header(None),
+    file_name: Optional[str] = Query(None),
+    sha256: Optional[str] = Query(None, description="Expected SHA-256 of the whole file, checked on completion"),
+    process: bool = False,
+    n_pages: int = 5,
+    callback_url: Optional[str] = None,
+):
+    """
+    Endpoint to start a resumable (tus-style) upload of Upload-Length bytes.
+    The file name comes from file_name or the tus Upload-Metadata "filename" entry. With process=true
+    the file is queued for processing as soon as its last byte arrives.
+    """
+    try:
+        file_name = file_name or parse_upload_metadata(upload_metadata).get("filename")
+    except Exception:
+        raise HTTPException(status_code=400, detail="Malformed Upload-Metadata header.", headers=TUS_HEADERS)
+    if not file_name:
+        raise HTTPException(status_code=400, detail="A file name is required.", headers=TUS_HEADERS)
+    check_callback(callback_url)
+    try:
+        upload = get_resumable_uploads().create(
+            os.path.basename(file_name), upload_length, expected_sha256=sha256,
+            options={"process": process, "n_pages": n_pages, "callback_url": callback_url},
+        )
+    except UploadError as e:
+        raise upload_error(e)
+    logging.info(f"Resumable upload {upload['upload_id']} started for {upload['file_name']} ({upload_length} bytes)")
+    location = str(request.url_for("get_resumable_upload", upload_id=upload["upload_id"]))
+    return JSONResponse(
+        content=upload, status_code=201,
+        headers={**TUS_HEADERS, "Location": location, "Upload-Offset": "0"},
+    )
+
+@router.patch("/uploads/{upload_id}", status_code=204)
+async def write_resumable_upload_chunk(upload_id: str, request: Request, upload_offset: int = Header(...)):
+    """
+    Endpoint to append a chunk of the request body at Upload-Offset.
+    Chunks may arrive in any order; parallel chunks of one upload are written one after another. The response's
+    Upload-Offset is the number of bytes received without a gap from the start. Bytes received before a dropped
+    connection are kept.
+    """
+    try:
+        writer = await run_in_threadpool(get_resumable_uploads().open_chunk, upload_id, upload_offset)
+        try:
+            buffer = bytearray()
+            async for piece in request.stream():
+                buffer += piece
+                if len(buffer) >= 1024 * 1024:
+                    await run_in_threadpool(writer.write, bytes(buffer))
+                    buffer.clear()
+            if buffer:
+                await run_in_threadpool(writer.write, bytes(buffer))
+        finally:
+            await run_in_threadpool(writer.close)
+        upload = await run_in_threadpool(get_resumable_uploads().get, upload_id)
+        headers = {**TUS_HEADERS, "Upload-Offset": str(upload["offset"])}
+        if upload["offset"] == upload["length"] and upload["options"].get("process"):
+            try:
+                upload = await run_in_threadpool(finish_resumable_upload, upload_id)
+                headers["Upload-Job-Id"] = upload["job_id"]
+            except UploadConflictError:
+                # A parallel chunk completed the upload first
+                pass
+        return Response(status_code=204, headers=headers)
+    except UploadError as e:
+        raise upload_error(e)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
+
+@router.head("/uploads/{upload_id}")
+def get_resumable_upload_offset(upload_id: str):
+    """
+    Endpoint to report how many bytes of a resumable upload were received, as Upload-Offset.
+    """
+    try:
+        upload = get_resumable_uploads().get(upload_id)
+    except UploadError as e:
+        raise upload_error(e)
+    return Response(headers={
+        **TUS_HEADERS,
+        "Upload-Offset": str(upload["offset"]),
+        "Upload-Length": str(upload["length"]),
+        "Cache-Control": "no-store",
+    })
+
+@router.get("/uploads/{upload_id}")
+def get_resumable_upload(upload_id: str):
+    """
+    Endpoint to report the state of a resumable upload, including every received byte range.
+    """
+    try:
+        return get_resumable_uploads().get(upload_id)
+    except UploadError as e:
+        raise upload_error(e)
+
+@router.post("/uploads/{upload_id}/finish")
+def finish_upload(upload_id: str, process: Optional[bool] = None, n_pages: Optional[int] = None):
+    """
+    Endpoint to complete a fully received resumable upload, optionally queueing it for processing.
+    Completing an upload that was already completed returns its state.
+    """
+    try:
+        upload = get_resumable_uploads().get(upload_id)
+        if upload["status"] == "complete":
+            return upload
+        if process is not None or n_pages is not None:
+            options = {**upload["options"]}
+            if process is not None:
+                options["process"] = process
+            if n_pages is not None:
+                options["n_pages"] = n_pages
+            get_resumable_uploads().set_options(upload_id, options)
+        return finish_resumable_upload(upload_id)
+    except UploadError as e:
+        raise upload_error(e)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
+
+@router.delete("/uploads/{upload_id}", status_code=204)
+def delete_resumable_upload(upload_id: str):
+    """
+    Endpoint to abandon a resumable upload and remove what was received.
+    """
+    try:
+        get_resumable_uploads().delete(upload_id)
+    except UploadError as e:
+        raise upload_error(e)
+    return Response(status_code=204, headers=TUS_HEADERS)
+
+@router.post("/deliveries", status_code=202)
+def send_to_kindle(request: dict = Body(..., example={"file_names": ["example file.pdf"], "recipient": "name@kindle.com"})):
+    """
+    Endpoint to queue processed PDFs for delivery to a Kindle address (KINDLE_EMAIL when no recipient is given).
+    Books queued together for the same address are sent in as few messages as the size limit allows.
+    """
+    file_names = request.get("file_names") or []
+    recipient = request.get("recipient") or config.KINDLE_EMAIL
+    if not file_names:
+        raise HTTPException(status_code=400, detail="file_names is required in the JSON body.")
+    if not recipient or "@" not in recipient:
+        raise HTTPException(status_code=400, detail="A recipient address is required.")
+
+    file_paths = [os.path.join(PROCESSED_DIR, os.path.basename(file_name)) for file_name in file_names]
+    missing = [os.path.basename(file_path) for file_path in file_paths if not os.path.exists(file_path)]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Files not found: {', '.join(missing)}")
+    try:
+        get_retention().touch(*file_paths)
+        deliveries = get_delivery_queue().enqueue(file_paths, recipient)
+        logging.info(f"Queued {len(deliveries)} books for delivery to {recipient}")
+        return {"message": "Books queued for delivery.", "deliveries": deliveries}
+    except Exception as e:
+        logging.error(f"Error queueing delivery: {e}")
+        raise HTTPException(status_code=500, detail=f"Error queueing delivery: {e}")
+
+@router.get("/deliveries")
+def list_deliveries(
+    recipient: Optional[str] = None,
+    status: Optional[str] = None,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+):
+    """
+    Endpoint to list deliveries, newest first, optionally for one recipient or status.
+    """
+    deliveries, total = get_delivery_queue().list(recipient=recipient, status=status, offset=offset, limit=limit)
+    return {"deliveries": deliveries, "total": total, "offset": offset, "limit": limit}
+
+@router.get("/deliveries/stats")
+def delivery_stats():
+    """
+    Endpoint to report delivery counts by status, overall and per recipient.
+    """
+    return get_delivery_queue().stats()
+
+@router.get("/deliveries/{delivery_id}")
+def get_delivery(delivery_id: str):
+    """
+    Endpoint to report the state of a single delivery.
+    """
+    delivery = get_delivery_queue().get(delivery_id)
+    if delivery is None:
+        raise HTTPException(status_code=404, detail="Delivery not found.")
+    return delivery
+
+@router.get("/metadata-cache-stats")
+def metadata_cache_stats():
+    """
+    Endpoint to report hit/miss counters and size of the LLM metadata cache.
+    """
+    try:
+        return get_metadata_cache().stats()
+    except Exception as e:
+        logging.error(f"Error reading metadata cache stats: {e}")
+        raise HTTPException(status_code=500, detail="Error reading metadata cache stats.")
+
+@router.get("/near-duplicate-stats")
+def near_duplicate_stats():
+    """
+    Endpoint to report the size of the near-duplicate index and its lookup and match counters.
+    """
+    try:
+        index = get_near_duplicate_index()
+        return index.stats() if index is not None else {"enabled": False}
+    except Exception as e:
+        logging.error(f"Error reading near-duplicate index stats: {e}")
+        raise HTTPException(status_code=500, detail="Error reading near-duplicate index stats.")
+
+@router.get("/retention-stats")
+def retention_stats():
+    """
+    Endpoint to report per-directory file counts, bytes and quotas, and eviction and expiry counters.
+    """
+    try:
+        return get_retention().stats()
+    except Exception as e:
+        logging.error(f"Error reading retention stats: {e}")
+        raise HTTPException(status_code=500, detail="Error reading retention stats.")
+
 @router.post("/pdf-check")
 def check_metadata(file_info: dict = Body(..., example={"file_name": "example file.pdf"})):
     """
@@ -124,18 +893,30 @@ def check_metadata(file_info: dict = Body(..., example={"file_name": "example fi
 
         file_path = os.path.join(PROCESSED_DIR, file_name)
         if not os.path.exists(file_path):
+            get_catalog().remove("processed", file_name)
             raise HTTPException(status_code=404, detail="File not found. Please process the file first.")
 
+        # The catalog holds the /Info dictionary written by the pipeline, as long as the file hasn't changed since
+        book = get_catalog().get("processed", file_name)
+        stat = os.stat(file_path)
+        if book and book["info"] is not None and (book["size"], book["mtime"]) == (stat.st_size, stat.st_mtime):
+            return JSONResponse({
+                "message": "Metadata checked successfully.",
+                "metadata": format_pdf_metadata(book["info"]) if book["info"] else "No metadata found in the PDF."
+            })
+
         logging.info(f"Checking metadata for PDF: {file_path}")
 
         # Call the check_pdf_metadata function
-        metadata = check_pdf_metadata(file_path)
+        metadata = format_pdf_metadata(EPUBPackage(file_path).info()) if is_epub(file_path) else check_pdf_metadata(file_path)
 
         return JSONResponse({
             "message": "Metadata checked successfully.",
             "metadata": metadata
         })
 
+    except HTTPException:
+        raise
     except ValueError as e:
         logging.error(f"Error when checking PDF metadata: {e}")
         raise HTTPException(status_code=400, detail=str(e))
@@ -143,27 +924,66 @@ def check_metadata(file_info: dict = Body(..., example={"file_name": "example fi
         logging.error(f"Unexpected error when checking PDF metadata: {e}")
         raise HTTPException(status_code=500, detail="An unexpected error occurred while checking PDF metadata.")
 
-@router.get("/pdf-download")
-def download_pdf(file_name: str = Query(..., description="Name of the processed PDF file")):
+@router.api_route("/pdf-download", methods=["GET", "HEAD"])
+def download_pdf(
+    file_name: str = Query(..., description="Name of the processed PDF file"),
+    if_none_match: Optional[str] = Header(None),
+):
     """
     Endpoint to download the processed PDF file.
+    Supports Range/If-Range (including multipart ranges) for resuming, and ETag/If-None-Match for revalidation.
     """
     try:
         file_path = os.path.join(PROCESSED_DIR, file_name)
         if not os.path.exists(file_path):
             raise HTTPException(status_code=404, detail="File not found. Please process the file first.")
 
+        get_retention().touch(file_path)
+        etag = content_etag(file_path)
+        if if_none_match and etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+
         logging.info(f"Serving PDF file for download: {file_path}")
+        # FileResponse answers Range and If-Range against this ETag, and hands the path to the server
+        # for sendfile when it supports the ASGI pathsend extension
         return FileResponse(
             file_path,
-            media_type="application/pdf",
+            media_type=EPUB_MEDIA_TYPE if is_epub(file_path) else "application/pdf",
             filename=os.path.basename(file_path),
+            headers={"ETag": etag},
         )
 
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error serving PDF file for download: {e}")
         raise HTTPException(status_code=500, detail=f"Error serving PDF file: {e}")
 
+@router.post("/pdf-optimize")
+def optimize_pdf(
+    file_name: str = Body(..., embed=True),
+    budget_bytes: Optional[int] = Body(None, embed=True, ge=1),
+    dpi: Optional[int] = Body(None, embed=True, ge=1),
+):
+    """
+    Endpoint to shrink a processed PDF towards a byte budget (OUTPUT_BYTE_BUDGET by default).
+    Returns the size after each step and the bytes it saved.
+    """
+    file_path = os.path.join(PROCESSED_DIR, file_name)
+    if not os.path.exists(file_path):
+        raise HTTPException(status_code=404, detail="File not found. Please process the file first.")
+    budget_bytes = budget_bytes or config.OUTPUT_BYTE_BUDGET or None
+
+    logging.info(f"Optimizing PDF {file_path} towards {budget_bytes} bytes")
+    with memory_budget.reserve(file_memory(file_path)), stage_timer("optimize"):
+        report = PDFManager.optimize_pdf(file_path, budget_bytes, dpi=dpi)
+    if report is None:
+        raise HTTPException(status_code=500, detail="Error optimizing PDF file.")
+    if report["written"]:
+        get_catalog().upsert("processed", file_path, hash_file=False)
+        retain(file_path)
+    return {"file_name": file_name, **report}
+
 @router.delete("/pdf-delete")
 def delete_pdf(file_name: str = Query(..., description="Name of the PDF file to delete")):
     """
@@ -175,6 +995,9 @@ def delete_pdf(file_name: str = Query(..., description="Name of the PDF file to
             raise HTTPException(status_code=404, detail="File not found.")
 
         os.remove(file_path)
+        get_catalog().remove("processed", file_name)
+        forget_near_duplicate(file_name)
+        get_retention().forget(file_path)
         logging.info(f"Deleted PDF file: {file_path}")
 
         return JSONResponse({"message": f"File '{file_name}' deleted successfully."})
@@ -0,0 +1,58 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from benchmarks.synthetic import SyntheticPDF
+from pdf_manager import batch
+from pdf_manager.batch import BatchProcessor
+from pdf_manager.metadata_extractor import PDFMetadataExtractor
+from pdf_manager.metrics import BYTES_PROCESSED, PAGES_PARSED, STAGE_SECONDS, record_metrics, replay_metrics
+
+
+def stage_count(stage):
+    counts, _ = STAGE_SECONDS.series.get((stage,), ([0], 0.0))
+    return counts[-1]
+
+
+def test_recorded_metrics_are_replayed():
+    with record_metrics() as recorded:
+        PAGES_PARSED.inc(3)
+        STAGE_SECONDS.observe(0.5, stage="test_replay")
+    pages = PAGES_PARSED.values[()]
+
+    replay_metrics(recorded)
+
+    assert recorded == [("pdf_pages_parsed_total", 3, {}), ("pdf_stage_duration_seconds", 0.5, {"stage": "test_replay"})]
+    assert PAGES_PARSED.values[()] == pages + 3
+    assert stage_count("test_replay") == 2
+
+
+@pytest.fixture
+def pool(monkeypatch, tmp_path):
+    # A spawned worker of its own, with the caches and indexes it opens under tmp_path
+    monkeypatch.chdir(tmp_path)
+    pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+    monkeypatch.setattr(batch, "get_process_pool", lambda: pool)
+    yield pool
+    pool.shutdown()
+
+
+def test_worker_metrics_reach_the_parent(pool, tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        PDFMetadataExtractor, "query_openai_for_metadata_batch",
+        staticmethod(lambda texts, fields: [{} for _ in texts]),
+    )
+    path = tmp_path / "book.pdf"
+    SyntheticPDF(pages=20, book_id=1).write(str(path))
+    pages = PAGES_PARSED.values.get((), 0)
+    written = BYTES_PROCESSED.values.get((), 0)
+    writes = stage_count("pdf_rewrite")
+
+    items = BatchProcessor(n_pages=3).run([str(path)])
+
+    assert items[0]["status"] == "processed"
+    assert PAGES_PARSED.values[()] > pages
+    assert BYTES_PROCESSED.values[()] > written
+    assert stage_count("pdf_rewrite") == writes + 1
+    assert items[0]["timings"]["pdf_rewrite"] > 0
@@ -0,0 +1,43 @@
+import os
+
+from pdf_manager.catalog import LibraryCatalog, file_sha256
+
+
+def write(path, data):
+    with open(path, "wb") as file:
+        file.write(data)
+
+
+def test_upsert_hashes_the_file(tmp_path):
+    catalog = LibraryCatalog(str(tmp_path / "catalog.db"))
+    path = str(tmp_path / "book.pdf")
+    write(path, b"%PDF-1.4 first")
+
+    catalog.upsert("processed", path)
+
+    assert catalog.get("processed", "book.pdf")["sha256"] == file_sha256(path)
+
+
+def test_upsert_without_hashing_clears_the_old_hash(tmp_path):
+    catalog = LibraryCatalog(str(tmp_path / "catalog.db"))
+    path = str(tmp_path / "book.pdf")
+    write(path, b"%PDF-1.4 first")
+    catalog.upsert("processed", path)
+
+    write(path, b"%PDF-1.4 second version")
+    catalog.upsert("processed", path, info={"/Title": "Book"}, hash_file=False)
+
+    book = catalog.get("processed", "book.pdf")
+    assert book["sha256"] is None
+    assert book["size"] == os.path.getsize(path)
+    assert book["info"] == {"/Title": "Book"}
+
+
+def test_upsert_keeps_a_known_hash(tmp_path):
+    catalog = LibraryCatalog(str(tmp_path / "catalog.db"))
+    path = str(tmp_path / "book.pdf")
+    write(path, b"%PDF-1.4 first")
+
+    catalog.upsert("processed", path, sha256="abc", hash_file=False)
+
+    assert catalog.get("processed", "book.pdf")["sha256"] == "abc"
@@ -0,0 +1,73 @@
+from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.generic import DecodedStreamObject, DictionaryObject, NameObject, NumberObject
+
+from pdf_manager.cover import save_cover
+
+
+def image_stream(width=4, height=6):
+    image = DecodedStreamObject()
+    image.set_data(b"\x80\x40\x20" * width * height)
+    image.update({
+        NameObject("/Type"): NameObject("/XObject"),
+        NameObject("/Subtype"): NameObject("/Image"),
+        NameObject("/Width"): NumberObject(width),
+        NameObject("/Height"): NumberObject(height),
+        NameObject("/ColorSpace"): NameObject("/DeviceRGB"),
+        NameObject("/BitsPerComponent"): NumberObject(8),
+    })
+    return image
+
+
+def font(name):
+    return DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject(name),
+    })
+
+
+def indirect_resources_pdf(path, content):
+    """
+    One-page PDF whose /Resources, /Font and /XObject dictionaries are all indirect objects.
+    """
+    writer = PdfWriter()
+    writer.add_blank_page(width=200, height=300)
+    page = writer.pages[0]
+    fonts = DictionaryObject({
+        NameObject("/F1"): writer._add_object(font("/Helvetica")),
+        NameObject("/F2"): writer._add_object(font("/Courier")),
+    })
+    xobjects = DictionaryObject({
+        NameObject("/Im0"): writer._add_object(image_stream()),
+        NameObject("/Im1"): writer._add_object(image_stream(8, 8)),
+    })
+    resources = DictionaryObject({
+        NameObject("/Font"): writer._add_object(fonts),
+        NameObject("/XObject"): writer._add_object(xobjects),
+    })
+    page[NameObject("/Resources")] = writer._add_object(resources)
+    stream = DecodedStreamObject()
+    stream.set_data(content)
+    page[NameObject("/Contents")] = writer._add_object(stream)
+    with open(path, "wb") as file:
+        writer.write(file)
+    return str(path)
+
+
+def test_cover_keeps_only_used_entries_of_indirect_resources(tmp_path):
+    source = indirect_resources_pdf(tmp_path / "book.pdf", b"q 200 0 0 300 0 0 cm /Im0 Do Q BT /F1 12 Tf (Hi) Tj ET")
+
+    cover = save_cover(PdfReader(source), str(tmp_path / "cover"))
+
+    assert cover.endswith(".pdf")
+    resources = PdfReader(cover).pages[0]["/Resources"]
+    assert list(resources["/Font"].keys()) == ["/F1"]
+    assert list(resources["/XObject"].keys()) == ["/Im0"]
+
+
+def test_thumbnail_is_found_behind_indirect_resources(tmp_path):
+    source = indirect_resources_pdf(tmp_path / "book.pdf", b"q 200 0 0 300 0 0 cm /Im0 Do Q")
+
+    cover = save_cover(PdfReader(source), str(tmp_path / "cover"), thumbnail_format="png")
+
+    assert cover.endswith(".png")
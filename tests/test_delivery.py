@@ -0,0 +1,168 @@
+import smtplib
+import socket
+import time
+
+import pytest
+
+from pdf_manager import delivery
+from pdf_manager.delivery import (
+    ATTACHMENT_OVERHEAD,
+    MESSAGE_OVERHEAD,
+    DeliveryQueue,
+    SMTPConnection,
+    encoded_size,
+    is_permanent,
+    pack_batches,
+)
+
+
+def test_encoded_size_counts_base64_and_line_breaks():
+    assert encoded_size(0) == ATTACHMENT_OVERHEAD
+    assert encoded_size(3) == 4 + ATTACHMENT_OVERHEAD
+    # 57 bytes make one full 76-character line
+    assert encoded_size(57) == 76 + 2 + ATTACHMENT_OVERHEAD
+
+
+def test_pack_batches_fills_messages_first_fit_decreasing():
+    limit = MESSAGE_OVERHEAD + 3 * encoded_size(1000)
+    items = [("a", 1000), ("b", 400), ("c", 1000), ("d", 1000), ("e", 600)]
+
+    batches, too_large = pack_batches(items, limit, max_attachments=10)
+
+    assert too_large == []
+    assert batches[0] == ["a", "c", "d"]
+    assert sorted(batches[1]) == ["b", "e"]
+
+
+def test_pack_batches_limits_attachments_and_rejects_oversized_files():
+    items = [(name, 10) for name in "abcde"] + [("huge", 10 ** 6)]
+
+    batches, too_large = pack_batches(items, 100 * 1024, max_attachments=2)
+
+    assert too_large == ["huge"]
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+
+
+def test_is_permanent():
+    assert is_permanent(FileNotFoundError())
+    assert is_permanent(smtplib.SMTPResponseException(550, b"no such user"))
+    assert not is_permanent(smtplib.SMTPResponseException(451, b"try later"))
+    assert is_permanent(smtplib.SMTPRecipientsRefused({"a@kindle.com": (550, b"refused")}))
+    assert not is_permanent(smtplib.SMTPRecipientsRefused({"a@kindle.com": (450, b"busy")}))
+    assert not is_permanent(smtplib.SMTPServerDisconnected())
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def book(tmp_path, name, size):
+    path = tmp_path / name
+    path.write_bytes(b"%PDF-1.4 " + b"x" * size)
+    return str(path)
+
+
+@pytest.fixture
+def smtp_sink():
+    controller_module = pytest.importorskip("aiosmtpd.controller")
+
+    class Sink:
+        def __init__(self):
+            self.messages = []
+            self.replies = []
+
+        async def handle_DATA(self, server, session, envelope):
+            if self.replies:
+                return self.replies.pop(0)
+            self.messages.append(envelope)
+            return "250 OK"
+
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    sink = Sink()
+    controller = controller_module.Controller(sink, hostname="127.0.0.1", port=port)
+    controller.start()
+    yield sink, port
+    controller.stop()
+
+
+def new_queue(tmp_path, port, **options):
+    return DeliveryQueue(
+        str(tmp_path / "deliveries.db"),
+        lambda: SMTPConnection("127.0.0.1", port, starttls=False),
+        "books@example.com",
+        **options,
+    )
+
+
+def test_books_for_one_recipient_share_a_message(tmp_path, smtp_sink):
+    sink, port = smtp_sink
+    queue = new_queue(tmp_path, port)
+    deliveries = queue.enqueue([book(tmp_path, f"book{index}.pdf", 1000) for index in range(3)], "reader@kindle.com")
+    queue.start()
+    try:
+        assert wait_for(lambda: all(queue.get(item["id"])["status"] == "sent" for item in deliveries))
+    finally:
+        queue.stop()
+
+    assert len(sink.messages) == 1
+    assert sink.messages[0].rcpt_tos == ["reader@kindle.com"]
+    assert b'filename="book2.pdf"' in sink.messages[0].content
+
+
+def test_temporary_reply_is_retried(tmp_path, smtp_sink):
+    sink, port = smtp_sink
+    sink.replies.append("451 Try again later")
+    queue = new_queue(tmp_path, port, base_delay=0.1, max_delay=0.1)
+    (delivery_item,) = queue.enqueue([book(tmp_path, "book.pdf", 1000)], "reader@kindle.com")
+    queue.start()
+    try:
+        assert wait_for(lambda: queue.get(delivery_item["id"])["status"] == "sent")
+    finally:
+        queue.stop()
+
+    assert queue.get(delivery_item["id"])["attempts"] == 1
+    assert len(sink.messages) == 1
+
+
+def test_permanent_reply_fails_without_retry(tmp_path, smtp_sink):
+    sink, port = smtp_sink
+    sink.replies.append("550 Mailbox unavailable")
+    queue = new_queue(tmp_path, port, base_delay=0.1, max_delay=0.1)
+    (delivery_item,) = queue.enqueue([book(tmp_path, "book.pdf", 1000)], "reader@kindle.com")
+    queue.start()
+    try:
+        assert wait_for(lambda: queue.get(delivery_item["id"])["status"] == "failed")
+    finally:
+        queue.stop()
+
+    assert sink.messages == []
+
+
+def test_unexpected_error_requeues_claimed_deliveries(tmp_path, monkeypatch, smtp_sink):
+    sink, port = smtp_sink
+    calls = []
+
+    def broken_pack(items, max_bytes, max_attachments):
+        calls.append(len(items))
+        if len(calls) == 1:
+            raise RuntimeError("packing failed")
+        return pack_batches(items, max_bytes, max_attachments)
+
+    monkeypatch.setattr(delivery, "pack_batches", broken_pack)
+    queue = new_queue(tmp_path, port, base_delay=0.1, max_delay=0.1)
+    (delivery_item,) = queue.enqueue([book(tmp_path, "book.pdf", 1000)], "reader@kindle.com")
+    queue.start()
+    try:
+        assert wait_for(lambda: queue.get(delivery_item["id"])["status"] == "sent")
+    finally:
+        queue.stop()
+
+    assert len(calls) == 2
+    assert queue.get(delivery_item["id"])["attempts"] == 1
@@ -0,0 +1,111 @@
+import zipfile
+from xml.etree import ElementTree
+
+from pdf_manager.epub import DC_NS, OPF_NS, EPUBManager, EPUBPackage, write_opf
+
+CONTAINER = """<?xml version="1.0"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/></rootfiles>
+</container>"""
+
+OPF = """<?xml version="1.0" encoding="utf-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="2.0" unique-identifier="id">
+  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:opf="http://www.idpf.org/2007/opf">
+    <dc:title>Old Title</dc:title>
+    <dc:creator opf:role="aut">Old Author</dc:creator>
+    <dc:creator opf:role="edt">Some Editor</dc:creator>
+    <dc:language>en</dc:language>
+    <dc:identifier id="id">urn:uuid:1234</dc:identifier>
+  </metadata>
+  <manifest><item id="c1" href="chapter.xhtml" media-type="application/xhtml+xml"/></manifest>
+  <spine><itemref idref="c1"/></spine>
+</package>"""
+
+CHAPTER = "<html><body><p>" + "Some chapter text. " * 200 + "</p></body></html>"
+
+
+def write_epub(path, opf=OPF):
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("mimetype", "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        archive.writestr("META-INF/container.xml", CONTAINER, compress_type=zipfile.ZIP_DEFLATED)
+        archive.writestr("OEBPS/content.opf", opf, compress_type=zipfile.ZIP_DEFLATED)
+        archive.writestr("OEBPS/chapter.xhtml", CHAPTER, compress_type=zipfile.ZIP_DEFLATED)
+    return str(path)
+
+
+def dc_text(opf, name):
+    root = ElementTree.fromstring(opf)
+    return [element.text for element in root.iter(f"{{{DC_NS}}}{name}")]
+
+
+def test_values_are_escaped(tmp_path):
+    package = EPUBPackage(write_epub(tmp_path / "book.epub"))
+
+    opf = package.updated_opf({"title": "Cats & Dogs <Revised>", "publisher": "Smith & Sons"})
+
+    assert b"Cats &amp; Dogs &lt;Revised&gt;" in opf
+    assert dc_text(opf, "title") == ["Cats & Dogs <Revised>"]
+    assert dc_text(opf, "publisher") == ["Smith & Sons"]
+
+
+def test_authors_are_replaced_and_other_creators_kept(tmp_path):
+    package = EPUBPackage(write_epub(tmp_path / "book.epub"))
+
+    opf = package.updated_opf({"authors": ["First Author", "Second Author"]})
+
+    root = ElementTree.fromstring(opf)
+    creators = [(element.text, element.get(f"{{{OPF_NS}}}role")) for element in root.iter(f"{{{DC_NS}}}creator")]
+    assert creators == [("Some Editor", "edt"), ("First Author", None), ("Second Author", None)]
+
+
+def test_unchanged_and_unknown_values_leave_the_document_alone(tmp_path):
+    package = EPUBPackage(write_epub(tmp_path / "book.epub"))
+
+    assert package.updated_opf({"title": "Old Title", "authors": "Old Author", "publisher": "Unknown"}) is None
+
+
+def test_only_changed_elements_are_touched(tmp_path):
+    package = EPUBPackage(write_epub(tmp_path / "book.epub"))
+
+    opf = package.updated_opf({"title": "New Title", "ISBN": "9780306406157"}).decode("utf-8")
+
+    assert opf == OPF.replace("Old Title", "New Title").replace(
+        "</metadata>", "  <dc:identifier>urn:isbn:9780306406157</dc:identifier>\n  </metadata>"
+    )
+
+
+def test_elements_use_the_documents_prefix(tmp_path):
+    opf = OPF.replace("xmlns:dc=", "xmlns:d=").replace("<dc:", "<d:").replace("</dc:", "</d:")
+    package = EPUBPackage(write_epub(tmp_path / "book.epub", opf))
+
+    updated = package.updated_opf({"publisher": "Press"})
+
+    assert b"<d:publisher>Press</d:publisher>" in updated
+    assert dc_text(updated, "publisher") == ["Press"]
+
+
+def test_written_archive_is_valid_and_keeps_other_entries(tmp_path):
+    source = write_epub(tmp_path / "book.epub")
+    output = str(tmp_path / "out.epub")
+    package = EPUBPackage(source)
+
+    write_opf(source, output, package.opf_path, package.updated_opf({"title": "New Title"}))
+
+    with zipfile.ZipFile(source) as original, zipfile.ZipFile(output) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist()[0] == "mimetype"
+        assert archive.getinfo("mimetype").compress_type == zipfile.ZIP_STORED
+        assert sorted(archive.namelist()) == sorted(original.namelist())
+        chapter, copied = original.getinfo("OEBPS/chapter.xhtml"), archive.getinfo("OEBPS/chapter.xhtml")
+        assert (copied.header_offset, copied.compress_size) == (chapter.header_offset, chapter.compress_size)
+    assert EPUBPackage(output).fields()["title"] == "New Title"
+
+
+def test_attach_metadata_returns_the_written_fields(tmp_path):
+    source = write_epub(tmp_path / "book.epub")
+    output = str(tmp_path / "out.epub")
+
+    info = EPUBManager.attach_metadata_to_epub(source, output, {"title": "New Title", "authors": "First Author"})
+
+    assert info == {"title": "New Title", "authors": "First Author", "language": "en"}
+    assert EPUBPackage(output).authors() == ["First Author"]
@@ -0,0 +1,57 @@
+from PyPDF2 import PdfReader, PdfWriter
+
+from pdf_manager.incremental_update import append_metadata_update
+
+
+def source_pdf(path, pages=3):
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=200, height=300)
+    writer.add_metadata({"/Title": "Old title", "/Creator": "Scanner"})
+    with open(path, "wb") as file:
+        writer.write(file)
+    return str(path)
+
+
+def test_update_is_appended_to_the_original_bytes(tmp_path):
+    source = source_pdf(tmp_path / "in.pdf")
+    output = str(tmp_path / "out.pdf")
+
+    written = append_metadata_update(source, output, {"/Title": "New title", "/Author": "Someone"})
+
+    original = open(source, "rb").read()
+    updated = open(output, "rb").read()
+    assert updated.startswith(original)
+    assert len(updated) == len(original) + written
+
+
+def test_update_replaces_info_and_keeps_other_keys(tmp_path):
+    source = source_pdf(tmp_path / "in.pdf")
+    output = str(tmp_path / "out.pdf")
+
+    append_metadata_update(source, output, {"/Title": "New title", "/Author": "Someone"})
+
+    reader = PdfReader(output)
+    assert reader.metadata["/Title"] == "New title"
+    assert reader.metadata["/Author"] == "Someone"
+    assert reader.metadata["/Creator"] == "Scanner"
+    assert len(reader.pages) == 3
+
+
+def test_update_can_prepend_a_cover_page(tmp_path):
+    source = source_pdf(tmp_path / "in.pdf")
+    output = str(tmp_path / "out.pdf")
+
+    append_metadata_update(source, output, {"/Title": "New title"}, prepend_cover=True)
+
+    reader = PdfReader(output)
+    assert len(reader.pages) == 4
+    assert reader.pages[0].mediabox.height == 300
+
+
+def test_update_in_place(tmp_path):
+    source = source_pdf(tmp_path / "in.pdf")
+
+    append_metadata_update(source, source, {"/Title": "New title"})
+
+    assert PdfReader(source).metadata["/Title"] == "New title"
@@ -0,0 +1,100 @@
+import json
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from pdf_manager import job_queue
+from pdf_manager.job_queue import CallbackURLError, JobQueue, QueueFullError, check_callback_url, pinned_opener
+
+
+@pytest.mark.parametrize("url", [
+    "http://127.0.0.1/callback",
+    "http://[::1]/callback",
+    "http://169.254.169.254/latest/meta-data",
+    "http://10.1.2.3/callback",
+    "http://192.168.0.10:8080/callback",
+    "ftp://203.0.113.10/callback",
+    "file:///etc/passwd",
+    "callback",
+])
+def test_rejects_non_public_callbacks(url):
+    with pytest.raises(CallbackURLError):
+        check_callback_url(url)
+
+
+def test_accepts_public_and_allowlisted_callbacks():
+    assert check_callback_url("https://8.8.8.8/callback") == ["8.8.8.8"]
+    assert check_callback_url("http://10.1.2.3/callback", {"10.1.2.3"}) == []
+    with pytest.raises(CallbackURLError):
+        check_callback_url("https://8.8.8.8/callback", {"callback.invalid"})
+
+
+def test_submit_rejects_callback_before_queueing(tmp_path):
+    queue = JobQueue(lambda payload, report_progress: payload, str(tmp_path / "jobs.sqlite3"))
+    with pytest.raises(CallbackURLError):
+        queue.submit({"file_path": "book.pdf"}, callback_url="http://127.0.0.1:9/")
+    assert queue.stats()["depth"] == 0
+
+
+def test_full_queue_is_refused_before_submitting(tmp_path):
+    queue = JobQueue(lambda payload, report_progress: payload, str(tmp_path / "jobs.sqlite3"), max_depth=1)
+    queue.check_capacity()
+    queue.submit({"file_path": "book.pdf"})
+
+    with pytest.raises(QueueFullError):
+        queue.check_capacity()
+    with pytest.raises(QueueFullError):
+        queue.submit({"file_path": "other.pdf"})
+    assert queue.stats()["depth"] == 1
+
+
+@pytest.fixture
+def callback_server():
+    # Records the Host header and body of each callback it receives
+    received = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            received.append((self.headers["Host"], json.loads(body)))
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server.server_address[1], received
+    server.shutdown()
+    server.server_close()
+
+
+def test_pinned_opener_connects_to_the_checked_address(callback_server):
+    port, received = callback_server
+    # The host doesn't resolve at all; the request still reaches the pinned address under its name
+    request = urllib.request.Request(f"http://callback.invalid:{port}/hook", data=b'{"ok": true}', method="POST")
+
+    with pinned_opener(["127.0.0.1"]).open(request, timeout=5) as response:
+        assert response.status == 204
+    assert received == [(f"callback.invalid:{port}", {"ok": True})]
+
+
+def test_callback_goes_to_the_address_that_passed_the_check(tmp_path, callback_server, monkeypatch):
+    port, received = callback_server
+    checked = []
+
+    def check(url, allowed_hosts=()):
+        checked.append(url)
+        return ["127.0.0.1"]
+
+    # The host doesn't resolve, so the call can only succeed at the address the check returned
+    monkeypatch.setattr(job_queue, "check_callback_url", check)
+    queue = JobQueue(lambda payload, report_progress: payload, str(tmp_path / "jobs.sqlite3"))
+
+    queue._notify(f"http://callback.invalid:{port}/done", {"id": "job", "status": "done"})
+
+    assert checked == [f"http://callback.invalid:{port}/done"]
+    assert received == [(f"callback.invalid:{port}", {"id": "job", "status": "done"})]
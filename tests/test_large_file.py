@@ -0,0 +1,91 @@
+import threading
+import time
+
+from pdf_manager.large_file import MemoryBudget
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def start(budget, amount, admitted, release):
+    """
+    Thread that reserves `amount`, appends it to `admitted` once granted and holds it until `release` is set.
+    """
+    def hold():
+        with budget.reserve(amount):
+            admitted.append(amount)
+            release.wait(5)
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    return thread
+
+
+def test_reservations_are_granted_in_arrival_order():
+    budget = MemoryBudget(100)
+    admitted = []
+    release_first, release_rest = threading.Event(), threading.Event()
+
+    first = start(budget, 60, admitted, release_first)
+    wait_for(lambda: admitted == [60])
+    large = start(budget, 50, admitted, release_rest)
+    wait_for(lambda: budget.stats()["waiting"] == 1)
+    # Fits next to the first job, but arrived after the large one
+    small = start(budget, 10, admitted, release_rest)
+    wait_for(lambda: budget.stats()["waiting"] == 2)
+    time.sleep(0.05)
+    assert admitted == [60]
+
+    release_first.set()
+    wait_for(lambda: len(admitted) == 3)
+    assert admitted == [60, 50, 10]
+    assert budget.stats()["reserved"] == 60
+
+    release_rest.set()
+    for thread in (first, large, small):
+        thread.join()
+    assert budget.stats() == {"total": 100, "reserved": 0, "waiting": 0}
+
+
+def test_job_larger_than_the_budget_runs_alone():
+    budget = MemoryBudget(100)
+    admitted = []
+    release_small, release_large = threading.Event(), threading.Event()
+
+    small = start(budget, 10, admitted, release_small)
+    wait_for(lambda: admitted == [10])
+    large = start(budget, 500, admitted, release_large)
+    wait_for(lambda: budget.stats()["waiting"] == 1)
+    time.sleep(0.05)
+    assert admitted == [10]
+
+    release_small.set()
+    wait_for(lambda: admitted == [10, 500])
+    # Capped at the whole budget, so nothing else fits while it runs
+    assert budget.stats()["reserved"] == 100
+
+    release_large.set()
+    for thread in (small, large):
+        thread.join()
+    assert budget.stats()["reserved"] == 0
+
+
+def test_zero_budget_admits_everything():
+    budget = MemoryBudget(0)
+    with budget.reserve(10 ** 12):
+        with budget.reserve(10 ** 12):
+            assert budget.stats()["reserved"] == 0
+
+
+def test_reservation_is_released_when_the_job_fails():
+    budget = MemoryBudget(100)
+    try:
+        with budget.reserve(80):
+            raise RuntimeError("job failed")
+    except RuntimeError:
+        pass
+    assert budget.stats()["reserved"] == 0
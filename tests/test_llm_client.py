@@ -0,0 +1,47 @@
+import asyncio
+import time
+
+from pdf_manager.llm_client import TokenBucket
+
+
+def timed(coroutine):
+    started = time.monotonic()
+    asyncio.run(coroutine)
+    return time.monotonic() - started
+
+
+def test_full_bucket_does_not_wait():
+    bucket = TokenBucket(600)
+
+    assert timed(bucket.acquire(600)) < 0.05
+    assert bucket.tokens < 1
+
+
+def test_empty_bucket_waits_for_the_refill():
+    bucket = TokenBucket(600)
+
+    async def drain_then_acquire():
+        await bucket.acquire(600)
+        await bucket.acquire(2)
+
+    # 600 per minute refills 10 units a second
+    assert 0.15 <= timed(drain_then_acquire()) < 1
+
+
+def test_requests_larger_than_the_bucket_are_capped():
+    bucket = TokenBucket(60)
+
+    async def oversized():
+        await bucket.acquire(1000)
+
+    assert timed(oversized()) < 0.05
+
+
+def test_refund_returns_unused_tokens():
+    bucket = TokenBucket(600)
+    asyncio.run(bucket.acquire(600))
+
+    bucket.refund(100)
+    assert 100 <= bucket.tokens <= 101
+    bucket.refund(10000)
+    assert bucket.tokens == bucket.capacity
@@ -0,0 +1,64 @@
+from io import BytesIO
+
+from PyPDF2 import PdfReader, PdfWriter
+
+from pdf_manager.local_metadata import LocalMetadataExtractor, find_isbn, isbn_is_valid, split_by_confidence
+from pdf_manager.manager import PDFManager
+
+
+def reader_with_info(info):
+    writer = PdfWriter()
+    writer.add_blank_page(width=200, height=200)
+    writer.add_metadata(info)
+    buffer = BytesIO()
+    writer.write(buffer)
+    buffer.seek(0)
+    return PdfReader(buffer)
+
+
+def test_isbn_checksums():
+    assert isbn_is_valid("9780306406157")
+    assert isbn_is_valid("080442957X")
+    assert not isbn_is_valid("9780306406158")
+    assert find_isbn("Printed in X. ISBN: 978-0-306-40615-7") == ("9780306406157", True)
+    assert find_isbn("order no. 9780306406157") == ("9780306406157", False)
+
+
+def test_clean_info_skips_the_llm():
+    reader = reader_with_info({"/Title": "Designing Data-Intensive Applications", "/Author": "Martin Kleppmann"})
+    fields = LocalMetadataExtractor(reader, "").extract()
+    metadata, missing = split_by_confidence(fields, 0.7)
+    assert metadata["title"] == "Designing Data-Intensive Applications"
+    assert "title" not in missing and "authors" not in missing
+    assert not PDFManager.needs_llm(missing)
+
+
+def test_placeholder_info_is_not_a_fallback():
+    reader = reader_with_info({"/Title": "Microsoft Word - draft3.docx", "/Author": "jsmith"})
+    metadata, missing = split_by_confidence(LocalMetadataExtractor(reader, "").extract(), 0.7)
+    assert "title" not in metadata and "authors" not in metadata
+    assert {"title", "authors"} <= set(missing)
+
+
+def test_weak_values_are_fallbacks_the_llm_can_replace():
+    fields = {"title": ("Cover Title", 0.55), "ISBN": ("9780306406157", 0.95)}
+    metadata, missing = split_by_confidence(fields, 0.7)
+    assert metadata == {"title": "Cover Title", "ISBN": "9780306406157"}
+    assert "title" in missing and "ISBN" not in missing
+
+    # An "Unknown" answer, or a failed call that merges nothing, keeps the fallback
+    PDFManager.merge_llm_metadata(metadata, {"title": "Unknown", "authors": "Ann Author"}, missing)
+    assert metadata["title"] == "Cover Title"
+    assert metadata["authors"] == "Ann Author"
+    PDFManager.merge_llm_metadata(metadata, {"title": "The Real Title"}, missing)
+    assert metadata["title"] == "The Real Title"
+
+
+def test_split_by_confidence_keeps_fallbacks_but_asks_for_them():
+    fields = {"title": ("Clean Title", 0.9), "authors": (["Someone"], 0.5), "publisher": ("Weak", 0.3)}
+
+    metadata, missing = split_by_confidence(fields, 0.7)
+
+    assert metadata == {"title": "Clean Title", "authors": ["Someone"]}
+    assert "title" not in missing
+    assert {"authors", "publisher", "ISBN"} <= set(missing)
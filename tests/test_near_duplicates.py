@@ -0,0 +1,171 @@
+import hashlib
+import shutil
+
+import pytest
+
+from benchmarks.synthetic import SyntheticPDF
+from pdf_manager import manager, metadata_extractor, near_duplicates
+from pdf_manager.manager import PDFManager
+from pdf_manager.near_duplicates import MinHasher, NearDuplicateIndex, shingles, similarity, text_hash
+
+BODY = " ".join(
+    f"Chapter {chapter} explains how replicated logs keep followers consistent with the leader after failure {chapter}."
+    for chapter in range(60)
+)
+OTHER = " ".join(
+    f"Recipe {number} folds butter into the dough and rests it overnight before baking at a high heat {number}."
+    for number in range(60)
+)
+
+
+def test_shingles_ignore_case_and_punctuation():
+    assert shingles("The Quick, brown fox") == shingles("the quick brown FOX!")
+    assert shingles("two words") == {"two words"}
+    assert shingles("") == set()
+
+
+def test_similar_texts_have_similar_signatures():
+    hasher = MinHasher(128)
+    edited = BODY.replace("Chapter 7 ", "Chapter seven ")
+
+    assert similarity(hasher.signature(BODY), hasher.signature(edited)) > 0.9
+    assert similarity(hasher.signature(BODY), hasher.signature(OTHER)) < 0.2
+    assert hasher.signature("") is None
+
+
+def test_signatures_match_the_scalar_hash():
+    hasher = MinHasher(16)
+    hashes = [
+        int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=4).digest(), "little")
+        for shingle in shingles(BODY)
+    ]
+
+    expected = [min(((a * value + b) % 2 ** 64) >> 32 for value in hashes) for a, b in hasher.permutations]
+    assert hasher.signature(BODY) == expected
+    assert MinHasher(16).signature(BODY) == expected
+
+
+def test_short_text_is_not_signed(tmp_path):
+    index = NearDuplicateIndex(str(tmp_path / "index.db"))
+
+    assert index.signature("Copyright (c) 2021 Example Press. All rights reserved.") is None
+
+
+def test_index_finds_near_duplicates_only(tmp_path):
+    index = NearDuplicateIndex(str(tmp_path / "index.db"), num_perm=64, bands=16, threshold=0.8)
+    index.add("log.pdf", index.signature(BODY), {"title": "Replicated Logs"})
+
+    match = index.find(index.signature(BODY + " An extra closing sentence."))
+    assert match["key"] == "log.pdf"
+    assert match["metadata"] == {"title": "Replicated Logs"}
+    assert index.find(index.signature(OTHER)) is None
+
+
+def test_removed_entries_no_longer_match(tmp_path):
+    index = NearDuplicateIndex(str(tmp_path / "index.db"), num_perm=64, bands=16, threshold=0.8)
+    index.add("log.pdf", index.signature(BODY), {"title": "Replicated Logs"})
+
+    assert index.remove("log.pdf")
+    assert index.find(index.signature(BODY)) is None
+    assert not index.remove("log.pdf")
+    assert index.stats()["entries"] == 0
+
+
+def test_entries_from_an_older_signature_version_are_dropped(tmp_path, monkeypatch):
+    path = str(tmp_path / "index.db")
+    index = NearDuplicateIndex(path, num_perm=64, bands=16)
+    index.add("log.pdf", index.signature(BODY), {"title": "Replicated Logs"})
+    index.connection.close()
+
+    monkeypatch.setattr(near_duplicates, "SIGNATURE_VERSION", near_duplicates.SIGNATURE_VERSION + 1)
+    index = NearDuplicateIndex(path, num_perm=64, bands=16)
+
+    assert index.stats()["entries"] == 0
+    assert index.connection.execute("SELECT COUNT(*) FROM buckets").fetchone()[0] == 0
+
+
+def test_books_added_later_are_signed_in_the_background(tmp_path):
+    index = NearDuplicateIndex(str(tmp_path / "index.db"), num_perm=64, bands=16, threshold=0.8)
+
+    index.add_later("log.pdf", lambda: BODY, {"title": "Replicated Logs"})
+    index.add_later("recipes.pdf", lambda: OTHER, {"title": "Recipes"})
+    index.remove("recipes.pdf")
+    index.wait()
+
+    assert index.find(index.signature(BODY))["key"] == "log.pdf"
+    # Removed while still queued, so it is never added
+    assert index.find(index.signature(OTHER)) is None
+    assert index.stats()["pending"] == 0
+
+
+def test_match_is_exact_only_for_the_same_text(tmp_path):
+    index = NearDuplicateIndex(str(tmp_path / "index.db"), num_perm=64, bands=16, threshold=0.8)
+    index.add("log.pdf", index.signature(BODY), {"title": "Replicated Logs"}, text_hash(BODY))
+    edited = BODY + " An extra closing sentence."
+
+    assert index.find(index.signature(BODY), text_hash(BODY.upper()))["exact"]
+    assert not index.find(index.signature(edited), text_hash(edited))["exact"]
+
+
+def test_near_match_does_not_lend_title_or_isbn():
+    duplicate = {
+        "exact": False,
+        "metadata": {"title": "Other Book", "ISBN": "9780306406157", "publisher": "Example Press", "language": "Unknown"},
+    }
+
+    metadata, missing = PDFManager.reuse_near_duplicate(duplicate, {}, ["title", "ISBN", "publisher", "language"])
+
+    assert metadata == {"publisher": "Example Press"}
+    assert missing == ["title", "ISBN", "language"]
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    index = NearDuplicateIndex(str(tmp_path / "index.db"))
+    monkeypatch.setattr(manager, "get_near_duplicate_index", lambda: index)
+    monkeypatch.setattr(metadata_extractor, "get_page_text_cache", lambda: None)
+    return index
+
+
+def register(index, path, title):
+    pdf_manager = PDFManager(str(path), n_pages=5)
+    pdf_manager.register_near_duplicate(str(path), {"title": title, "ISBN": "9780306406157"})
+    index.wait()
+
+
+def test_books_with_the_same_front_matter_are_not_duplicates(tmp_path, index):
+    # Same title and copyright pages, different body text
+    first, second = tmp_path / "first.pdf", tmp_path / "second.pdf"
+    SyntheticPDF(pages=40, seed=1, book_id=7).write(str(first))
+    SyntheticPDF(pages=40, seed=2, book_id=7).write(str(second))
+    register(index, first, "First Book")
+
+    pdf_manager = PDFManager(str(second), n_pages=5)
+    assert pdf_manager.find_near_duplicate() is None
+    assert pdf_manager.duplicate_of is None
+
+
+def test_copy_of_a_book_reuses_all_its_metadata(tmp_path, index):
+    original, copy = tmp_path / "original.pdf", tmp_path / "copy.pdf"
+    SyntheticPDF(pages=40, seed=1).write(str(original))
+    shutil.copyfile(original, copy)
+    register(index, original, "First Book")
+
+    _, metadata, missing = PDFManager(str(copy), n_pages=5).collect_local_metadata()
+
+    assert metadata["title"] == "First Book"
+    assert metadata["ISBN"] == "9780306406157"
+    assert missing == []
+
+
+def test_no_lookup_when_local_metadata_is_enough(tmp_path, index, monkeypatch):
+    original, copy = tmp_path / "original.pdf", tmp_path / "copy.pdf"
+    SyntheticPDF(pages=40, seed=1).write(str(original))
+    shutil.copyfile(original, copy)
+    register(index, original, "First Book")
+    monkeypatch.setattr(PDFManager, "needs_llm", staticmethod(lambda missing_fields: False))
+
+    _, metadata, _ = PDFManager(str(copy), n_pages=5).collect_local_metadata()
+
+    assert index.stats()["lookups"] == 0
+    assert metadata.get("title") != "First Book"
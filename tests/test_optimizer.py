@@ -0,0 +1,135 @@
+import random
+
+from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.generic import DecodedStreamObject, DictionaryObject, NameObject, NumberObject
+
+from pdf_manager.optimizer import PDFOptimizer
+
+CONTENT = b"q 200 0 0 300 0 0 cm /Im0 Do Q\n" + b"BT /F1 12 Tf 20 20 Td (Some page text) Tj ET\n" * 40
+
+
+def image_stream(size=300):
+    image = DecodedStreamObject()
+    # Noise, so that JPEG beats Flate
+    image.set_data(random.Random(size).randbytes(size * size * 3))
+    image.update({
+        NameObject("/Type"): NameObject("/XObject"),
+        NameObject("/Subtype"): NameObject("/Image"),
+        NameObject("/Width"): NumberObject(size),
+        NameObject("/Height"): NumberObject(size),
+        NameObject("/ColorSpace"): NameObject("/DeviceRGB"),
+        NameObject("/BitsPerComponent"): NumberObject(8),
+    })
+    return image
+
+
+def font(name):
+    return DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject(name),
+    })
+
+
+def wasteful_pdf(path, pages=3):
+    """
+    PDF with something for each lossless step: every page has its own copy of the same image, a font
+    its content never uses, and an uncompressed content stream.
+    """
+    writer = PdfWriter()
+    for index in range(pages):
+        writer.add_blank_page(width=200, height=300)
+        page = writer.pages[index]
+        page[NameObject("/Resources")] = DictionaryObject({
+            NameObject("/Font"): DictionaryObject({
+                NameObject("/F1"): writer._add_object(font("/Helvetica")),
+                NameObject("/F2"): writer._add_object(font("/Courier")),
+            }),
+            NameObject("/XObject"): DictionaryObject({NameObject("/Im0"): writer._add_object(image_stream())}),
+        })
+        content = DecodedStreamObject()
+        content.set_data(CONTENT)
+        page[NameObject("/Contents")] = writer._add_object(content)
+    with open(path, "wb") as file:
+        writer.write(file)
+    return str(path)
+
+
+def steps(report):
+    return {step["step"]: step for step in report["steps"]}
+
+
+def test_lossless_steps_each_save_bytes(tmp_path):
+    source = wasteful_pdf(tmp_path / "book.pdf")
+    output = str(tmp_path / "out.pdf")
+
+    report = PDFOptimizer(source).run(output)
+
+    by_step = steps(report)
+    assert by_step["dedupe"]["saved"] > 0
+    assert by_step["prune_resources"]["saved"] > 0
+    assert by_step["compress_streams"]["saved"] > 0
+    assert report["written"]
+    assert report["final_bytes"] == len(open(output, "rb").read())
+
+
+def test_output_stays_readable(tmp_path):
+    source = wasteful_pdf(tmp_path / "book.pdf")
+    output = str(tmp_path / "out.pdf")
+
+    PDFOptimizer(source).run(output)
+
+    reader = PdfReader(output)
+    assert len(reader.pages) == 3
+    for page in reader.pages:
+        assert page.get_contents().get_data() == CONTENT
+        assert list(page["/Resources"]["/Font"].keys()) == ["/F1"]
+        assert page["/Resources"]["/XObject"]["/Im0"]["/Width"] == 300
+    # The three copies of the image were merged into one object
+    images = {page["/Resources"]["/XObject"].raw_get("/Im0").idnum for page in reader.pages}
+    assert len(images) == 1
+
+
+def test_lazy_mode_writes_the_same_file(tmp_path):
+    source = wasteful_pdf(tmp_path / "book.pdf")
+    eager, lazy = str(tmp_path / "eager.pdf"), str(tmp_path / "lazy.pdf")
+
+    eager_report = PDFOptimizer(source, dpi=72).run(eager)
+    lazy_report = PDFOptimizer(source, dpi=72, lazy=True).run(lazy)
+
+    assert open(eager, "rb").read() == open(lazy, "rb").read()
+    assert eager_report["steps"] == lazy_report["steps"]
+
+
+def test_images_are_downsampled_to_page_size(tmp_path):
+    source = wasteful_pdf(tmp_path / "book.pdf")
+    output = str(tmp_path / "out.pdf")
+
+    report = PDFOptimizer(source, dpi=72).run(output)
+
+    assert steps(report)["downsample_images"]["images"] == 1
+    image = PdfReader(output).pages[0]["/Resources"]["/XObject"]["/Im0"]
+    # 200 x 300 points at 72 dpi: the 300 px square image fits in 200 px
+    assert image["/Width"] == 200
+    assert image["/Filter"] == "/DCTDecode"
+
+
+def test_steps_stop_once_the_budget_is_met(tmp_path):
+    source = wasteful_pdf(tmp_path / "book.pdf")
+
+    report = PDFOptimizer(source, target_bytes=10 ** 9, dpi=72).run(str(tmp_path / "out.pdf"))
+
+    assert [step["step"] for step in report["steps"]] == ["rewrite"]
+    assert report["met_target"]
+
+
+def test_input_is_left_alone_when_nothing_shrinks(tmp_path):
+    source = wasteful_pdf(tmp_path / "book.pdf")
+    PDFOptimizer(source).run(source)
+    output = tmp_path / "out.pdf"
+
+    report = PDFOptimizer(source).run(str(output))
+
+    assert not report["written"]
+    assert report["output"] == source
+    assert not output.exists()
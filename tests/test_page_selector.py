@@ -0,0 +1,59 @@
+from PyPDF2 import PdfReader
+
+from benchmarks.synthetic import SyntheticPDF
+from pdf_manager.page_selector import PageTextSelector, candidate_pages, estimate_tokens
+from pdf_manager.page_text import PageTextCache
+
+
+def select(path, **options):
+    selector = PageTextSelector(PdfReader(str(path)), 5, token_budget=options.pop("token_budget", 1500), **options)
+    return selector.select()
+
+
+def test_candidates_alternate_front_and_back():
+    assert candidate_pages(10, 3) == [0, 9, 1, 8, 2, 7]
+    assert candidate_pages(3, 5) == [0, 2, 1]
+
+
+def test_title_page_after_image_cover_is_kept(tmp_path):
+    path = tmp_path / "book.pdf"
+    SyntheticPDF(pages=50, image_cover=True, book_id=1).write(str(path))
+    text = select(path, signal_target=10)
+    assert "The Synthetic Handbook 1" in text
+    assert "ISBN 978-0-306-40615-7" in text
+
+
+def test_front_matter_without_signals_gets_a_share_of_the_budget(tmp_path):
+    path = tmp_path / "book.pdf"
+    SyntheticPDF(pages=50, image_cover=False, book_id=2).write(str(path))
+    # Page 0 is body text here; it is kept, but cut to a quarter of the budget
+    text = select(path, signal_target=10, token_budget=400)
+    assert estimate_tokens(text) <= 400 + 2
+    assert "ISBN" in text
+
+
+def test_known_hash_keys_the_cache_without_hashing(tmp_path, monkeypatch):
+    path = tmp_path / "book.pdf"
+    SyntheticPDF(pages=20, book_id=3).write(str(path))
+    cache = PageTextCache(str(tmp_path / "cache.db"))
+
+    def no_hashing(path):
+        raise AssertionError("the file was hashed again")
+
+    monkeypatch.setattr(cache, "file_hash", no_hashing)
+    first = select(path, file_path=str(path), cache=cache, file_hash="upload-hash")
+    selector = PageTextSelector(PdfReader(str(path)), 5, file_path=str(path), cache=cache, file_hash="upload-hash")
+
+    assert selector.select() == first
+    assert selector.pages_extracted == 0
+    assert selector.pages_cached > 0
+
+
+def test_few_candidate_pages_are_extracted_in_process(tmp_path):
+    path = tmp_path / "book.pdf"
+    SyntheticPDF(pages=20, book_id=4).write(str(path))
+    selector = PageTextSelector(PdfReader(str(path)), 5, file_path=str(path), workers=4, pool_min_pages=40)
+
+    selector.select()
+
+    assert selector.workers == 1
@@ -0,0 +1,73 @@
+import hashlib
+import os
+import threading
+
+import pytest
+
+from pdf_manager.resumable_upload import ResumableUploads, UploadConflictError
+
+DATA = os.urandom(256 * 1024)
+
+
+def new_uploads(tmp_path):
+    return ResumableUploads(str(tmp_path / "uploads.db"), str(tmp_path / "uploads"))
+
+
+def finish(uploads, upload_id, tmp_path):
+    return uploads.finish(upload_id, str(tmp_path / "book.pdf"))
+
+
+def test_out_of_order_chunks_hash_the_whole_file(tmp_path):
+    uploads = new_uploads(tmp_path)
+    upload_id = uploads.create("book.pdf", len(DATA))["upload_id"]
+    half = len(DATA) // 2
+
+    assert uploads.write_chunk(upload_id, half, [DATA[half:]])["offset"] == 0
+    assert uploads.write_chunk(upload_id, 0, [DATA[:half]])["offset"] == len(DATA)
+
+    assert finish(uploads, upload_id, tmp_path)["sha256"] == hashlib.sha256(DATA).hexdigest()
+
+
+def test_parallel_chunks_are_serialized(tmp_path):
+    uploads = new_uploads(tmp_path)
+    upload_id = uploads.create("book.pdf", len(DATA))["upload_id"]
+    size = len(DATA) // 8
+    offsets = list(range(0, len(DATA), size))
+
+    def send(offset):
+        writer = uploads.open_chunk(upload_id, offset)
+        try:
+            for start in range(offset, offset + size, 4096):
+                writer.write(DATA[start:start + 4096])
+        finally:
+            writer.close()
+
+    threads = [threading.Thread(target=send, args=(offset,)) for offset in reversed(offsets)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert finish(uploads, upload_id, tmp_path)["sha256"] == hashlib.sha256(DATA).hexdigest()
+
+
+def test_chunk_over_hashed_bytes_is_refused(tmp_path):
+    uploads = new_uploads(tmp_path)
+    upload_id = uploads.create("book.pdf", len(DATA))["upload_id"]
+    uploads.write_chunk(upload_id, 0, [DATA[:1000]])
+
+    with pytest.raises(UploadConflictError):
+        uploads.open_chunk(upload_id, 500)
+    # The refused chunk released the upload's lock
+    uploads.write_chunk(upload_id, 1000, [DATA[1000:]])
+    assert finish(uploads, upload_id, tmp_path)["sha256"] == hashlib.sha256(DATA).hexdigest()
+
+
+def test_hash_is_rebuilt_after_restart(tmp_path):
+    uploads = new_uploads(tmp_path)
+    upload_id = uploads.create("book.pdf", len(DATA))["upload_id"]
+    uploads.write_chunk(upload_id, 0, [DATA[:1000]])
+
+    restarted = new_uploads(tmp_path)
+    assert restarted.write_chunk(upload_id, 1000, [DATA[1000:]])["offset"] == len(DATA)
+    assert finish(restarted, upload_id, tmp_path)["sha256"] == hashlib.sha256(DATA).hexdigest()
@@ -0,0 +1,135 @@
+import os
+import types
+
+import pytest
+
+from pdf_manager import retention
+from pdf_manager.retention import RetentionManager
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Time as the retention module sees it; tests move it forward by hand
+    now = types.SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(retention, "time", types.SimpleNamespace(time=lambda: now.value))
+    return now
+
+
+def write(directory, name, size=100):
+    path = os.path.join(directory, name)
+    with open(path, "wb") as file:
+        file.write(b"x" * size)
+    return path
+
+
+@pytest.fixture
+def library(tmp_path):
+    directory = tmp_path / "library"
+    directory.mkdir()
+    return str(directory)
+
+
+def manager(tmp_path, library, quota, evicted=None, **kwargs):
+    on_evict = (lambda directory, name: evicted.append(name)) if evicted is not None else None
+    return RetentionManager(str(tmp_path / "retention.db"), {library: quota}, on_evict=on_evict, **kwargs)
+
+
+def test_least_recently_used_files_are_evicted_first(tmp_path, library, clock):
+    evicted = []
+    retention_manager = manager(tmp_path, library, 300, evicted, grace_seconds=60)
+    for name in ("a.pdf", "b.pdf", "c.pdf"):
+        retention_manager.track(write(library, name))
+        clock.value += 10
+    # Reading a moves it behind b and c
+    retention_manager.touch(os.path.join(library, "a.pdf"))
+
+    clock.value += 1000
+    assert retention_manager.track(write(library, "d.pdf")) == ["b.pdf"]
+
+    assert sorted(os.listdir(library)) == ["a.pdf", "c.pdf", "d.pdf"]
+    assert evicted == ["b.pdf"]
+    stats = retention_manager.stats()
+    assert stats["evicted"] == 1 and stats["evicted_bytes"] == 100
+    assert stats["directories"][library]["bytes"] == 300
+
+
+def test_pinned_and_recently_used_files_are_kept(tmp_path, library, clock):
+    retention_manager = manager(tmp_path, library, 250, grace_seconds=60)
+    for name, mtime in (("pinned.pdf", 100), ("old.pdf", 200), ("recent.pdf", 980)):
+        os.utime(write(library, name), (mtime, mtime))
+    retention_manager.sweep(library)
+
+    with retention_manager.pin(os.path.join(library, "pinned.pdf")):
+        evicted = retention_manager.track(write(library, "new.pdf"))
+
+    # Still over quota: everything left is pinned, within the grace period or just written
+    assert evicted == ["old.pdf"]
+    assert sorted(os.listdir(library)) == ["new.pdf", "pinned.pdf", "recent.pdf"]
+    assert retention_manager.stats()["pinned"] == 0
+
+
+def test_directories_without_a_quota_are_left_alone(tmp_path, library, clock):
+    other = tmp_path / "other"
+    other.mkdir()
+    retention_manager = manager(tmp_path, library, 100, grace_seconds=0)
+    for name in ("a.pdf", "b.pdf"):
+        retention_manager.track(write(str(other), name))
+        clock.value += 10
+    assert retention_manager.enforce(str(other)) == []
+    assert sorted(os.listdir(other)) == ["a.pdf", "b.pdf"]
+
+
+def test_sweep_indexes_the_directory_in_batches(tmp_path, library, clock, monkeypatch):
+    retention_manager = manager(tmp_path, library, 10 ** 6)
+    for name in ("known-1.pdf", "known-2.pdf"):
+        retention_manager.track(write(library, name))
+    gone = write(library, "gone.pdf")
+    retention_manager.track(gone)
+    os.remove(gone)
+    for index in range(5):
+        write(library, f"new-{index}.pdf", size=50)
+    write(library, ".upload.part")
+    os.mkdir(os.path.join(library, "subdirectory"))
+
+    batches = []
+    add_unknown = retention_manager._add_unknown
+
+    def recording(directory, entries):
+        batches.append(len(entries))
+        return add_unknown(directory, entries)
+
+    monkeypatch.setattr(retention_manager, "_add_unknown", recording)
+    assert retention_manager.sweep(library, batch_size=3) == {"added": 5, "removed": 1}
+
+    assert batches == [3, 3, 1]
+    directory = retention_manager.stats()["directories"][library]
+    assert directory["files"] == 7
+    assert directory["bytes"] == 2 * 100 + 5 * 50
+    # A second sweep has nothing to do
+    assert retention_manager.sweep(library, batch_size=3) == {"added": 0, "removed": 0}
+
+
+def test_swept_files_are_evicted_before_files_read_since(tmp_path, library, clock):
+    retention_manager = manager(tmp_path, library, 250, grace_seconds=60)
+    outside = write(library, "outside.pdf")
+    os.utime(outside, (500, 500))
+    retention_manager.sweep(library)
+    retention_manager.track(write(library, "tracked.pdf"))
+
+    clock.value += 1000
+    assert retention_manager.track(write(library, "new.pdf")) == ["outside.pdf"]
+
+
+def test_expire_skips_pinned_files(tmp_path, library, clock):
+    evicted = []
+    retention_manager = manager(tmp_path, library, 0, evicted, max_age_seconds=60)
+    for name in ("a.pdf", "b.pdf"):
+        path = write(library, name)
+        os.utime(path, (100, 100))
+        retention_manager.track(path)
+
+    with retention_manager.pin(os.path.join(library, "b.pdf")):
+        assert retention_manager.expire() == 1
+
+    assert evicted == ["a.pdf"]
+    assert os.listdir(library) == ["b.pdf"]